@@ -6,3 +6,41 @@ load_dotenv()
 
 
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+# "auto" lets each library move from an exact scan to an ANN engine as it grows.
+DEFAULT_INDEX_TYPE = os.getenv("VECTORDB_INDEX_TYPE", "auto")
+WAL_FSYNC = os.getenv("VECTORDB_WAL_FSYNC", "always")
+CHECKPOINT_INTERVAL = float(os.getenv("VECTORDB_CHECKPOINT_INTERVAL", "60"))
+# How often the background compactor rebuilds indexes (HNSW graphs) that have piled up deletes.
+COMPACT_INTERVAL = float(os.getenv("VECTORDB_COMPACT_INTERVAL", "10"))
+# How often auto-indexed libraries re-plan their engine (and build a new one in the background).
+INDEX_MANAGER_INTERVAL = float(os.getenv("VECTORDB_INDEX_MANAGER_INTERVAL", "5"))
+STORAGE_PATH = os.getenv("VECTORDB_STORAGE_PATH", "data/vectordb")
+# Set when several worker processes serve the same storage path (e.g. uvicorn --workers N).
+SHARED_STORAGE = os.getenv("VECTORDB_SHARED", "false").lower() in ("1", "true", "yes")
+SYNC_INTERVAL = float(os.getenv("VECTORDB_SYNC_INTERVAL", "0.05"))
+# Number of shard worker processes; 0 serves everything from one in-process database.
+SHARDS = int(os.getenv("VECTORDB_SHARDS", "0"))
+SHARD_CONNECTIONS = int(os.getenv("VECTORDB_SHARD_CONNECTIONS", "4"))
+# A library is hash-partitioned over another shard for every this many chunks it holds.
+SHARD_PARTITION_CHUNKS = int(os.getenv("VECTORDB_SHARD_PARTITION_CHUNKS", "1000000"))
+REBALANCE_INTERVAL = float(os.getenv("VECTORDB_REBALANCE_INTERVAL", "300"))
+# Filters matching at most this fraction of a library are searched by exact scan of the matches.
+FILTER_PREFILTER_RATIO = float(os.getenv("VECTORDB_FILTER_PREFILTER_RATIO", "0.1"))
+# Search results cached per (library, query, k, filters); 0 entries turns the cache off.
+RESULT_CACHE_SIZE = int(os.getenv("VECTORDB_RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_TTL = float(os.getenv("VECTORDB_RESULT_CACHE_TTL", "300"))
+# Requests slower than this many seconds are logged with their per-stage breakdown; 0 turns the profiler off.
+SLOW_QUERY_SECONDS = float(os.getenv("VECTORDB_SLOW_QUERY_SECONDS", "0"))
+# Fraction of requests the profiler traces.
+PROFILE_SAMPLE_RATE = float(os.getenv("VECTORDB_PROFILE_SAMPLE_RATE", "1"))
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "cohere")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "embed-english-v3.0")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "96"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "1024"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "30"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+EMBEDDING_MAX_CONNECTIONS = int(os.getenv("EMBEDDING_MAX_CONNECTIONS", "20"))
@@ -0,0 +1,41 @@
+from typing import Dict, List, Sequence, Tuple
+
+from app.core.indexing.auto import AutoIndex
+from app.core.indexing.bm25 import BM25Index
+from app.core.indexing.flat import FlatIndex
+from app.core.indexing.hnsw import HNSWIndex
+from app.core.indexing.inf import IVFIndex
+from app.core.indexing.lsh import LSHIndex
+from app.core.indexing.metadata import FilterMatch, MetadataIndex, filtered_search
+from app.core.indexing.quantization import ProductQuantizer, QuantizedIndex, ScalarQuantizer
+
+INDEX_TYPES = {
+    "auto": AutoIndex,
+    "flat": FlatIndex,
+    "hnsw": HNSWIndex,
+    "ivf": IVFIndex,
+    "lsh": LSHIndex,
+    "quantized": QuantizedIndex,
+}
+
+
+def create_index(index_type: str, params: dict = None):
+    index_cls = INDEX_TYPES.get(index_type)
+    if index_cls is None:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {sorted(INDEX_TYPES)}")
+    try:
+        return index_cls(**(params or {}))
+    except TypeError as e:
+        raise ValueError(f"Invalid parameters for '{index_type}' index: {e}")
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[Tuple[str, float]]], k: int = 60) -> List[Tuple[str, float]]:
+    """Merge best-first rankings by summing ``1 / (k + rank)`` per id (Cormack et al. 2009).
+
+    Only ranks are used, so rankings with incomparable scores (cosine, BM25) fuse cleanly.
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (item_id, _) in enumerate(ranking, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
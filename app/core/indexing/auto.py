@@ -0,0 +1,270 @@
+import datetime
+from collections import deque
+from time import perf_counter
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.indexing.flat import FlatIndex
+
+# Per approximate engine: the search-time parameter that trades latency for recall, its default and its ceiling.
+RECALL_KNOBS = {"hnsw": ("ef", 64, 1024), "ivf": ("nprobe", 8, 256)}
+# Approximate hits scoring within this of the exact k-th best count as correct.
+RECALL_TOLERANCE = 1e-5
+# Latency percentiles need at least this many timed searches.
+MIN_TIMED_SEARCHES = 20
+
+
+class AutoIndex:
+    """Vector index that picks its engine and parameters for one library.
+
+    Up to ``flat_max`` vectors, searches are an exact scan (``FlatIndex``).
+    The ``ann`` engine ("hnsw" or "ivf", built with ``ann_params``) takes over
+    past that size, or earlier, once at least ``min_ann`` vectors are scanned
+    slower than ``latency_ms`` at the 95th percentile. It hands back to the
+    exact scan if the library shrinks below ``min_ann``.
+
+    Every ``sample_every``-th search on an approximate engine is kept as a
+    sample, and ``measure_recall`` compares its hits with an exact search: a
+    hit counts when it scores at least the exact k-th best, so an equally
+    scored id in place of the exact one is not a miss.
+    The engine's recall knob (HNSW ``ef``, IVF ``nprobe``) is doubled while
+    recall is under ``target_recall``, and halved back while recall has
+    headroom and latency is over target.
+
+    ``plan`` only decides. The database builds the planned engine in the
+    background while this one keeps serving: ``begin_build`` starts a journal
+    of the writes made meanwhile, and ``finish_build`` replays it onto the new
+    engine and swaps that in.
+    """
+
+    def __init__(
+        self,
+        flat_max: int = 20_000,
+        min_ann: int = 1_000,
+        ann: str = "hnsw",
+        ann_params: Optional[dict] = None,
+        target_recall: float = 0.95,
+        latency_ms: float = 10.0,
+        sample_every: int = 50,
+        samples: int = 16,
+    ):
+        if ann not in RECALL_KNOBS:
+            raise ValueError(f"ann must be one of {sorted(RECALL_KNOBS)}")
+        if not 0 < min_ann <= flat_max:
+            raise ValueError("min_ann must be positive and at most flat_max")
+        if not 0 < target_recall <= 1:
+            raise ValueError("target_recall must be in (0, 1]")
+        self.flat_max = flat_max
+        self.min_ann = min_ann
+        self.ann = ann
+        self.ann_params = ann_params or {}
+        self.target_recall = target_recall
+        self.latency_ms = latency_ms
+        self.sample_every = max(sample_every, 1)
+        self.max_samples = samples
+        self.engine = "flat"
+        self.params: dict = {}
+        # The engine and its search parameters, swapped together in one assignment.
+        self.serving: Tuple[object, dict] = (FlatIndex(), {})
+        self.recall: Optional[float] = None
+        self.builds = 0
+        self._reset_observations()
+
+    def _reset_observations(self):
+        self._latencies: deque = deque(maxlen=256)
+        self._samples: deque = deque(maxlen=self.max_samples)
+        self._searches = 0
+        self._journal: Optional[List[Tuple[str, Optional[np.ndarray]]]] = None
+        self._replayed = 0
+        self.build: Optional[dict] = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        # Observations and an unfinished build are not worth keeping across restarts.
+        for key in ("_latencies", "_samples", "_searches", "_journal", "_replayed", "build"):
+            del state[key]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._reset_observations()
+
+    def __len__(self) -> int:
+        return len(self.serving[0])
+
+    def __contains__(self, vector_id: str) -> bool:
+        return vector_id in self.serving[0]
+
+    @property
+    def latency_p95(self) -> Optional[float]:
+        """95th percentile of the recent search latencies, in milliseconds."""
+        latencies = list(self._latencies)
+        if len(latencies) < MIN_TIMED_SEARCHES:
+            return None
+        return float(np.percentile(latencies, 95)) * 1000
+
+    # Writes go to the serving engine and, while a build runs, to the journal.
+    def add_vector(self, vector: List[float], vector_id: str):
+        self.serving[0].add_vector(vector, vector_id)
+        if self._journal is not None:
+            self._journal.append((vector_id, vector))
+
+    def update_vector(self, vector: List[float], vector_id: str):
+        self.serving[0].update_vector(vector, vector_id)
+        if self._journal is not None:
+            self._journal.append((vector_id, vector))
+
+    def remove_vector(self, vector_id: str) -> bool:
+        removed = self.serving[0].remove_vector(vector_id)
+        if self._journal is not None:
+            self._journal.append((vector_id, None))
+        return removed
+
+    def search(self, query: List[float], k: int = 5) -> List[Tuple[str, float]]:
+        index, params = self.serving
+        start = perf_counter()
+        hits = index.search(query, k, **params)
+        self._latencies.append(perf_counter() - start)
+        if self.engine in RECALL_KNOBS:
+            self._searches += 1
+            if self._searches % self.sample_every == 0:
+                self._samples.append((query, k))
+        return hits
+
+    def search_subset(self, query: List[float], vector_ids: List[str], k: int = 5) -> List[Tuple[str, float]]:
+        return self.serving[0].search_subset(query, vector_ids, k)
+
+    def search_batch(self, queries: np.ndarray, k: int = 5) -> List[List[Tuple[str, float]]]:
+        index, params = self.serving
+        if not params and hasattr(index, "search_batch"):
+            return index.search_batch(queries, k)
+        return [index.search(query, k, **params) for query in queries]
+
+    def measure_recall(self, vector_ids: Callable[[], Sequence[str]]):
+        """Score the sampled searches against an exact search over ``vector_ids()``
+        (called only if there are samples) and update ``recall``."""
+        if not self._samples:
+            return
+        index, params = self.serving
+        ids = list(vector_ids())
+        found = expected = 0
+        while self._samples:
+            query, k = self._samples.popleft()
+            exact = index.search_subset(query, ids, k)
+            if not exact:
+                continue
+            # A hit scoring as well as the exact k-th is as good as the id it displaced, as with ties.
+            cutoff = exact[-1][1] - RECALL_TOLERANCE
+            found += min(sum(score >= cutoff for _, score in index.search(query, k, **params)), len(exact))
+            expected += len(exact)
+        if expected:
+            self.recall = found / expected
+
+    def plan(self) -> Optional[Tuple[str, dict]]:
+        """The engine and build parameters to switch to, or None to keep the
+        current engine (whose recall knob may have been retuned in place)."""
+        if self.build is not None:
+            return None
+        n = len(self)
+        latency = self.latency_p95
+        if self.engine == "flat":
+            if n > self.flat_max or (n >= self.min_ann and latency is not None and latency > self.latency_ms):
+                return self.ann, self._ann_params(n)
+            return None
+        if n < self.min_ann:
+            return "flat", {}
+        index, params = self.serving
+        if getattr(index, "needs_compaction", False):
+            return self.engine, self.params
+
+        knob, default, ceiling = RECALL_KNOBS[self.engine]
+        base = self.params.get(knob, default)
+        value = params.get(knob, base)
+        if self.recall is None:
+            return None
+        if self.recall < self.target_recall and value < ceiling:
+            value = min(value * 2, ceiling)
+        elif value > base and self.recall >= min(self.target_recall + 0.04, 1.0) and (latency or 0) > self.latency_ms:
+            value = max(value // 2, base)
+        else:
+            return None
+        self.serving = (index, {knob: value})
+        self.recall = None
+        self._samples.clear()
+        return None
+
+    def _ann_params(self, n: int) -> dict:
+        if self.ann == "hnsw" and n >= 1_000_000:
+            return {"m": 32, **self.ann_params}
+        return dict(self.ann_params)
+
+    def begin_build(self, engine: str, params: dict, total: int):
+        """Start journaling writes for a build of ``engine`` over ``total``
+        vectors; call with writes held off, as the vectors are read."""
+        self._journal = []
+        self._replayed = 0
+        self.build = {
+            "engine": engine,
+            "params": params,
+            "done": 0,
+            "total": total,
+            "started_at": datetime.datetime.now(datetime.UTC).isoformat(),
+        }
+
+    def progress(self, done: int):
+        if self.build is not None:
+            self.build = {**self.build, "done": done}
+
+    def abort_build(self):
+        self._journal = None
+        self.build = None
+
+    def _replay(self, index, stop: int):
+        for vector_id, vector in self._journal[self._replayed : stop]:
+            if vector is None:
+                index.remove_vector(vector_id)
+            elif vector_id in index:
+                index.update_vector(vector, vector_id)
+            else:
+                index.add_vector(vector, vector_id)
+        self._replayed = stop
+
+    def catch_up(self, index, lag: int = 1000, rounds: int = 8):
+        """Replay the writes journaled so far onto ``index`` while writers keep
+        going, until fewer than ``lag`` are left for ``finish_build`` (or
+        ``rounds`` passes have not got there)."""
+        for _ in range(rounds):
+            stop = len(self._journal)
+            if stop - self._replayed < lag:
+                return
+            self._replay(index, stop)
+
+    def finish_build(self, index):
+        """Replay the rest of the journaled writes onto ``index`` (the build
+        started by ``begin_build``) and serve from it; call with writes held off."""
+        self._replay(index, len(self._journal))
+        engine, params = self.build["engine"], self.build["params"]
+        if engine == self.engine:
+            search_params = self.serving[1]  # A rebuild keeps its tuning
+        elif engine in RECALL_KNOBS:
+            knob, default, _ = RECALL_KNOBS[engine]
+            search_params = {knob: params.get(knob, default)}
+        else:
+            search_params = {}
+        self.engine, self.params = engine, params
+        self.serving = (index, search_params)
+        self.recall = None
+        self.builds += 1
+        self._reset_observations()
+
+    def status(self) -> dict:
+        return {
+            "engine": self.engine,
+            "params": self.params,
+            "search_params": self.serving[1],
+            "size": len(self),
+            "recall": self.recall,
+            "latency_p95_ms": self.latency_p95,
+            "build": self.build,
+        }
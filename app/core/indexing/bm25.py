@@ -0,0 +1,296 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.indexing.flat import top_k
+
+TOKEN_PATTERN = re.compile(r"\w+")
+BLOCK_SIZE = 128
+WINDOW = 2048
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+class _Postings:
+    """Ascending document numbers and their term frequencies for one term.
+
+    Postings are grouped into blocks of ``BLOCK_SIZE``; for each block the
+    largest term frequency and the shortest document length are kept, which
+    together bound the BM25 score of anything in the block.
+    """
+
+    __slots__ = ("docs", "tfs", "size", "block_max_tf", "block_min_len")
+
+    def __init__(self):
+        self.docs = np.zeros(4, dtype=np.int32)
+        self.tfs = np.zeros(4, dtype=np.int32)
+        self.size = 0
+        self.block_max_tf: List[int] = []
+        self.block_min_len: List[int] = []
+
+    def append(self, doc: int, tf: int, length: int):
+        if self.size == len(self.docs):
+            self.docs = _grow(self.docs, self.size + 1)
+            self.tfs = _grow(self.tfs, self.size + 1)
+        self.docs[self.size] = doc
+        self.tfs[self.size] = tf
+        if self.size % BLOCK_SIZE == 0:
+            self.block_max_tf.append(tf)
+            self.block_min_len.append(length)
+        else:
+            self.block_max_tf[-1] = max(self.block_max_tf[-1], tf)
+            self.block_min_len[-1] = min(self.block_min_len[-1], length)
+        # Readers bound themselves by ``size``, so it moves only after the posting is written.
+        self.size += 1
+
+
+class _LexicalState:
+    """Document table and postings; replaced wholesale by ``BM25Index.compact``."""
+
+    __slots__ = ("postings", "ids", "terms", "lengths", "alive", "count")
+
+    def __init__(self):
+        self.postings: Dict[str, _Postings] = {}
+        self.ids: List[str] = []
+        self.terms: List[Optional[Dict[str, int]]] = []
+        self.lengths = np.zeros(1024, dtype=np.int32)
+        self.alive = np.zeros(1024, dtype=bool)
+        self.count = 0
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index with block-max WAND style top-k.
+
+    Documents get dense numbers in insertion order, so every posting list is
+    an ascending int32 array and new postings are appends. Removal leaves a
+    tombstone; once tombstones pass ``compact_threshold`` of the documents the
+    postings are rebuilt without them.
+
+    ``search`` splits the document-number space into windows of ``WINDOW``
+    and bounds each window by summing, over the query terms, the best block
+    bound overlapping it. Windows are scored (with numpy) best bound first, and
+    the search stops once no remaining window can beat the current k-th score,
+    so the postings of those windows are never read.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, compact_threshold: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.compact_threshold = compact_threshold
+        self.state = _LexicalState()
+        self.rows: Dict[str, int] = {}
+        self.df: Dict[str, int] = {}
+        self.total_length = 0
+        self.tombstones = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, text_id: str) -> bool:
+        return text_id in self.rows
+
+    def add_text(self, text: str, text_id: str):
+        if text_id in self.rows:
+            self._tombstone(text_id)
+        state = self.state
+        counts = dict(Counter(tokenize(text)))
+        length = sum(counts.values())
+        doc = state.count
+        if doc == len(state.lengths):
+            state.lengths = _grow(state.lengths, doc + 1)
+            state.alive = _grow(state.alive, doc + 1)
+        state.lengths[doc] = length
+        state.alive[doc] = True
+        state.ids.append(text_id)
+        state.terms.append(counts)
+        state.count += 1
+        for term, tf in counts.items():
+            postings = state.postings.get(term)
+            if postings is None:
+                postings = state.postings[term] = _Postings()
+            postings.append(doc, tf, length)
+            self.df[term] = self.df.get(term, 0) + 1
+        self.rows[text_id] = doc
+        self.total_length += length
+        self._maybe_compact()
+
+    def update_text(self, text: str, text_id: str):
+        self.add_text(text, text_id)
+
+    def remove_text(self, text_id: str) -> bool:
+        if not self._tombstone(text_id):
+            return False
+        self._maybe_compact()
+        return True
+
+    def _tombstone(self, text_id: str) -> bool:
+        doc = self.rows.pop(text_id, None)
+        if doc is None:
+            return False
+        state = self.state
+        state.alive[doc] = False
+        for term in state.terms[doc]:
+            self.df[term] -= 1
+            if not self.df[term]:
+                del self.df[term]
+        self.total_length -= int(state.lengths[doc])
+        state.terms[doc] = None
+        self.tombstones += 1
+        return True
+
+    def _maybe_compact(self):
+        if self.tombstones and self.tombstones >= self.compact_threshold * self.state.count:
+            self.compact()
+
+    def compact(self):
+        """Renumber the live documents into fresh postings, dropping tombstones."""
+        old = self.state
+        state = _LexicalState()
+        rows = {}
+        for doc in range(old.count):
+            counts = old.terms[doc]
+            if counts is None:
+                continue
+            new_doc = state.count
+            if new_doc == len(state.lengths):
+                state.lengths = _grow(state.lengths, new_doc + 1)
+                state.alive = _grow(state.alive, new_doc + 1)
+            length = int(old.lengths[doc])
+            state.lengths[new_doc] = length
+            state.alive[new_doc] = True
+            state.ids.append(old.ids[doc])
+            state.terms.append(counts)
+            state.count += 1
+            for term, tf in counts.items():
+                postings = state.postings.get(term)
+                if postings is None:
+                    postings = state.postings[term] = _Postings()
+                postings.append(new_doc, tf, length)
+            rows[old.ids[doc]] = new_doc
+        self.state, self.rows = state, rows
+        self.tombstones = 0
+
+    def idf(self, term: str) -> float:
+        n = len(self.rows)
+        df = self.df.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search_subset(self, query: str, text_ids: List[str], k: int = 5) -> List[Tuple[str, float]]:
+        """BM25 over ``text_ids`` only, scored from their stored term counts."""
+        state = self.state
+        rows = self.rows
+        n = len(rows)
+        if n == 0 or k <= 0:
+            return []
+        avgdl = max(self.total_length / n, 1e-9)
+        k1, b = self.k1, self.b
+        terms = [(term, self.idf(term)) for term in dict.fromkeys(tokenize(query)) if self.df.get(term)]
+
+        found, scores = [], []
+        for text_id in text_ids:
+            doc = rows.get(text_id)
+            # Rows may already belong to a compacted state; the id check catches that.
+            if doc is None or doc >= state.count or state.ids[doc] != text_id:
+                continue
+            counts = state.terms[doc]
+            if counts is None:
+                continue
+            norm = k1 * (1 - b + b * int(state.lengths[doc]) / avgdl)
+            score = 0.0
+            for term, idf in terms:
+                tf = counts.get(term)
+                if tf:
+                    score += idf * tf * (k1 + 1) / (tf + norm)
+            if score > 0:
+                found.append(text_id)
+                scores.append(score)
+        scores = np.asarray(scores)
+        return [(found[i], float(scores[i])) for i in top_k(scores, k)]
+
+    def _block_bounds(self, postings: _Postings, size: int, idf: float, avgdl: float):
+        """First and last document of each block and the block's score upper bound."""
+        n_blocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        first = postings.docs[0:size:BLOCK_SIZE]
+        last = postings.docs[np.minimum(np.arange(1, n_blocks + 1) * BLOCK_SIZE, size) - 1]
+        tf = np.asarray(postings.block_max_tf[:n_blocks], dtype=np.float64)
+        norm = self.k1 * (1 - self.b + self.b * np.asarray(postings.block_min_len[:n_blocks]) / avgdl)
+        return first, last, idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        state = self.state
+        n = len(self.rows)
+        if n == 0 or k <= 0:
+            return []
+        avgdl = max(self.total_length / n, 1e-9)
+        k1, b = self.k1, self.b
+
+        # Sizes are read before the document arrays, so every posting seen has its length and flag.
+        terms = []
+        for term in dict.fromkeys(tokenize(query)):
+            postings = state.postings.get(term)
+            if postings is not None and postings.size and self.df.get(term):
+                terms.append((postings, postings.size, self.idf(term)))
+        if not terms:
+            return []
+        lengths, alive = state.lengths, state.alive
+        count = state.count
+
+        # Upper bound of each window of WINDOW document numbers: per term, the
+        # best block overlapping it, summed over terms.
+        n_windows = (count + WINDOW - 1) // WINDOW
+        window_starts = np.arange(n_windows) * WINDOW
+        bounds = np.zeros(n_windows)
+        for postings, size, idf in terms:
+            first, last, block_bounds = self._block_bounds(postings, size, idf, avgdl)
+            lo = np.searchsorted(last, window_starts)
+            hi = np.searchsorted(first, window_starts + WINDOW)
+            present = lo < hi
+            if present.any():
+                # Max over blocks [lo, hi) per window; the pad keeps hi == n_blocks a valid index.
+                padded = np.append(block_bounds, 0.0)
+                window_max = np.maximum.reduceat(padded, np.column_stack([lo, hi]).ravel())[::2]
+                bounds[present] += window_max[present]
+
+        best_docs = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float64)
+        threshold = 0.0
+        acc = np.zeros(WINDOW)
+        for window in np.argsort(-bounds, kind="stable"):
+            if bounds[window] <= 0 or (len(best_docs) == k and bounds[window] <= threshold):
+                break  # windows are visited best bound first, so nothing left can qualify
+            w_start = int(window_starts[window])
+            acc[:] = 0
+            for postings, size, idf in terms:
+                lo, hi = np.searchsorted(postings.docs[:size], [w_start, w_start + WINDOW])
+                if lo == hi:
+                    continue
+                docs = postings.docs[lo:hi]
+                tf = postings.tfs[lo:hi].astype(np.float64)
+                norm = k1 * (1 - b + b * lengths[docs] / avgdl)
+                acc[docs - w_start] += idf * tf * (k1 + 1) / (tf + norm)
+
+            hits = np.flatnonzero(acc > threshold)
+            hits = hits[alive[hits + w_start]]
+            if not len(hits):
+                continue
+            best_docs = np.concatenate([best_docs, hits + w_start])
+            best_scores = np.concatenate([best_scores, acc[hits]])
+            if len(best_docs) >= k:
+                top = top_k(best_scores, k)
+                best_docs, best_scores = best_docs[top], best_scores[top]
+                threshold = float(best_scores[-1])
+
+        order = top_k(best_scores, k)
+        ids = state.ids
+        return [(ids[doc], float(score)) for doc, score in zip(best_docs[order], best_scores[order])]
@@ -0,0 +1,269 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core import metrics
+
+ALIVE = np.iinfo(np.int64).max
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` largest scores, best first."""
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class _FlatView:
+    """Immutable read view of a ``FlatIndex`` as of ``version``.
+
+    Rows past ``size`` are appended after the view was taken, and a row counts as
+    deleted only if ``deleted_at <= version``, so later writes never change what a
+    view returns.
+    """
+
+    __slots__ = ("matrix", "ids", "rows", "deleted_at", "size", "version", "has_tombstones", "score", "score_batch")
+
+    def __init__(self, matrix, ids, rows, deleted_at, size, version, has_tombstones, score, score_batch):
+        self.matrix = matrix
+        self.ids = ids
+        self.rows = rows
+        self.deleted_at = deleted_at
+        self.size = size
+        self.version = version
+        self.has_tombstones = has_tombstones
+        self.score = score
+        self.score_batch = score_batch
+
+    def search(self, query: List[float], k: int = 5) -> List[Tuple[str, float]]:
+        n = self.size
+        if n == 0 or k <= 0:
+            return []
+
+        scores = self.score(self.matrix[:n], query)
+        metrics.count("scored_vectors", n)
+        if self.has_tombstones:
+            alive = self.deleted_at[:n] > self.version
+            scores = np.where(alive, scores, -np.inf)
+            k = min(k, int(alive.sum()))
+        ids = self.ids
+        return [(ids[i], float(scores[i])) for i in top_k(scores, k)]
+
+    def search_subset(self, query: List[float], vector_ids: List[str], k: int = 5) -> List[Tuple[str, float]]:
+        rows = np.fromiter((row for row in map(self.rows.get, vector_ids) if row is not None), dtype=np.int64)
+        rows = rows[rows < self.size]
+        if self.has_tombstones:
+            rows = rows[self.deleted_at[rows] > self.version]
+        if not len(rows) or k <= 0:
+            return []
+        metrics.count("candidates", len(rows))
+        metrics.count("scored_vectors", len(rows))
+        scores = self.score(self.matrix[rows], query)
+        ids = self.ids
+        return [(ids[rows[i]], float(scores[i])) for i in top_k(scores, k)]
+
+    def search_batch(self, queries: np.ndarray, k: int, block_size: int = 65536) -> List[List[Tuple[str, float]]]:
+        n, m = self.size, len(queries)
+        if n == 0 or k <= 0:
+            return [[] for _ in range(m)]
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-10)
+        k = min(k, n)
+        metrics.count("scored_vectors", n * m)
+
+        # Scored one block of rows at a time, keeping a running top k per query.
+        best_scores = np.zeros((m, 0), dtype=np.float32)
+        best_rows = np.zeros((m, 0), dtype=np.int64)
+        for start in range(0, n, block_size):
+            stop = min(n, start + block_size)
+            scores = self.score_batch(self.matrix[start:stop], queries).T
+            if self.has_tombstones:
+                scores[:, self.deleted_at[start:stop] <= self.version] = -np.inf
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, stop), (m, stop - start))], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores, rows = np.take_along_axis(scores, top, axis=1), np.take_along_axis(rows, top, axis=1)
+            best_scores, best_rows = scores, rows
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        ids = self.ids
+        return [
+            [(ids[row], float(score)) for row, score in zip(rows, scores) if score > -np.inf]
+            for rows, scores in zip(best_rows.tolist(), best_scores.tolist())
+        ]
+
+
+class FlatIndex:
+    """Exact cosine search over a contiguous, pre-normalized float32 matrix.
+
+    ``ids[row]`` maps a row back to its vector id and ``rows`` maps live ids the
+    other way. The matrix grows geometrically so appends are amortized O(1).
+    Removals and updates tombstone the old row (stamping the version at which it
+    died) instead of moving rows, and tombstones are compacted into fresh arrays
+    once they pass ``compact_threshold`` of the rows. Every mutation publishes a
+    new ``_FlatView``; readers search that view and never block on writers.
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024, compact_threshold: float = 0.25):
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self.compact_threshold = compact_threshold
+        self.matrix: Optional[np.ndarray] = None
+        self.deleted_at = np.zeros(0, dtype=np.int64)
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.size = 0
+        self.tombstones = 0
+        self.version = 0
+        self._view = _FlatView(None, self.ids, self.rows, self.deleted_at, 0, 0, False, self._score, self._score_batch)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, vector_id: str) -> bool:
+        return vector_id in self.rows
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_view"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._publish()
+
+    @staticmethod
+    def normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        return vec / (np.linalg.norm(vec) + 1e-10)
+
+    # Row storage hooks; subclasses may store an encoding of each vector instead.
+    def _empty(self, capacity: int) -> np.ndarray:
+        return np.zeros((capacity, self.dim or 0), dtype=np.float32)
+
+    def _encode(self, vec: np.ndarray) -> np.ndarray:
+        return vec
+
+    def _score(self, rows: np.ndarray, query: List[float]) -> np.ndarray:
+        return rows @ self.normalize(query)
+
+    def _score_batch(self, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Scores of ``rows`` (one row each) against normalized ``queries`` (one column each)."""
+        return rows @ queries.T
+
+    def _appended(self, row: int, vec: np.ndarray):
+        """Called after ``vec`` is written at ``row``, before the new view is published."""
+
+    def _compacted(self, live: np.ndarray):
+        """Called by ``compact`` with the old row numbers of the kept rows, in their new order."""
+
+    def _publish(self):
+        self._view = _FlatView(
+            self.matrix,
+            self.ids,
+            self.rows,
+            self.deleted_at,
+            self.size,
+            self.version,
+            self.tombstones > 0,
+            self._score,
+            self._score_batch,
+        )
+
+    def snapshot(self) -> _FlatView:
+        return self._view
+
+    def _reserve(self, size: int):
+        capacity = 0 if self.matrix is None else self.matrix.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, self.initial_capacity, capacity * 2)
+        matrix = self._empty(capacity)
+        deleted_at = np.full(capacity, ALIVE, dtype=np.int64)
+        if self.size:
+            matrix[: self.size] = self.matrix[: self.size]
+            deleted_at[: self.size] = self.deleted_at[: self.size]
+        # New arrays are fully written before they are swapped in; views keep the old ones.
+        self.matrix, self.deleted_at = matrix, deleted_at
+
+    def _tombstone(self, vector_id: str) -> bool:
+        row = self.rows.pop(vector_id, None)
+        if row is None:
+            return False
+        self.deleted_at[row] = self.version + 1
+        self.tombstones += 1
+        return True
+
+    def add_vector(self, vector: List[float], vector_id: str):
+        vec = self.normalize(vector)
+        if self.dim is None:
+            self.dim = vec.shape[0]
+        elif vec.shape[0] != self.dim:
+            raise ValueError(f"Expected vector of dimension {self.dim}, got {vec.shape[0]}")
+
+        self._tombstone(vector_id)
+        row = self.size
+        self._reserve(row + 1)
+        self.matrix[row] = self._encode(vec)
+        self._appended(row, vec)
+        self.ids.append(vector_id)
+        self.rows[vector_id] = row
+        self.size += 1
+        self.version += 1
+        self._maybe_compact()
+        self._publish()
+
+    def update_vector(self, vector: List[float], vector_id: str):
+        self.add_vector(vector, vector_id)
+
+    def remove_vector(self, vector_id: str) -> bool:
+        if not self._tombstone(vector_id):
+            return False
+        self.version += 1
+        self._maybe_compact()
+        self._publish()
+        return True
+
+    def _maybe_compact(self):
+        if self.tombstones and self.tombstones >= self.compact_threshold * self.size:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the live rows into fresh arrays, dropping tombstones."""
+        live = np.flatnonzero(self.deleted_at[: self.size] == ALIVE)
+        capacity = max(len(live), self.initial_capacity)
+        matrix = self._empty(capacity)
+        if len(live):
+            matrix[: len(live)] = self.matrix[live]
+        self.ids = [self.ids[row] for row in live]
+        self.rows = {vector_id: row for row, vector_id in enumerate(self.ids)}
+        self.matrix = matrix
+        self.deleted_at = np.full(capacity, ALIVE, dtype=np.int64)
+        self.size = len(live)
+        self.tombstones = 0
+        self.version += 1
+        self._compacted(live)
+        self._publish()
+
+    def vectors(self) -> Tuple[List[str], np.ndarray]:
+        """Live ids and their stored rows (normalized vectors, unless a subclass encodes them)."""
+        live = np.flatnonzero(self.deleted_at[: self.size] == ALIVE)
+        matrix = self.matrix[live] if len(live) else self._empty(0)
+        return [self.ids[row] for row in live], matrix
+
+    def search(self, query: List[float], k: int = 5) -> List[Tuple[str, float]]:
+        return self._view.search(query, k)
+
+    def search_subset(self, query: List[float], vector_ids: List[str], k: int = 5) -> List[Tuple[str, float]]:
+        """Exact search over ``vector_ids`` only; costs O(len(vector_ids)), not O(len(self))."""
+        return self._view.search_subset(query, vector_ids, k)
+
+    def search_batch(self, queries: np.ndarray, k: int = 5) -> List[List[Tuple[str, float]]]:
+        """Exact top ``k`` for every row of ``queries`` with one matrix product
+        per block of stored rows, instead of one pass per query."""
+        return self._view.search_batch(queries, k)
@@ -1,39 +1,360 @@
-# src/vectordb/core/indexing/hnsw.py
 import heapq
-from typing import List, Tuple
+import math
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
+from app.core import metrics
+
+from app.core.indexing.flat import ALIVE, top_k
+
 
 class HNSWIndex:
-    def __init__(self, m: int = 5, ef: int = 10, m0: int = None):
-        self.m = m  # Number of connections per layer
-        self.ef = ef  # Search scope
-        self.m0 = m0 or m * 2
-        self.layers = []  # Layer 0 is the base layer
-        self.entry_point = None
-
-    def _search_layer(self, q: np.ndarray, ep: dict, ef: int, layer: int):
-        candidates = [(-np.linalg.norm(q - ep["vector"]), ep)]
-        visited = set([ep["id"]])
-        heap = []
+    """Hierarchical navigable small world graph over cosine distance.
+
+    Nodes are dense integer ids into ``vectors``. Layer 0 adjacency is a single
+    ``(capacity, m0)`` int32 array; the few nodes that reach upper layers keep a
+    ``(level, m)`` array in ``upper_links``. Unused slots hold -1. Deleted nodes are
+    tombstoned: they stay in the graph for navigation but are never returned.
+    Once tombstones pass ``compact_threshold`` of the nodes, ``needs_compaction``
+    is set and the owner rebuilds the graph with ``rebuild`` and ``catch_up``.
+
+    Each mutation publishes a shallow copy of the index with its node count,
+    version and entry point frozen; searches run against that view. Writers only
+    ever append nodes past the view's count, replace whole arrays when growing and
+    stamp deletions with a later version, so a view keeps returning the live set
+    it was published with while ingest continues.
+    """
+
+    def __init__(
+        self,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef: int = 64,
+        m0: int = None,
+        dim: Optional[int] = None,
+        initial_capacity: int = 1024,
+        seed: Optional[int] = None,
+        compact_threshold: float = 0.25,
+    ):
+        self.m = m  # Number of connections per upper layer
+        self.m0 = m0 or m * 2  # Number of connections on the base layer
+        self.ef_construction = ef_construction
+        self.ef = ef  # Search scope at layer 0
+        self.level_mult = 1 / math.log(max(m, 2))
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self.compact_threshold = compact_threshold
+        self.rng = np.random.default_rng(seed)
+
+        self.count = 0
+        self.vectors: Optional[np.ndarray] = None
+        self.levels = np.zeros(0, dtype=np.int8)
+        self.deleted_at = np.zeros(0, dtype=np.int64)
+        self.links0 = np.zeros((0, self.m0), dtype=np.int32)
+        self.upper_links: Dict[int, np.ndarray] = {}
+
+        self.ids: List[str] = []
+        self.nodes: Dict[str, int] = {}
+        self.entry_point = -1
+        self.max_level = -1
+        self.version = 0
+        self.live = 0
+        self._view: Optional["HNSWIndex"] = None
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, vector_id: str) -> bool:
+        return vector_id in self.nodes
+
+    @property
+    def tombstones(self) -> int:
+        return self.count - self.live
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.tombstones > 0 and self.tombstones >= self.compact_threshold * self.count
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_view"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._publish()
+
+    def _publish(self):
+        self.live = len(self.nodes)
+        view = object.__new__(HNSWIndex)
+        view.__dict__.update(self.__dict__)
+        view._view = None
+        self._view = view
+
+    def snapshot(self) -> Optional["HNSWIndex"]:
+        return self._view
+
+    @staticmethod
+    def normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        return vec / (np.linalg.norm(vec) + 1e-10)
+
+    def _reserve(self, size: int):
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, self.initial_capacity, capacity * 2)
+
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        levels = np.zeros(capacity, dtype=np.int8)
+        deleted_at = np.full(capacity, ALIVE, dtype=np.int64)
+        links0 = np.full((capacity, self.m0), -1, dtype=np.int32)
+        if self.count:
+            vectors[: self.count] = self.vectors[: self.count]
+            levels[: self.count] = self.levels[: self.count]
+            deleted_at[: self.count] = self.deleted_at[: self.count]
+            links0[: self.count] = self.links0[: self.count]
+        self.vectors, self.levels, self.deleted_at, self.links0 = vectors, levels, deleted_at, links0
+
+    def _links(self, node: int, layer: int) -> np.ndarray:
+        row = self.links0[node] if layer == 0 else self.upper_links[node][layer - 1]
+        # Links to nodes past ``count`` were added after this view was published.
+        return row[(row >= 0) & (row < self.count)]
+
+    def _set_links(self, node: int, layer: int, neighbors: List[int]):
+        row = self.links0[node] if layer == 0 else self.upper_links[node][layer - 1]
+        padded = np.full(row.shape[0], -1, dtype=np.int32)
+        padded[: len(neighbors)] = neighbors
+        row[:] = padded  # One assignment, so concurrent readers never see a half-cleared row
+
+    def _random_level(self) -> int:
+        return min(int(-math.log(1.0 - self.rng.random()) * self.level_mult), 127)
+
+    def _distances(self, q: np.ndarray, nodes) -> np.ndarray:
+        return 1.0 - self.vectors[nodes] @ q
+
+    def _greedy_closest(self, q: np.ndarray, ep: int, layer: int) -> int:
+        best_dist = float(self._distances(q, [ep])[0])
+        improved = True
+        while improved:
+            improved = False
+            neighbors = self._links(ep, layer)
+            if not len(neighbors):
+                break
+            dists = self._distances(q, neighbors)
+            i = int(np.argmin(dists))
+            if dists[i] < best_dist:
+                best_dist, ep, improved = float(dists[i]), int(neighbors[i]), True
+        return ep
+
+    def _search_layer(self, q: np.ndarray, entry_points: List[int], ef: int, layer: int) -> List[Tuple[float, int]]:
+        """Best-first search bounded by ``ef``; returns (distance, node) sorted ascending."""
+        visited = set(entry_points)
+        dists = self._distances(q, entry_points)
+        candidates = [(float(d), n) for d, n in zip(dists, entry_points)]
+        heapq.heapify(candidates)
+        results = [(-d, n) for d, n in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
 
         while candidates:
             dist, node = heapq.heappop(candidates)
-            heapq.heappush(heap, (-dist, node))
+            if dist > -results[0][0] and len(results) >= ef:
+                break
+
+            neighbors = [n for n in self._links(node, layer).tolist() if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+
+            for d, n in zip(self._distances(q, neighbors).tolist(), neighbors):
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, n))
+                    heapq.heappush(results, (-d, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        metrics.count("scored_vectors", len(visited))
+        return sorted((-d, n) for d, n in results)
+
+    def _select_neighbors(self, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """Heuristic selection: keep a candidate only if it is closer to the base
+        point than to every neighbor already kept, then backfill with the pruned."""
+        if len(candidates) <= m:
+            return [n for _, n in candidates]
+
+        nodes = [n for _, n in candidates]
+        dists = np.array([d for d, _ in candidates], dtype=np.float32)
+        vecs = self.vectors[nodes]
+        pairwise = 1.0 - vecs @ vecs.T
+        dominated = np.zeros(len(nodes), dtype=bool)
+        selected: List[int] = []
+        pruned: List[int] = []
+        for i in range(len(nodes)):
+            if len(selected) >= m:
+                break
+            if dominated[i]:
+                pruned.append(i)
+                continue
+            selected.append(i)
+            dominated |= pairwise[:, i] < dists
+        selected.extend(pruned[: m - len(selected)])
+        return [nodes[i] for i in selected]
 
-            for neighbor in node["neighbors"].get(layer, []):
-                if neighbor["id"] not in visited:
-                    visited.add(neighbor["id"])
-                    dist = -np.linalg.norm(q - neighbor["vector"])
-                    heapq.heappush(candidates, (dist, neighbor))
+    def _connect(self, node: int, neighbor: int, layer: int):
+        m = self.m0 if layer == 0 else self.m
+        links = self._links(neighbor, layer)
+        if len(links) < m:
+            self._set_links(neighbor, layer, links.tolist() + [node])
+            return
 
-        return [item[1] for item in heapq.nlargest(ef, heap)]
+        candidates = np.append(links, node)
+        dists = self._distances(self.vectors[neighbor], candidates)
+        order = np.argsort(dists)
+        ranked = [(float(dists[i]), int(candidates[i])) for i in order]
+        self._set_links(neighbor, layer, self._select_neighbors(ranked, m))
 
     def add_vector(self, vector: List[float], vector_id: str):
-        # Implementation omitted for brevity
-        pass
+        if vector_id in self.nodes:
+            self._tombstone(vector_id)
+
+        q = self.normalize(vector)
+        if self.dim is None:
+            self.dim = q.shape[0]
+        elif q.shape[0] != self.dim:
+            raise ValueError(f"Expected vector of dimension {self.dim}, got {q.shape[0]}")
+
+        node = self.count
+        self._reserve(node + 1)
+        level = self._random_level()
+        self.vectors[node] = q
+        self.levels[node] = level
+        if level > 0:
+            self.upper_links[node] = np.full((level, self.m), -1, dtype=np.int32)
+        self.ids.append(vector_id)
+        self.nodes[vector_id] = node
+        self.count += 1
+
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = node, level
+            self.version += 1
+            self._publish()
+            return
+
+        ep = self.entry_point
+        for layer in range(self.max_level, level, -1):
+            ep = self._greedy_closest(q, ep, layer)
+
+        entry_points = [ep]
+        for layer in range(min(level, self.max_level), -1, -1):
+            candidates = self._search_layer(q, entry_points, self.ef_construction, layer)
+            neighbors = self._select_neighbors(candidates, self.m0 if layer == 0 else self.m)
+            self._set_links(node, layer, neighbors)
+            for neighbor in neighbors:
+                self._connect(node, neighbor, layer)
+            entry_points = [n for _, n in candidates]
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+        self.version += 1
+        self._publish()
+
+    def update_vector(self, vector: List[float], vector_id: str):
+        self.add_vector(vector, vector_id)
+
+    def _tombstone(self, vector_id: str) -> bool:
+        node = self.nodes.pop(vector_id, None)
+        if node is None:
+            return False
+        self.deleted_at[node] = self.version + 1
+        return True
+
+    def remove_vector(self, vector_id: str) -> bool:
+        if not self._tombstone(vector_id):
+            return False
+        self.version += 1
+        self._publish()
+        return True
+
+    def rebuild(self) -> Tuple["HNSWIndex", int]:
+        """A new graph over the live nodes of the current view, without
+        tombstones, and the number of nodes that view covered.
+
+        Only the view is read, so this can run while writes continue; pass both
+        to ``catch_up`` to apply the writes made since before using the graph.
+        """
+        view = self._view
+        fresh = HNSWIndex(
+            m=self.m,
+            ef_construction=self.ef_construction,
+            ef=self.ef,
+            m0=self.m0,
+            dim=self.dim,
+            initial_capacity=self.initial_capacity,
+            seed=int(self.rng.integers(2**31)),
+            compact_threshold=self.compact_threshold,
+        )
+        if view is not None:
+            for node in np.flatnonzero(view.deleted_at[: view.count] > view.version).tolist():
+                fresh.add_vector(view.vectors[node], view.ids[node])
+        return fresh, 0 if view is None else view.count
+
+    def catch_up(self, fresh: "HNSWIndex", covered: int):
+        """Replay onto ``fresh`` (from ``rebuild``) the writes made to this index
+        since it was built; call with writes to this index held off."""
+        for vector_id in [vector_id for vector_id in fresh.nodes if vector_id not in self.nodes]:
+            fresh.remove_vector(vector_id)
+        # Nodes are never reused, so those past the rebuilt view were added or replaced after it.
+        for vector_id, node in self.nodes.items():
+            if node >= covered:
+                fresh.add_vector(self.vectors[node], vector_id)
+
+    def search(self, query: List[float], k: int = 5, ef: Optional[int] = None) -> List[Tuple[str, float]]:
+        view = self._view
+        if view is None:
+            return []
+        return view._search(query, k, ef)
+
+    def search_subset(self, query: List[float], vector_ids: List[str], k: int = 5) -> List[Tuple[str, float]]:
+        """Exact search over ``vector_ids`` only, bypassing the graph."""
+        view = self._view
+        if view is None or k <= 0:
+            return []
+        nodes = np.fromiter((node for node in map(view.nodes.get, vector_ids) if node is not None), dtype=np.int64)
+        nodes = nodes[nodes < view.count]
+        nodes = nodes[view.deleted_at[nodes] > view.version]
+        if not len(nodes):
+            return []
+        metrics.count("candidates", len(nodes))
+        metrics.count("scored_vectors", len(nodes))
+        scores = view.vectors[nodes] @ self.normalize(query)
+        return [(view.ids[nodes[i]], float(scores[i])) for i in top_k(scores, k)]
+
+    def _search(self, query: List[float], k: int, ef: Optional[int]) -> List[Tuple[str, float]]:
+        if not self.live or k <= 0:
+            return []
+
+        q = self.normalize(query)
+        ep = self.entry_point
+        for layer in range(self.max_level, 0, -1):
+            ep = self._greedy_closest(q, ep, layer)
+
+        # Tombstones still occupy slots in the candidate list, so widen the beam
+        # in proportion to how much of the graph has been deleted.
+        ef = max(ef or self.ef, k)
+        if self.tombstones:
+            ef = min(self.count, int(ef * self.count / max(self.live, 1)))
 
-    def search(self, query: List[float], k: int = 5) -> List[Tuple[str, float]]:
-        # Implementation omitted for brevity
-        pass
+        while True:
+            results = []
+            for dist, node in self._search_layer(q, [ep], ef, 0):
+                if self.deleted_at[node] > self.version:
+                    results.append((self.ids[node], 1.0 - dist))
+                    if len(results) == k:
+                        return results
+            # The beam can still fill up with tombstones around deleted regions; widen it.
+            if len(results) >= self.live or ef >= self.count:
+                return results
+            ef = min(self.count, ef * 2)
@@ -1,36 +1,508 @@
-from typing import List, Tuple
+import threading
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
-from sklearn.cluster import KMeans
+
+from app.core import metrics
+
+from app.core.indexing.flat import FlatIndex, top_k
+
+
+def mini_batch_kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    batch_size: int = 1024,
+    n_iter: int = 100,
+    seed: Optional[int] = None,
+    spherical: bool = True,
+) -> np.ndarray:
+    """Mini-batch k-means (Sculley 2010) with per-centroid learning rates.
+
+    With ``spherical`` the inputs are expected to be unit vectors, points are
+    assigned by inner product and centroids are kept on the unit sphere.
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    n_clusters = min(n_clusters, n)
+    centroids = vectors[rng.choice(n, n_clusters, replace=False)].astype(np.float32, copy=True)
+    counts = np.zeros(n_clusters, dtype=np.float64)
+
+    for _ in range(n_iter):
+        batch = vectors[rng.choice(n, min(batch_size, n), replace=False)]
+        labels = _assign(batch, centroids, spherical)
+
+        batch_counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, batch)
+        hit = batch_counts > 0
+        counts[hit] += batch_counts[hit]
+        lr = (batch_counts[hit] / counts[hit]).astype(np.float32)[:, None]
+        centroids[hit] += lr * (sums[hit] / batch_counts[hit][:, None] - centroids[hit])
+        if spherical:
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-10
+
+    # Clusters that never won a point are re-seeded so no posting list is dead on arrival.
+    empty = np.flatnonzero(counts == 0)
+    if len(empty):
+        centroids[empty] = vectors[rng.choice(n, len(empty), replace=False)]
+    return centroids
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, spherical: bool = True) -> np.ndarray:
+    if spherical:
+        return np.argmax(vectors @ centroids.T, axis=1)
+    dists = (centroids * centroids).sum(axis=1) - 2 * vectors @ centroids.T
+    return np.argmin(dists, axis=1)
+
+
+class _PostingList:
+    """Contiguous ids/vectors for one cluster.
+
+    ``shared`` is set once a read view holds these arrays; the next remove
+    copies them first (copy-on-write), as it either rewrites a slot or frees one
+    the next append would reuse. Without a remove since the last view, appends
+    below capacity only touch slots past every view's ``size`` and need no copy.
+    """
+
+    __slots__ = ("ids", "vectors", "size", "shared")
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.size = 0
+        self.shared = False
+
+    def append(self, internal_id: int, vector: np.ndarray) -> int:
+        if self.size == self.ids.shape[0]:
+            capacity = self.size * 2
+            ids = np.zeros(capacity, dtype=np.int64)
+            vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+            ids[: self.size] = self.ids[: self.size]
+            vectors[: self.size] = self.vectors[: self.size]
+            self.ids, self.vectors = ids, vectors
+            self.shared = False
+
+        slot = self.size
+        self.ids[slot] = internal_id
+        self.vectors[slot] = vector
+        self.size += 1
+        return slot
+
+    def remove(self, slot: int) -> Optional[int]:
+        """Swap-remove ``slot``; returns the internal id moved into it, if any."""
+        if self.shared:
+            self.ids, self.vectors = self.ids.copy(), self.vectors.copy()
+            self.shared = False
+        last = self.size - 1
+        self.size = last
+        if slot == last:
+            return None
+        self.ids[slot] = self.ids[last]
+        self.vectors[slot] = self.vectors[last]
+        return int(self.ids[slot])
+
+
+class _IVFState:
+    """Centroids plus the posting lists and locations built against them."""
+
+    def __init__(self, centroids: np.ndarray, capacity: int):
+        self.centroids = centroids
+        self.lists = [_PostingList(centroids.shape[1]) for _ in range(centroids.shape[0])]
+        self.cluster_of = np.full(capacity, -1, dtype=np.int32)
+        self.slot_of = np.full(capacity, -1, dtype=np.int32)
+
+    def _reserve(self, size: int):
+        if size > self.cluster_of.shape[0]:
+            capacity = max(size, self.cluster_of.shape[0] * 2)
+            for name in ("cluster_of", "slot_of"):
+                old = getattr(self, name)
+                grown = np.full(capacity, -1, dtype=np.int32)
+                grown[: old.shape[0]] = old
+                setattr(self, name, grown)
+
+    def add(self, internal_id: int, vector: np.ndarray) -> float:
+        """Insert and return the quantization error (cosine distance to the centroid)."""
+        sims = self.centroids @ vector
+        cluster = int(np.argmax(sims))
+        self._reserve(internal_id + 1)
+        self.cluster_of[internal_id] = cluster
+        self.slot_of[internal_id] = self.lists[cluster].append(internal_id, vector)
+        return 1.0 - float(sims[cluster])
+
+    def add_many(self, internal_ids: np.ndarray, vectors: np.ndarray, chunk_size: int = 65536):
+        if not len(internal_ids):
+            return
+        self._reserve(int(internal_ids.max()) + 1)
+        for start in range(0, len(internal_ids), chunk_size):
+            ids = internal_ids[start : start + chunk_size]
+            vecs = vectors[start : start + chunk_size]
+            for internal_id, vec, cluster in zip(ids, vecs, _assign(vecs, self.centroids)):
+                self.cluster_of[internal_id] = cluster
+                self.slot_of[internal_id] = self.lists[cluster].append(internal_id, vec)
+
+    def remove(self, internal_id: int):
+        cluster = self.cluster_of[internal_id]
+        if cluster < 0:
+            return
+        moved = self.lists[cluster].remove(int(self.slot_of[internal_id]))
+        if moved is not None:
+            self.slot_of[moved] = self.slot_of[internal_id]
+        self.cluster_of[internal_id] = -1
+        self.slot_of[internal_id] = -1
+
+    def snapshot(self) -> "_IVFView":
+        for plist in self.lists:
+            plist.shared = True
+        return _IVFView(self.centroids, tuple((p.ids, p.vectors, p.size) for p in self.lists))
+
+    def vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        lists = [p for p in self.lists if p.size]
+        if not lists:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.centroids.shape[1]), dtype=np.float32)
+        return (
+            np.concatenate([p.ids[: p.size] for p in lists]),
+            np.concatenate([p.vectors[: p.size] for p in lists]),
+        )
+
+
+class _IVFView:
+    """Frozen (ids, vectors, size) triples for every posting list."""
+
+    __slots__ = ("centroids", "lists")
+
+    def __init__(self, centroids: np.ndarray, lists: tuple):
+        self.centroids = centroids
+        self.lists = lists
+
+    def search(self, q: np.ndarray, k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Scan the ``nprobe`` closest lists, then the next closest ones while
+        they hold fewer than ``k`` vectors between them."""
+        centroid_scores = self.centroids @ q
+        nprobe = min(nprobe, len(self.lists))
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        ids, scores = [], []
+        found = self._scan(probes, q, ids, scores)
+        if found < k and nprobe < len(self.lists):
+            rest = np.setdiff1d(np.arange(len(self.lists)), probes, assume_unique=True)
+            for cluster in rest[np.argsort(-centroid_scores[rest], kind="stable")]:
+                found += self._scan((cluster,), q, ids, scores)
+                if found >= k:
+                    break
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        metrics.count("scored_vectors", len(ids))
+        top = top_k(scores, k)
+        return ids[top], scores[top]
+
+    def _scan(self, clusters, q: np.ndarray, ids: list, scores: list) -> int:
+        found = 0
+        for cluster in clusters:
+            list_ids, vectors, size = self.lists[cluster]
+            if size:
+                ids.append(list_ids[:size])
+                scores.append(vectors[:size] @ q)
+                found += size
+        return found
 
 
 class IVFIndex:
-    def __init__(self, n_clusters: int = 100):
-        self.n_clusters = n_clusters
-        self.clusters = {}
-        self.centroids = None
-
-    def train(self, vectors: List[List[float]]):
-        if len(vectors) < self.n_clusters:
-            self.n_clusters = max(1, len(vectors) // 2)
-
-        kmeans = KMeans(n_clusters=self.n_clusters)
-        self.centroids = kmeans.fit(vectors).cluster_centers_
-
-        for i, vec in enumerate(vectors):
-            cluster_id = np.argmin(np.linalg.norm(self.centroids - vec, axis=1))
-            if cluster_id not in self.clusters:
-                self.clusters[cluster_id] = []
-            self.clusters[cluster_id].append((i, vec))
-
-    def search(self, query: List[float], k: int = 5) -> List[Tuple[str, float]]:
-        if not self.centroids:
+    """Inverted file index over cosine similarity.
+
+    Until ``train_size`` vectors have been added the index is an exact flat scan.
+    After that, vectors are partitioned by a mini-batch k-means codebook into
+    contiguous posting lists and a query scans the ``nprobe`` closest lists
+    (and the next closest while those hold fewer than ``k`` vectors).
+    ``drift`` tracks how far the data has moved away from the codebook (growth and
+    churn since training, and the rise in quantization error); once it exceeds
+    ``drift_threshold`` the codebook is retrained in a background thread and the
+    rebuilt posting lists are swapped in.
+
+    Searches run against a read view that is rebuilt lazily after writes; the
+    posting lists are copy-on-write, so a view is never disturbed by later
+    writes. Internal ids are never reused, so a view cannot resolve a stale
+    internal id to a newer vector.
+    """
+
+    def __init__(
+        self,
+        n_clusters: Optional[int] = None,
+        nprobe: int = 8,
+        train_size: int = 2048,
+        max_train_sample: int = 100_000,
+        batch_size: int = 1024,
+        n_iter: int = 100,
+        drift_threshold: float = 0.5,
+        background_retrain: bool = True,
+        seed: Optional[int] = None,
+    ):
+        self.n_clusters = n_clusters  # Defaults to ~4 * sqrt(N) at train time
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.max_train_sample = max_train_sample
+        self.batch_size = batch_size
+        self.n_iter = n_iter
+        self.drift_threshold = drift_threshold
+        self.background_retrain = background_retrain
+        self.rng = np.random.default_rng(seed)
+        self.dim: Optional[int] = None
+
+        self.buffer = FlatIndex()  # Exact store used until the codebook is trained
+        self.state: Optional[_IVFState] = None
+        self.external: List[Optional[str]] = []
+        self.internal: Dict[str, int] = {}
+        self.version = 0
+        self._view = None
+
+        self.trained_size = 0
+        self.baseline_error = 0.0
+        self.changes_since_train = 0
+        self.error_sum = 0.0
+        self.error_count = 0
+
+        self._lock = threading.RLock()
+        self._retraining = False
+        self._pending: List[Tuple[str, int, Optional[np.ndarray]]] = []
+
+    def __getstate__(self) -> dict:
+        with self._lock:
+            state = self.__dict__.copy()
+        del state["_lock"]
+        state["_retraining"] = False
+        state["_pending"] = []
+        state["_view"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.internal) if self.state is not None else len(self.buffer)
+
+    def __contains__(self, vector_id: str) -> bool:
+        return vector_id in self.internal if self.state is not None else vector_id in self.buffer
+
+    @property
+    def is_trained(self) -> bool:
+        return self.state is not None
+
+    @property
+    def drift(self) -> float:
+        if self.state is None:
+            return 0.0
+        churn = self.changes_since_train / max(self.trained_size, 1)
+        error_growth = 0.0
+        if self.error_count and self.baseline_error > 0:
+            error_growth = self.error_sum / self.error_count / self.baseline_error - 1.0
+        return max(churn, error_growth)
+
+    def _allocate(self, vector_id: str) -> int:
+        internal_id = len(self.external)
+        self.external.append(vector_id)
+        self.internal[vector_id] = internal_id
+        return internal_id
+
+    def add_vector(self, vector: List[float], vector_id: str):
+        with self._lock:
+            if self.state is None:
+                self.buffer.add_vector(vector, vector_id)
+                self.dim = self.buffer.dim
+                if len(self.buffer) >= self.train_size:
+                    self.train()
+                self.version += 1
+                return
+
+            vec = FlatIndex.normalize(vector)
+            if vec.shape[0] != self.dim:
+                raise ValueError(f"Expected vector of dimension {self.dim}, got {vec.shape[0]}")
+            if vector_id in self.internal:
+                self._remove(vector_id)
+
+            internal_id = self._allocate(vector_id)
+            self.error_sum += self.state.add(internal_id, vec)
+            self.error_count += 1
+            self.changes_since_train += 1
+            self.version += 1
+            if self._retraining:
+                self._pending.append(("add", internal_id, vec))
+            self._maybe_retrain()
+
+    def update_vector(self, vector: List[float], vector_id: str):
+        self.add_vector(vector, vector_id)
+
+    def remove_vector(self, vector_id: str) -> bool:
+        with self._lock:
+            if self.state is None:
+                self.version += 1
+                return self.buffer.remove_vector(vector_id)
+            if vector_id not in self.internal:
+                return False
+            self._remove(vector_id)
+            self.changes_since_train += 1
+            self.version += 1
+            self._maybe_retrain()
+            return True
+
+    def _remove(self, vector_id: str):
+        internal_id = self.internal.pop(vector_id)
+        self.state.remove(internal_id)
+        self.external[internal_id] = None
+        if self._retraining:
+            self._pending.append(("remove", internal_id, None))
+
+    def train(self, sample: Optional[np.ndarray] = None):
+        """Fit the codebook (on ``sample`` if given, else on the buffered vectors)
+        and move the buffered vectors into posting lists."""
+        with self._lock:
+            if self.state is not None or not len(self.buffer):
+                return
+
+            buffered_ids, data = self.buffer.vectors()
+            n = len(buffered_ids)
+            if sample is not None:
+                sample = np.asarray(sample, dtype=np.float32)
+                sample = sample / (np.linalg.norm(sample, axis=1, keepdims=True) + 1e-10)
+            centroids = self._fit(data if sample is None else sample)
+            self.state = _IVFState(centroids, capacity=n)
+            ids = np.array([self._allocate(vid) for vid in buffered_ids], dtype=np.int64)
+            self.state.add_many(ids, data)
+            self.buffer = FlatIndex()
+            self.version += 1
+            self._reset_drift(data, centroids, n)
+
+    def _fit(self, data: np.ndarray) -> np.ndarray:
+        n_clusters = self.n_clusters or int(4 * np.sqrt(len(data)))
+        n_clusters = max(1, min(n_clusters, len(data)))
+        if len(data) > self.max_train_sample:
+            data = data[self.rng.choice(len(data), self.max_train_sample, replace=False)]
+        return mini_batch_kmeans(
+            data, n_clusters, batch_size=self.batch_size, n_iter=self.n_iter, seed=int(self.rng.integers(2**31))
+        )
+
+    def _reset_drift(self, data: np.ndarray, centroids: np.ndarray, size: int):
+        sample = data[: min(len(data), 10_000)]
+        self.baseline_error = float(np.mean(1.0 - np.max(sample @ centroids.T, axis=1)))
+        self.trained_size = size
+        self.changes_since_train = 0
+        self.error_sum = 0.0
+        self.error_count = 0
+
+    def _maybe_retrain(self):
+        if self._retraining or self.drift <= self.drift_threshold:
+            return
+        if self.background_retrain:
+            self._retraining = True
+            threading.Thread(target=self.retrain, daemon=True, name="ivf-retrain").start()
+        else:
+            self.retrain()
+
+    def retrain(self):
+        """Re-cluster the live vectors. Writes that land while the new codebook is
+        being fitted are logged and replayed onto it before the swap."""
+        with self._lock:
+            self._retraining = True
+            self._pending = []
+            ids, data = self.state.vectors()
+        try:
+            if not len(ids):
+                return
+            centroids = self._fit(data)
+            state = _IVFState(centroids, capacity=len(self.external))
+            state.add_many(ids, data)
+
+            with self._lock:
+                for op, internal_id, vec in self._pending:
+                    if op == "add":
+                        state.add(internal_id, vec)
+                    else:
+                        state.remove(internal_id)
+                self.state = state
+                self.version += 1
+                self._reset_drift(data, centroids, len(self.internal))
+        finally:
+            with self._lock:
+                self._pending = []
+                self._retraining = False
+
+    def snapshot(self):
+        view = self._view
+        if view is not None and view[0] == self.version:
+            return view[1]
+        with self._lock:
+            if self.state is None:
+                view = self.buffer.snapshot()
+            else:
+                view = self.state.snapshot()
+            self._view = (self.version, view)
+            return view
+
+    def search_subset(self, query: List[float], vector_ids: List[str], k: int = 5) -> List[Tuple[str, float]]:
+        """Exact search over ``vector_ids`` only, read straight from their posting lists."""
+        view = self.snapshot()
+        if not isinstance(view, _IVFView):
+            return view.search_subset(query, vector_ids, k)
+        if k <= 0:
             return []
 
-        query_vec = np.array(query)
-        closest_cluster = np.argmin(np.linalg.norm(self.centroids - query_vec, axis=1))
-        candidates = self.clusters.get(closest_cluster, [])
+        state = self.state
+        cluster_of, slot_of = state.cluster_of, state.slot_of
+        internal = np.fromiter((i for i in map(self.internal.get, vector_ids) if i is not None), dtype=np.int64)
+        internal = internal[internal < len(cluster_of)]
+        clusters = cluster_of[internal]
+        order = np.argsort(clusters, kind="stable")
+        internal, clusters, slots = internal[order], clusters[order], slot_of[internal[order]]
+        starts = np.flatnonzero(np.r_[True, clusters[1:] != clusters[:-1]]) if len(clusters) else []
+        ends = np.r_[starts[1:], len(clusters)] if len(clusters) else []
+        found, vectors = [], []
+        for start, end in zip(starts, ends):
+            cluster = clusters[start]
+            if cluster < 0:
+                continue
+            list_ids, list_vectors, size = view.lists[cluster]
+            want, at = internal[start:end], slots[start:end]
+            # Locations are read from the live state; keep only those the view agrees with.
+            ok = at < size
+            ok[ok] = list_ids[at[ok]] == want[ok]
+            found.append(want[ok])
+            vectors.append(list_vectors[at[ok]])
+        if not found:
+            return []
+
+        found = np.concatenate(found)
+        metrics.count("candidates", len(found))
+        metrics.count("scored_vectors", len(found))
+        scores = np.concatenate(vectors) @ FlatIndex.normalize(query)
+        external = self.external
+        results = []
+        for i in top_k(scores, len(scores)):
+            vector_id = external[found[i]]
+            if vector_id is not None:
+                results.append((vector_id, float(scores[i])))
+                if len(results) == k:
+                    break
+        return results
+
+    def search(self, query: List[float], k: int = 5, nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        if k <= 0:
+            return []
+        view = self.snapshot()
+        if not isinstance(view, _IVFView):
+            return view.search(query, k)
 
-        distances = [np.linalg.norm(vec - query_vec) for _, vec in candidates]
-        indices = np.argpartition(distances, min(k, len(distances)))[:k]
-        return [(candidates[i][0], float(distances[i])) for i in indices]
+        q = FlatIndex.normalize(query)
+        external = self.external
+        wanted = k
+        while True:
+            ids, scores = view.search(q, wanted, nprobe or self.nprobe)
+            results = []
+            for internal_id, score in zip(ids.tolist(), scores.tolist()):
+                vector_id = external[internal_id]
+                if vector_id is not None:
+                    results.append((vector_id, score))
+            # Vectors removed since the view was taken drop out; ask for that many more while the view has them.
+            if len(results) >= k or len(ids) < wanted:
+                return results[:k]
+            wanted += k - len(results)
@@ -0,0 +1,153 @@
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core import metrics
+
+from app.core.indexing.flat import ALIVE, FlatIndex, _FlatView, top_k
+
+
+class _LSHView(_FlatView):
+    """``_FlatView`` plus the hash tables, scanning only the probed buckets."""
+
+    __slots__ = ("tables", "index")
+
+    def __init__(self, *args, tables, index):
+        super().__init__(*args)
+        self.tables = tables
+        self.index = index
+
+    def search(self, query: List[float], k: int = 5) -> List[Tuple[str, float]]:
+        n = self.size
+        if n == 0 or k <= 0:
+            return []
+        keys = self.index.signatures(FlatIndex.normalize(query)[None, :])[0].tolist()
+        masks = self.index.probe_masks
+        buckets = []
+        for table, key in zip(self.tables, keys):
+            for mask in masks:
+                bucket = table.get(key ^ mask)
+                if bucket:
+                    buckets.append(bucket)
+        # Buckets only grow between compactions; rows past the view's size are newer than it.
+        rows = np.unique(np.fromiter((row for bucket in buckets for row in bucket[:]), dtype=np.int64))
+        rows = rows[rows < n]
+        if self.has_tombstones:
+            rows = rows[self.deleted_at[rows] > self.version]
+        if len(rows) < k:
+            # Too few candidates to fill k; an exact scan still answers correctly.
+            return super().search(query, k)
+        metrics.count("candidates", len(rows))
+        metrics.count("scored_vectors", len(rows))
+        scores = self.score(self.matrix[rows], query)
+        ids = self.ids
+        return [(ids[rows[i]], float(scores[i])) for i in top_k(scores, k)]
+
+
+class LSHIndex(FlatIndex):
+    """Random-hyperplane LSH (Charikar 2002) for cosine similarity.
+
+    Each of ``n_tables`` tables hashes a vector to ``n_bits`` sign bits against
+    random hyperplanes, packed into one integer key, so vectors at a small
+    angle tend to share a bucket. A query probes, in every table, its own
+    bucket and all buckets within Hamming distance ``probe_radius`` of it
+    (multi-probe), and only the union of those buckets is scored exactly.
+
+    Vectors are stored as in ``FlatIndex``, whose tombstones also handle
+    deletes: buckets keep dead rows until compaction rebuilds the tables, and
+    searches skip them. More tables or a larger radius raise recall; more bits
+    make buckets smaller and searches cheaper.
+    """
+
+    def __init__(
+        self,
+        n_tables: int = 8,
+        n_bits: int = 12,
+        probe_radius: int = 1,
+        seed: Optional[int] = None,
+        dim: Optional[int] = None,
+        initial_capacity: int = 1024,
+        compact_threshold: float = 0.25,
+    ):
+        if n_tables < 1:
+            raise ValueError("n_tables must be positive")
+        if not 1 <= n_bits <= 63:
+            raise ValueError("n_bits must be between 1 and 63")
+        if not 0 <= probe_radius <= n_bits:
+            raise ValueError("probe_radius must be between 0 and n_bits")
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.probe_radius = probe_radius
+        self.rng = np.random.default_rng(seed)
+        self.planes: Optional[np.ndarray] = None
+        self.keys = np.zeros((0, n_tables), dtype=np.int64)
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in range(n_tables)]
+        # XOR masks of every bit pattern within the probe radius, nearest first.
+        self.probe_masks = [
+            sum(1 << bit for bit in bits)
+            for distance in range(probe_radius + 1)
+            for bits in combinations(range(n_bits), distance)
+        ]
+        super().__init__(dim=dim, initial_capacity=initial_capacity, compact_threshold=compact_threshold)
+
+    def __getstate__(self) -> dict:
+        state = super().__getstate__()
+        del state["tables"]  # Rebuilt from the stored keys
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.tables = self._build_tables(np.flatnonzero(self.deleted_at[: self.size] == ALIVE))
+        self._publish()
+
+    def signatures(self, vectors: np.ndarray) -> np.ndarray:
+        """Packed bucket keys, one per table, for each of ``vectors``."""
+        bits = (vectors @ self.planes.T > 0).reshape(len(vectors), self.n_tables, self.n_bits)
+        return bits.astype(np.int64) @ (np.int64(1) << np.arange(self.n_bits, dtype=np.int64))
+
+    def _appended(self, row: int, vec: np.ndarray):
+        if self.planes is None:
+            self.planes = self.rng.standard_normal((self.n_tables * self.n_bits, self.dim)).astype(np.float32)
+        if row >= len(self.keys):
+            keys = np.zeros((max(row + 1, 2 * len(self.keys), self.initial_capacity), self.n_tables), dtype=np.int64)
+            keys[: len(self.keys)] = self.keys
+            self.keys = keys
+        self.keys[row] = self.signatures(vec[None, :])[0]
+        for table, key in zip(self.tables, self.keys[row].tolist()):
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = [row]
+            else:
+                bucket.append(row)
+
+    def _compacted(self, live: np.ndarray):
+        keys = np.zeros((max(len(live), self.initial_capacity), self.n_tables), dtype=np.int64)
+        keys[: len(live)] = self.keys[live]
+        self.keys = keys
+        self.tables = self._build_tables(np.arange(len(live)))
+
+    def _build_tables(self, rows: np.ndarray) -> List[Dict[int, List[int]]]:
+        tables = []
+        for t in range(self.n_tables):
+            keys = self.keys[rows, t]
+            order = np.argsort(keys, kind="stable")
+            unique, starts = np.unique(keys[order], return_index=True)
+            groups = np.split(rows[order], starts[1:])
+            tables.append({key: group.tolist() for key, group in zip(unique.tolist(), groups)})
+        return tables
+
+    def _publish(self):
+        self._view = _LSHView(
+            self.matrix,
+            self.ids,
+            self.rows,
+            self.deleted_at,
+            self.size,
+            self.version,
+            self.tombstones > 0,
+            self._score,
+            self._score_batch,
+            tables=self.tables,
+            index=self,
+        )
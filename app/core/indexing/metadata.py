@@ -0,0 +1,241 @@
+import bisect
+import math
+from numbers import Number
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+RANGE_OPERATORS = ("gt", "gte", "lt", "lte")
+OPERATORS = ("eq", "in") + RANGE_OPERATORS
+
+
+def _key(value):
+    # True == 1 in a dict; keep booleans apart from numbers.
+    return ("bool", value) if isinstance(value, bool) else value
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, Number) and not isinstance(value, bool) and not math.isnan(value)
+
+
+def _scalar(value, field: str):
+    if not (isinstance(value, (str, bool)) or _is_number(value)):
+        raise ValueError(f"Filter values on '{field}' must be strings, numbers or booleans")
+    return _key(value)
+
+
+def _scalars(value) -> Iterable:
+    """The indexable values of a metadata field; list fields index every element."""
+    for item in value if isinstance(value, (list, tuple)) else (value,):
+        if isinstance(item, (str, bool)) or _is_number(item):
+            yield item
+
+
+class FilterMatch:
+    """The chunks of one library that satisfy a filter, as a mask over the
+    metadata index's dense chunk numbers."""
+
+    __slots__ = ("mask", "rows", "chunk_ids", "count")
+
+    def __init__(self, mask: np.ndarray, rows: Dict[str, int], chunk_ids: List[Optional[str]]):
+        self.mask = mask
+        self.rows = rows
+        self.chunk_ids = chunk_ids
+        self.count = int(mask.sum())
+
+    def __contains__(self, chunk_id: str) -> bool:
+        row = self.rows.get(chunk_id)
+        return row is not None and row < len(self.mask) and bool(self.mask[row])
+
+    def ids(self) -> List[str]:
+        chunk_ids = self.chunk_ids
+        return [chunk_ids[row] for row in np.flatnonzero(self.mask)]
+
+
+class MetadataIndex:
+    """Secondary indexes over the chunks of one library, for filtered search.
+
+    Every chunk gets a dense number. ``document_id`` and each scalar metadata
+    value map to the set of chunk numbers holding them (list values index each
+    element), and numeric values are also kept in a per-field sorted list of
+    ``(value, number)`` for range predicates. ``match`` evaluates a filter into a
+    boolean mask over the numbers, ANDing one mask per predicate.
+
+    A filter is ``{"document_id": id | [ids], "metadata": {field: condition}}``
+    where a condition is a scalar (equality), a list (membership), or a dict of
+    operators from ``OPERATORS``, e.g. ``{"gte": 2020, "lt": 2024}``.
+
+    Removed chunks leave their number unused; once those pass
+    ``compact_threshold`` of the numbers, ``needs_compaction`` is set and the
+    owner swaps in ``compacted()``, which renumbers the live chunks densely.
+    """
+
+    def __init__(self, compact_threshold: float = 0.25):
+        self.compact_threshold = compact_threshold
+        self.chunk_ids: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.entries: List[Optional[Tuple[str, Dict[str, Any]]]] = []
+        self.documents: Dict[str, Set[int]] = {}
+        self.values: Dict[str, Dict[Any, Set[int]]] = {}
+        self.numbers: Dict[str, List[Tuple[float, int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def needs_compaction(self) -> bool:
+        tombstones = len(self.chunk_ids) - len(self.rows)
+        return tombstones > 0 and tombstones >= self.compact_threshold * len(self.chunk_ids)
+
+    def add(self, chunk_id: str, document_id: str, metadata: Optional[dict]):
+        if chunk_id in self.rows:
+            self.remove(chunk_id)
+        row = len(self.chunk_ids)
+        for field, number in self._append(chunk_id, document_id, metadata or {}):
+            bisect.insort(self.numbers.setdefault(field, []), (number, row))
+        self.rows[chunk_id] = row
+
+    def _append(self, chunk_id: str, document_id: str, metadata: dict) -> List[Tuple[str, float]]:
+        """Post a new chunk number everywhere but ``numbers``; returns its numeric values."""
+        row = len(self.chunk_ids)
+        self.chunk_ids.append(chunk_id)
+        self.entries.append((document_id, metadata))
+        self.documents.setdefault(document_id, set()).add(row)
+        numbers = []
+        for field, value in metadata.items():
+            postings = self.values.setdefault(field, {})
+            for item in _scalars(value):
+                postings.setdefault(_key(item), set()).add(row)
+                if _is_number(item):
+                    numbers.append((field, float(item)))
+        return numbers
+
+    def update(self, chunk_id: str, document_id: str, metadata: Optional[dict]):
+        self.add(chunk_id, document_id, metadata)
+
+    def remove(self, chunk_id: str) -> bool:
+        row = self.rows.pop(chunk_id, None)
+        if row is None:
+            return False
+        document_id, metadata = self.entries[row]
+        self.entries[row] = None
+        self.chunk_ids[row] = None
+        self._discard(self.documents, document_id, row)
+        for field, value in metadata.items():
+            for item in _scalars(value):
+                self._discard(self.values.get(field, {}), _key(item), row)
+                if _is_number(item):
+                    numbers = self.numbers[field]
+                    del numbers[bisect.bisect_left(numbers, (float(item), row))]
+        return True
+
+    def compacted(self) -> "MetadataIndex":
+        """A copy holding only the live chunks, numbered densely in their current order."""
+        fresh = MetadataIndex(self.compact_threshold)
+        numbers: Dict[str, List[Tuple[float, int]]] = {}
+        for chunk_id, entry in zip(self.chunk_ids, self.entries):
+            if entry is None:
+                continue
+            row = len(fresh.chunk_ids)
+            for field, number in fresh._append(chunk_id, *entry):
+                numbers.setdefault(field, []).append((number, row))
+            fresh.rows[chunk_id] = row
+        fresh.numbers = {field: sorted(pairs) for field, pairs in numbers.items()}
+        return fresh
+
+    @staticmethod
+    def _discard(postings: Dict[Any, Set[int]], key, row: int):
+        rows = postings.get(key)
+        if rows is not None:
+            rows.discard(row)
+            if not rows:
+                del postings[key]
+
+    def match(self, filters: Optional[dict]) -> Optional[FilterMatch]:
+        """Evaluate ``filters``; None when there is nothing to filter on.
+
+        Raises ValueError for malformed conditions.
+        """
+        if not filters:
+            return None
+        size = len(self.chunk_ids)
+        mask = None
+
+        def restrict(rows: np.ndarray):
+            nonlocal mask
+            selected = np.zeros(size, dtype=bool)
+            selected[rows[rows < size]] = True
+            mask = selected if mask is None else mask & selected
+
+        unknown = set(filters) - {"document_id", "metadata"}
+        if unknown:
+            raise ValueError(f"Unknown filter keys {sorted(unknown)}, expected 'document_id' and 'metadata'")
+
+        document_id = filters.get("document_id")
+        if document_id is not None:
+            document_ids = document_id if isinstance(document_id, list) else [document_id]
+            restrict(self._union(self.documents, document_ids))
+
+        for field, condition in (filters.get("metadata") or {}).items():
+            if not isinstance(condition, dict):
+                condition = {"in": condition} if isinstance(condition, list) else {"eq": condition}
+            unknown = set(condition) - set(OPERATORS)
+            if unknown or not condition:
+                raise ValueError(f"Invalid condition on '{field}', expected operators from {OPERATORS}")
+            postings = self.values.get(field, {})
+            if "eq" in condition:
+                restrict(self._union(postings, [_scalar(condition["eq"], field)]))
+            if "in" in condition:
+                if not isinstance(condition["in"], list):
+                    raise ValueError(f"'in' on '{field}' expects a list")
+                restrict(self._union(postings, [_scalar(value, field) for value in condition["in"]]))
+            bounds = {op: condition[op] for op in RANGE_OPERATORS if op in condition}
+            if bounds:
+                if not all(_is_number(bound) for bound in bounds.values()):
+                    raise ValueError(f"Range bounds on '{field}' must be numbers")
+                restrict(self._range(self.numbers.get(field, []), bounds))
+
+        if mask is None:
+            return None
+        return FilterMatch(mask, self.rows, self.chunk_ids)
+
+    @staticmethod
+    def _union(postings: Dict[Any, Set[int]], keys: List) -> np.ndarray:
+        # list() copies each set in one step, so concurrent writers cannot break the iteration.
+        parts = [list(postings.get(key, ())) for key in keys]
+        return np.fromiter((row for part in parts for row in part), dtype=np.int64)
+
+    @staticmethod
+    def _range(numbers: List[Tuple[float, int]], bounds: Dict[str, float]) -> np.ndarray:
+        lo, hi = 0, len(numbers)
+        if "gte" in bounds:
+            lo = max(lo, bisect.bisect_left(numbers, (bounds["gte"], -1)))
+        if "gt" in bounds:
+            lo = max(lo, bisect.bisect_right(numbers, (bounds["gt"], math.inf)))
+        if "lte" in bounds:
+            hi = min(hi, bisect.bisect_right(numbers, (bounds["lte"], math.inf)))
+        if "lt" in bounds:
+            hi = min(hi, bisect.bisect_left(numbers, (bounds["lt"], -1)))
+        return np.fromiter((row for _, row in numbers[lo:hi]), dtype=np.int64)
+
+
+def filtered_search(search, search_subset, size: int, query, k: int, match: FilterMatch, prefilter_ratio: float):
+    """Top ``k`` hits satisfying ``match``.
+
+    When the filter keeps at most ``prefilter_ratio`` of the ``size`` indexed
+    items, ``search_subset`` scores exactly the matching items (pre-filtering),
+    which is cheaper than an unfiltered search. Broader filters run ``search``
+    with headroom for the hits the filter will reject and drop them afterwards
+    (post-filtering), widening the request until ``k`` hits survive.
+    """
+    if not match.count or not size or k <= 0:
+        return []
+    if match.count <= prefilter_ratio * size:
+        return search_subset(query, match.ids(), k)
+
+    fetch = min(size, math.ceil(k * size / match.count * 1.2))
+    while True:
+        hits = [hit for hit in search(query, fetch) if hit[0] in match]
+        if len(hits) >= k or fetch >= size:
+            return hits[:k]
+        fetch = min(size, fetch * 2)
@@ -0,0 +1,282 @@
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core import metrics
+
+from app.core.indexing.flat import FlatIndex, top_k
+from app.core.indexing.inf import mini_batch_kmeans
+
+# Codes are scored in blocks whose temporary arrays stay around this size, in cache.
+SCORE_BLOCK_BYTES = 1 << 20
+
+
+class ScalarQuantizer:
+    """int8 scalar quantization (one byte per dimension, 4x smaller than float32).
+
+    Each dimension is mapped linearly from its trained ``[low, high]`` range onto
+    0..255. Scoring is asymmetric: the query stays in float32 and
+    ``q . x ~= q . low + (q * scale) . code``, so codes are never decoded.
+    """
+
+    def __init__(self):
+        self.dim: Optional[int] = None
+        self.low: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def code_size(self) -> int:
+        return self.dim
+
+    def train(self, vectors: np.ndarray):
+        self.dim = vectors.shape[1]
+        self.low = vectors.min(axis=0)
+        self.scale = np.maximum((vectors.max(axis=0) - self.low) / 255.0, 1e-12).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        scaled = query * self.scale
+        offset = float(query @ self.low)
+        block = max(1, SCORE_BLOCK_BYTES // (4 * self.dim))
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block):
+            out[start : start + block] = codes[start : start + block] @ scaled + offset
+        return out
+
+
+class ProductQuantizer:
+    """Product quantization (Jegou et al. 2011).
+
+    The dimensions are split into ``m`` contiguous subspaces, each with its own
+    k-means codebook of ``2 ** nbits`` centroids, and a vector is stored as the
+    ``m`` indices of its nearest centroids: ``m`` bytes instead of ``4 * dim``.
+    Scoring is asymmetric: per query, a table of the inner products between each
+    query sub-vector and each centroid is built once, and a code's score is the
+    sum of ``m`` table lookups.
+    """
+
+    def __init__(self, m: Optional[int] = None, nbits: int = 8, n_iter: int = 100, seed: Optional[int] = None):
+        if not 1 <= nbits <= 8:
+            raise ValueError("nbits must be between 1 and 8")
+        if m is not None and m < 1:
+            raise ValueError("m must be positive")
+        self.m = m  # Defaults to one subspace per 16 dimensions at train time
+        self.ksub = 2**nbits
+        self.n_iter = n_iter
+        self.seed = seed
+        self.dim: Optional[int] = None
+        self.bounds: List[Tuple[int, int]] = []
+        self.codebooks: List[np.ndarray] = []
+
+    @property
+    def code_size(self) -> int:
+        return len(self.bounds)
+
+    def train(self, vectors: np.ndarray):
+        self.dim = vectors.shape[1]
+        m = min(self.m or max(1, self.dim // 16), self.dim)
+        edges = np.linspace(0, self.dim, m + 1).astype(int)
+        self.bounds = list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+        rng = np.random.default_rng(self.seed)
+        self.codebooks = [
+            mini_batch_kmeans(
+                np.ascontiguousarray(vectors[:, lo:hi]),
+                self.ksub,
+                n_iter=self.n_iter,
+                seed=int(rng.integers(2**31)),
+                spherical=False,
+            )
+            for lo, hi in self.bounds
+        ]
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.code_size), dtype=np.uint8)
+        for j, ((lo, hi), codebook) in enumerate(zip(self.bounds, self.codebooks)):
+            dists = (codebook * codebook).sum(axis=1) - 2 * vectors[:, lo:hi] @ codebook.T
+            codes[:, j] = np.argmin(dists, axis=1)
+        return codes
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        table = np.zeros((self.code_size, self.ksub), dtype=np.float32)
+        for j, ((lo, hi), codebook) in enumerate(zip(self.bounds, self.codebooks)):
+            table[j, : len(codebook)] = codebook @ query[lo:hi]
+        table = table.ravel()
+        offsets = np.arange(self.code_size, dtype=np.intp) * self.ksub
+        block = max(1, SCORE_BLOCK_BYTES // (8 * self.code_size))
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block):
+            out[start : start + block] = np.take(table, codes[start : start + block] + offsets).sum(axis=1)
+        return out
+
+
+QUANTIZERS = {
+    "sq8": ScalarQuantizer,
+    "pq": ProductQuantizer,
+}
+
+
+class _CodeIndex(FlatIndex):
+    """``FlatIndex`` whose rows hold quantizer codes, scored by asymmetric distance."""
+
+    def __init__(self, quantizer, initial_capacity: int = 1024):
+        super().__init__(dim=quantizer.dim, initial_capacity=initial_capacity)
+        self.quantizer = quantizer
+
+    def _empty(self, capacity: int) -> np.ndarray:
+        return np.zeros((capacity, self.quantizer.code_size), dtype=np.uint8)
+
+    def _encode(self, vec: np.ndarray) -> np.ndarray:
+        return self.quantizer.encode(vec[None, :])[0]
+
+    def _score(self, rows: np.ndarray, query: List[float]) -> np.ndarray:
+        return self.quantizer.scores(self.normalize(query), rows)
+
+    def _score_batch(self, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        return np.stack([self.quantizer.scores(query, rows) for query in queries], axis=1)
+
+    def extend(self, vector_ids: List[str], vectors: np.ndarray, chunk_size: int = 65536):
+        """Bulk-append new ids with their normalized vectors, encoding them in batches."""
+        start = self.size
+        self._reserve(start + len(vector_ids))
+        for offset in range(0, len(vector_ids), chunk_size):
+            batch = vectors[offset : offset + chunk_size]
+            self.matrix[start + offset : start + offset + len(batch)] = self.quantizer.encode(batch)
+        for row, vector_id in enumerate(vector_ids, start=start):
+            self.ids.append(vector_id)
+            self.rows[vector_id] = row
+        self.size += len(vector_ids)
+        self.version += 1
+        self._publish()
+
+
+class QuantizedIndex:
+    """Compressed exact-scan index: quantized codes plus full-precision re-ranking.
+
+    Until ``train_size`` vectors have been added the index is a plain exact flat
+    scan. Then the ``quantizer`` ("sq8" or "pq") is trained on them and only codes
+    are kept in memory: ``dim`` bytes per vector for sq8, ``m`` bytes for pq.
+
+    A search scores every code against the float32 query (asymmetric distance)
+    and takes the best ``k * rerank`` candidates, which are then re-scored exactly
+    from full-precision vectors fetched through ``vector_source`` (a callable
+    mapping ids to vectors, or None for ids it no longer has). The database wires
+    this to the chunk embeddings, which live in the memory-mapped snapshot, so
+    the full vectors stay on disk and only the candidates' pages are read.
+    Without a ``vector_source`` the approximate scores are returned as they are.
+    """
+
+    def __init__(
+        self,
+        quantizer: str = "sq8",
+        m: Optional[int] = None,
+        nbits: int = 8,
+        rerank: int = 4,
+        train_size: int = 2048,
+        max_train_sample: int = 100_000,
+        n_iter: int = 25,
+        seed: Optional[int] = None,
+    ):
+        if quantizer not in QUANTIZERS:
+            raise ValueError(f"Unknown quantizer '{quantizer}', expected one of {sorted(QUANTIZERS)}")
+        if rerank < 1:
+            raise ValueError("rerank must be at least 1")
+        self.quantizer = quantizer
+        self.m = m
+        self.nbits = nbits
+        self.rerank = rerank
+        self.train_size = train_size
+        self.max_train_sample = max_train_sample
+        self.n_iter = n_iter
+        self.rng = np.random.default_rng(seed)
+        self._new_quantizer()  # Validates the quantizer parameters up front
+        self.dim: Optional[int] = None
+        # A FlatIndex until trained, then a _CodeIndex; swapped in one assignment.
+        self.store: FlatIndex = FlatIndex()
+        self.vector_source: Optional[Callable[[Sequence[str]], List[Optional[np.ndarray]]]] = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["vector_source"] = None  # Bound to the live database; re-attached after loading
+        return state
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __contains__(self, vector_id: str) -> bool:
+        return vector_id in self.store
+
+    @property
+    def is_trained(self) -> bool:
+        return isinstance(self.store, _CodeIndex)
+
+    def _new_quantizer(self):
+        if self.quantizer == "pq":
+            return ProductQuantizer(
+                m=self.m, nbits=self.nbits, n_iter=self.n_iter, seed=int(self.rng.integers(2**31))
+            )
+        return ScalarQuantizer()
+
+    def add_vector(self, vector: List[float], vector_id: str):
+        self.store.add_vector(vector, vector_id)
+        self.dim = self.store.dim
+        if not self.is_trained and len(self.store) >= self.train_size:
+            self.train()
+
+    def update_vector(self, vector: List[float], vector_id: str):
+        self.add_vector(vector, vector_id)
+
+    def remove_vector(self, vector_id: str) -> bool:
+        return self.store.remove_vector(vector_id)
+
+    def train(self, sample: Optional[np.ndarray] = None):
+        """Fit the quantizer (on ``sample`` if given, else on the buffered vectors)
+        and re-encode the buffered vectors as codes."""
+        if self.is_trained or not len(self.store):
+            return
+        ids, data = self.store.vectors()
+        if sample is not None:
+            sample = np.asarray(sample, dtype=np.float32)
+            sample = sample / (np.linalg.norm(sample, axis=1, keepdims=True) + 1e-10)
+        else:
+            sample = data
+        if len(sample) > self.max_train_sample:
+            sample = sample[self.rng.choice(len(sample), self.max_train_sample, replace=False)]
+
+        quantizer = self._new_quantizer()
+        quantizer.train(sample)
+        codes = _CodeIndex(quantizer)
+        codes.extend(ids, data)
+        self.store = codes
+
+    def _rescore(self, query: List[float], candidates: List[Tuple[str, float]], k: int) -> List[Tuple[str, float]]:
+        source = self.vector_source
+        if source is None or not candidates:
+            return candidates[:k]
+        ids = [vector_id for vector_id, _ in candidates]
+        metrics.count("candidates", len(ids))
+        found, vectors = [], []
+        for vector_id, vector in zip(ids, source(ids)):
+            if vector is not None and len(vector) == self.dim:
+                found.append(vector_id)
+                vectors.append(vector)
+        if not found:
+            return []
+        matrix = np.asarray(vectors, dtype=np.float32)
+        metrics.count("scored_vectors", len(matrix))
+        scores = (matrix @ FlatIndex.normalize(query)) / (np.linalg.norm(matrix, axis=1) + 1e-10)
+        return [(found[i], float(scores[i])) for i in top_k(scores, k)]
+
+    def search(self, query: List[float], k: int = 5) -> List[Tuple[str, float]]:
+        store = self.store
+        if not isinstance(store, _CodeIndex):
+            return store.search(query, k)
+        return self._rescore(query, store.search(query, k * self.rerank), k)
+
+    def search_subset(self, query: List[float], vector_ids: List[str], k: int = 5) -> List[Tuple[str, float]]:
+        store = self.store
+        if not isinstance(store, _CodeIndex):
+            return store.search_subset(query, vector_ids, k)
+        return self._rescore(query, store.search_subset(query, vector_ids, k * self.rerank), k)
@@ -0,0 +1,365 @@
+import bisect
+import json
+import logging
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+
+
+class Gauge:
+    """Current value per label combination."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def set(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination, as Prometheus exposes them."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS, labels: Sequence[str] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.label_names = tuple(labels)
+        # Per label combination: per-bucket (not yet cumulative) counts, the +Inf slot last, then the sum.
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[slot] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = 'le="%s"' % (bound if isinstance(bound, str) else _number(bound))
+                yield f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, key)} {_number(counts[-1])}"
+            yield f"{self.name}_count{_labels(self.label_names, key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """The Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+EMBEDDING_SECONDS = REGISTRY.register(
+    Histogram("vectordb_embedding_seconds", "Time to embed one request's texts.", labels=("input_type",))
+)
+EMBEDDED_TEXTS = REGISTRY.register(
+    Counter("vectordb_embedded_texts_total", "Texts sent to the embedding provider.", labels=("input_type",))
+)
+SEARCH_SECONDS = REGISTRY.register(
+    Histogram("vectordb_index_search_seconds", "Time spent inside the index for one search.", labels=("index",))
+)
+SEARCH_CANDIDATES = REGISTRY.register(
+    Histogram(
+        "vectordb_search_candidates",
+        "Vectors short-listed for exact scoring per search (filter matches, LSH buckets, re-rank candidates).",
+        buckets=COUNT_BUCKETS,
+        labels=("index",),
+    )
+)
+SCORED_VECTORS = REGISTRY.register(
+    Histogram(
+        "vectordb_search_scored_vectors",
+        "Similarity computations per search.",
+        buckets=COUNT_BUCKETS,
+        labels=("index",),
+    )
+)
+LOCK_WAIT_SECONDS = REGISTRY.register(
+    Histogram("vectordb_lock_wait_seconds", "Time writers waited for the database write lock.")
+)
+LOCK_HOLD_SECONDS = REGISTRY.register(
+    Histogram("vectordb_lock_hold_seconds", "Time writers held the database write lock.")
+)
+WAL_COMMIT_SECONDS = REGISTRY.register(
+    Histogram("vectordb_wal_commit_seconds", "Time writes waited for their log records to be fsynced.")
+)
+WAL_WRITE_ERRORS = REGISTRY.register(
+    Counter("vectordb_wal_write_errors_total", "Failed write-ahead log writes or fsyncs; the batch is retried.")
+)
+CHECKPOINT_SECONDS = REGISTRY.register(
+    Histogram("vectordb_checkpoint_seconds", "Duration of snapshot checkpoints (save_to_disk).")
+)
+RESULT_CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "vectordb_result_cache_requests_total",
+        "Search result cache lookups by outcome (hit, miss, stale, expired).",
+        labels=("result",),
+    )
+)
+RESULT_CACHE_EVICTIONS = REGISTRY.register(
+    Counter("vectordb_result_cache_evictions_total", "Search results evicted from the cache to stay under its size.")
+)
+EMBEDDING_CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "vectordb_embedding_cache_requests_total",
+        "Embedding cache lookups by outcome (hit, disk_hit, miss).",
+        labels=("result",),
+    )
+)
+EMBEDDING_CACHE_EVICTIONS = REGISTRY.register(
+    Counter(
+        "vectordb_embedding_cache_evictions_total", "Embeddings evicted from the memory tier to stay under its size."
+    )
+)
+EMBEDDING_CACHE_ENTRIES = REGISTRY.register(
+    Gauge("vectordb_embedding_cache_entries", "Embeddings held in the memory tier of the embedding cache.")
+)
+EMBEDDING_CACHE_BYTES = REGISTRY.register(
+    Gauge("vectordb_embedding_cache_bytes", "Estimated size of the memory tier of the embedding cache.")
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram("vectordb_http_request_seconds", "HTTP request latency.", labels=("method", "route", "status"))
+)
+
+
+class Trace:
+    """Stage timings and counts collected over one request."""
+
+    __slots__ = ("stages", "counts")
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("vectordb_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def count(name: str, n: int):
+    """Add ``n`` to the current trace's ``name`` count; a no-op outside one."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.counts[name] = trace.counts.get(name, 0) + n
+
+
+def record(stage: str, seconds: float):
+    """Add ``seconds`` to the current trace's ``stage``; a no-op outside one."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def traced(trace: Optional[Trace] = None) -> Iterator[Trace]:
+    """Collect stages and counts into ``trace`` (a new one by default) within the block."""
+    trace = trace or Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def searching(index: str):
+    """Observe the time and the candidate and scored-vector counts that an index
+    search reports (through ``count``) within the block, labelled ``index``."""
+    trace = _trace.get()
+    token = None
+    if trace is None:
+        trace = Trace()
+        token = _trace.set(trace)
+    candidates = trace.counts.get("candidates", 0)
+    scored = trace.counts.get("scored_vectors", 0)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        trace.add("index_search", elapsed)
+        SEARCH_SECONDS.observe(elapsed, index=index)
+        candidates = trace.counts.get("candidates", 0) - candidates
+        if candidates:
+            SEARCH_CANDIDATES.observe(candidates, index=index)
+        scored = trace.counts.get("scored_vectors", 0) - scored
+        if scored:
+            SCORED_VECTORS.observe(scored, index=index)
+        if token is not None:
+            _trace.reset(token)
+
+
+class SlowQueryProfiler:
+    """Traces a sampled fraction of requests and logs the stage breakdown of
+    those slower than ``threshold`` seconds; ``threshold`` 0 disables it.
+
+    Time not attributed to a stage ("other") is routing, validation and
+    response serialization.
+    """
+
+    def __init__(self, threshold: float = 0.0, sample_rate: float = 1.0):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 and self.sample_rate > 0
+
+    def sample(self) -> Optional[Trace]:
+        if not self.enabled or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return None
+        return Trace()
+
+    def report(self, trace: Trace, method: str, route: str, status: int, seconds: float):
+        if seconds < self.threshold:
+            return
+        stages = {stage: round(value * 1000, 3) for stage, value in trace.stages.items()}
+        stages["other"] = round(max(seconds - sum(trace.stages.values()), 0.0) * 1000, 3)
+        logger.warning(
+            "slow request %s",
+            json.dumps(
+                {
+                    "method": method,
+                    "route": route,
+                    "status": status,
+                    "total_ms": round(seconds * 1000, 3),
+                    "stages_ms": stages,
+                    "counts": trace.counts,
+                }
+            ),
+        )
+
+
+class TraceMiddleware:
+    """ASGI middleware observing each request's latency by route template and
+    handing the requests ``profiler`` samples a trace to collect stages into."""
+
+    def __init__(self, app, profiler: SlowQueryProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        trace = self.profiler.sample()
+        token = _trace.set(trace) if trace is not None else None
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - start
+            if token is not None:
+                _trace.reset(token)
+            # The router records the matched route in the scope; raw paths would carry ids.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status)
+            if trace is not None:
+                self.profiler.report(trace, scope["method"], route, status, elapsed)
@@ -0,0 +1,617 @@
+import datetime
+import math
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import orjson
+
+# Field kinds: "id" is the record's key; "ref" is another record's id, interned
+# to a number; "text" and "json" are bytes in the table's arena; "time" is an
+# ISO timestamp, kept as microseconds; "vector" is a float32 embedding.
+LIBRARY_SCHEMA = {
+    "id": "id",
+    "name": "text",
+    "metadata": "json",
+    "index_type": "ref",
+    "index_params": "json",
+    "created_at": "time",
+}
+DOCUMENT_SCHEMA = {"id": "id", "library_id": "ref", "title": "text", "metadata": "json", "created_at": "time"}
+CHUNK_SCHEMA = {
+    "id": "id",
+    "document_id": "ref",
+    "library_id": "ref",
+    "content": "text",
+    "embedding": "vector",
+    "metadata": "json",
+    "created_at": "time",
+}
+
+NO_VECTOR = np.iinfo(np.int64).min
+START = ".start"  # Column of each row's offset in the arena
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+class _Missing:
+    """Marks a schema field a record did not have."""
+
+    def __reduce__(self):
+        return "MISSING"
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+@lru_cache(maxsize=4096)
+def _format_time(micros: int) -> str:
+    return (EPOCH + datetime.timedelta(microseconds=micros)).isoformat()
+
+
+def _encode_time(value: Any) -> Optional[int]:
+    """Microseconds since the epoch, or None unless ``value`` is a UTC ISO
+    timestamp that ``_format_time`` gives back unchanged."""
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.utcoffset() != datetime.timedelta(0):
+        return None
+    micros = (moment - EPOCH) // ONE_MICROSECOND
+    return micros if _format_time(micros) == value else None
+
+
+def _has_non_finite(value: Any) -> bool:
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(_has_non_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_non_finite(item) for item in value)
+    return False
+
+
+class _State:
+    """The columns of a ``RecordTable``.
+
+    Rows are written once, before their id is published in ``rows``, and never
+    changed after; an update appends a new row. Writers only append, growing
+    arrays into copies assigned in place. Whatever renumbers rows or moves
+    vectors (compaction, adopting a snapshot's vectors) builds a new state, so a
+    reader holding one sees every row it reaches unchanged.
+    """
+
+    __slots__ = (
+        "rows",
+        "ids",
+        "columns",
+        "arena",
+        "arena_size",
+        "strings",
+        "string_numbers",
+        "keys",
+        "key_numbers",
+        "extras",
+        "base",
+        "tail",
+        "tail_size",
+        "dim",
+    )
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.rows: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.columns = columns
+        self.arena = np.zeros(0, dtype=np.uint8)
+        self.arena_size = 0
+        # Interned ref values and json key tuples, shared by all of a row's fields.
+        self.strings: List[str] = []
+        self.string_numbers: Dict[str, int] = {}
+        self.keys: List[tuple] = []
+        self.key_numbers: Dict[tuple, int] = {}
+        # Per row, fields kept as Python objects: those the columns cannot
+        # represent exactly, fields missing from the record, and fields not in the schema.
+        self.extras: Dict[int, dict] = {}
+        # Vectors: a locator >= 0 is a row of ``base`` (a snapshot's memory-mapped
+        # matrix), one < 0 is row ``-locator - 1`` of the in-memory ``tail``.
+        self.base: Optional[np.ndarray] = None
+        self.tail: Optional[np.ndarray] = None
+        self.tail_size = 0
+        self.dim: Optional[int] = None
+
+    def copy(self) -> "_State":
+        state = _State(dict(self.columns))
+        for name in self.__slots__:
+            if name != "columns":
+                setattr(state, name, getattr(self, name))
+        state.rows = dict(self.rows)
+        return state
+
+
+class RecordTable:
+    """Records of one table, stored by column instead of as a dict each.
+
+    Each record is a row: external string ids map to row numbers, ref and time
+    fields are int arrays, text and json fields are UTF-8 bytes in one arena
+    (json as its values, with the key tuple interned), and vectors are rows of a
+    float32 matrix. Values the columns cannot hold exactly (non-UTC times,
+    metadata with NaN or infinities, extra fields) are kept as they are on the
+    side. Rows superseded by updates or deletes are dropped once they pass
+    ``compact_threshold`` of the rows.
+
+    The table reads like the ``Dict[str, dict]`` it replaces: ``get``,
+    ``[]``, ``values`` and ``items`` build a fresh dict view per record, and
+    ``table[id] = record`` stores one. Writes must be serialized by the caller;
+    reads need no lock.
+    """
+
+    def __init__(self, schema: Dict[str, str], compact_threshold: float = 0.25):
+        self.schema = schema
+        self.compact_threshold = compact_threshold
+        self._fields = [(field, kind) for field, kind in schema.items() if kind != "id"]
+        self._vector = next((field for field, kind in self._fields if kind == "vector"), None)
+        self._refs = [field for field, kind in self._fields if kind == "ref"]
+        self._payload_fields = [field for field, kind in self._fields if kind in ("text", "json")]
+        self._state = _State(self._empty_columns(0))
+
+    def _empty_columns(self, capacity: int) -> Dict[str, np.ndarray]:
+        columns = {START: np.zeros(capacity, dtype=np.int64)}
+        for field, kind in self._fields:
+            columns[field] = np.zeros(capacity, dtype=np.int64 if kind in ("time", "vector") else np.int32)
+            if kind == "json":
+                columns[field + ".keys"] = np.zeros(capacity, dtype=np.int32)
+        return columns
+
+    @classmethod
+    def from_records(cls, schema: Dict[str, str], records: Iterable[dict]) -> "RecordTable":
+        table = cls(schema)
+        for record in records:
+            table[record["id"]] = record
+        return table
+
+    # === READING ===
+    def __len__(self) -> int:
+        return len(self._state.rows)
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self._state.rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._state.rows))
+
+    def __getitem__(self, record_id: str) -> dict:
+        record = self.get(record_id)
+        if record is None:
+            raise KeyError(record_id)
+        return record
+
+    def get(self, record_id: str, default: Any = None) -> Any:
+        record = self.view(record_id)
+        return default if record is None else record
+
+    def view(self, record_id: str, skip: Sequence[str] = ()) -> Optional[dict]:
+        """The record as a new dict, without the fields in ``skip``; None if absent."""
+        state = self._state
+        row = state.rows.get(record_id)
+        return None if row is None else self._record(state, row, skip)
+
+    def values(self) -> Iterator[dict]:
+        state = self._state
+        for row in list(state.rows.values()):
+            yield self._record(state, row)
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        state = self._state
+        for row in list(state.rows.values()):
+            yield state.ids[row], self._record(state, row)
+
+    def column(self, field: str) -> Iterator[Tuple[str, Any]]:
+        """``(id, value)`` of ``field`` for every record, reading only that field."""
+        state = self._state
+        rows = list(state.rows.values())
+        if self.schema.get(field) != "ref":
+            skip = [name for name in self.schema if name not in ("id", field)]
+            for row in rows:
+                yield state.ids[row], self._record(state, row, skip).get(field)
+            return
+        numbers = state.columns[field][np.asarray(rows, dtype=np.int64)].tolist()
+        strings, extras = state.strings, state.extras
+        for row, number in zip(rows, numbers):
+            extra = extras.get(row) if extras else None
+            if extra is not None and field in extra:
+                yield state.ids[row], extra[field]
+            else:
+                yield state.ids[row], strings[number] if number >= 0 else None
+
+    def vectors(self, record_ids: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """The vector field of each of ``record_ids`` (None for absent ones),
+        without building the records."""
+        state = self._state
+        rows, extras = state.rows, state.extras
+        locators = state.columns[self._vector]
+        vectors = []
+        for record_id in record_ids:
+            row = rows.get(record_id)
+            extra = extras.get(row) if extras and row is not None else None
+            if row is None:
+                vectors.append(None)
+            elif extra is not None and self._vector in extra:
+                value = extra[self._vector]
+                vectors.append(None if value is MISSING else value)
+            else:
+                vectors.append(self._locate(state, locators.item(row)))
+        return vectors
+
+    @staticmethod
+    def _locate(state: _State, locator: int) -> Optional[np.ndarray]:
+        if locator >= 0:
+            return state.base[locator]
+        if locator != NO_VECTOR:
+            return state.tail[-locator - 1]
+        return None
+
+    def _record(self, state: _State, row: int, skip: Sequence[str] = ()) -> dict:
+        columns = state.columns
+        extra = state.extras.get(row) if state.extras else None
+        start = columns[START].item(row)
+        size = sum(columns[field].item(row) for field in self._payload_fields)
+        payload = state.arena[start : start + size].tobytes()
+        offset = 0
+        record = {"id": state.ids[row]}
+        for field, kind in self._fields:
+            if extra is not None and field in extra:
+                # Kept out of the columns, and of the arena.
+                value = extra[field]
+                if value is not MISSING and field not in skip:
+                    record[field] = value
+                continue
+            if kind == "text":
+                length = columns[field].item(row)
+                if field not in skip:
+                    record[field] = payload[offset : offset + length].decode()
+                offset += length
+            elif kind == "json":
+                length = columns[field].item(row)
+                if field not in skip:
+                    keys = state.keys[columns[field + ".keys"].item(row)]
+                    values = orjson.loads(payload[offset : offset + length]) if keys else ()
+                    record[field] = dict(zip(keys, values))
+                offset += length
+            elif field in skip:
+                continue
+            elif kind == "ref":
+                number = columns[field].item(row)
+                record[field] = state.strings[number] if number >= 0 else None
+            elif kind == "time":
+                record[field] = _format_time(columns[field].item(row))
+            else:
+                record[field] = self._locate(state, columns[field].item(row))
+        if extra is not None:
+            for field, value in extra.items():
+                if field not in self.schema and field not in skip:
+                    record[field] = value
+        return record
+
+    # === WRITING ===
+    def __setitem__(self, record_id: str, record: dict):
+        state = self._state
+        row = len(state.ids)
+        self._reserve(state, row + 1)
+        columns = state.columns
+        extra = {}
+        payload = []
+        for field, kind in self._fields:
+            value = record.get(field, MISSING)
+            column = columns[field]
+            # What a field stored in ``extra`` leaves in its columns.
+            column[row] = -1 if kind == "ref" else NO_VECTOR if kind == "vector" else 0
+            if kind == "json":
+                columns[field + ".keys"][row] = -1
+            if value is MISSING:
+                extra[field] = MISSING
+            elif kind == "ref":
+                if isinstance(value, str):
+                    column[row] = self._intern(state.strings, state.string_numbers, value)
+                elif value is not None:
+                    extra[field] = value
+            elif kind == "text":
+                try:
+                    data = value.encode()
+                except (AttributeError, UnicodeEncodeError):
+                    extra[field] = value
+                    continue
+                column[row] = len(data)
+                payload.append(data)
+            elif kind == "json":
+                if not isinstance(value, dict):
+                    extra[field] = value
+                    continue
+                try:
+                    data = orjson.dumps(list(value.values())) if value else b""
+                except TypeError:
+                    extra[field] = value
+                    continue
+                # orjson writes NaN and infinities as null; such values are kept as they are instead.
+                if b"null" in data and _has_non_finite(value):
+                    extra[field] = value
+                    continue
+                column[row] = len(data)
+                columns[field + ".keys"][row] = self._intern(state.keys, state.key_numbers, tuple(value))
+                payload.append(data)
+            elif kind == "time":
+                micros = _encode_time(value)
+                if micros is None:
+                    extra[field] = value
+                else:
+                    column[row] = micros
+            else:
+                locator = self._append_vector(state, value)
+                if locator == NO_VECTOR:
+                    extra[field] = value
+                column[row] = locator
+        for field, value in record.items():
+            if field not in self.schema:
+                extra[field] = value
+
+        data = b"".join(payload)
+        self._reserve_bytes(state, len(data))
+        columns[START][row] = state.arena_size
+        state.arena[state.arena_size : state.arena_size + len(data)] = np.frombuffer(data, dtype=np.uint8)
+        state.arena_size += len(data)
+        if extra:
+            state.extras[row] = extra
+        state.ids.append(record_id)
+        # Publishing the row: readers find it from here on.
+        replaced = state.rows.get(record_id) is not None
+        state.rows[record_id] = row
+        if replaced:
+            self._maybe_compact()
+
+    def __delitem__(self, record_id: str):
+        del self._state.rows[record_id]
+        self._maybe_compact()
+
+    def pop(self, record_id: str, *default: Any) -> Any:
+        state = self._state
+        row = state.rows.get(record_id)
+        if row is None:
+            if default:
+                return default[0]
+            raise KeyError(record_id)
+        record = self._record(state, row)
+        del self[record_id]
+        return record
+
+    @staticmethod
+    def _intern(values: list, numbers: dict, value) -> int:
+        number = numbers.get(value)
+        if number is None:
+            number = len(values)
+            values.append(value)
+            numbers[value] = number
+        return number
+
+    def _append_vector(self, state: _State, value: Any) -> int:
+        """The locator of ``value`` appended to the tail; NO_VECTOR if it does not fit the matrix."""
+        try:
+            vector = np.asarray(value, dtype=np.float32)
+        except (TypeError, ValueError):
+            return NO_VECTOR
+        if vector.ndim != 1 or not len(vector):
+            return NO_VECTOR
+        if state.dim is None:
+            state.dim = len(vector)
+            state.tail = np.zeros((0, state.dim), dtype=np.float32)
+        if len(vector) != state.dim:
+            return NO_VECTOR
+        if state.tail_size == len(state.tail):
+            tail = np.zeros((max(2 * len(state.tail), 64), state.dim), dtype=np.float32)
+            tail[: state.tail_size] = state.tail[: state.tail_size]
+            state.tail = tail
+        state.tail[state.tail_size] = vector
+        state.tail_size += 1
+        return -state.tail_size
+
+    @staticmethod
+    def _reserve(state: _State, rows: int):
+        capacity = len(state.columns[START])
+        if rows <= capacity:
+            return
+        capacity = max(2 * capacity, rows, 64)
+        for name, column in list(state.columns.items()):
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[: len(column)] = column
+            state.columns[name] = grown
+
+    @staticmethod
+    def _reserve_bytes(state: _State, size: int):
+        if state.arena_size + size <= len(state.arena):
+            return
+        arena = np.zeros(max(2 * len(state.arena), state.arena_size + size, 4096), dtype=np.uint8)
+        arena[: state.arena_size] = state.arena[: state.arena_size]
+        state.arena = arena
+
+    # === COMPACTION ===
+    def _maybe_compact(self):
+        state = self._state
+        superseded = len(state.ids) - len(state.rows)
+        if superseded and superseded >= self.compact_threshold * len(state.ids):
+            self._state = self._compacted(state)
+
+    def _live_rows(self, state: _State) -> np.ndarray:
+        return np.fromiter(state.rows.values(), dtype=np.int64, count=len(state.rows))
+
+    def _compacted(self, state: _State) -> _State:
+        """A state holding only the rows of live records, renumbered densely in
+        their current order, with vectors kept in ``base`` or copied into a fresh tail."""
+        fresh = self._gather(state, self._live_rows(state))
+        if self._vector is not None:
+            locators = fresh.columns[self._vector]
+            in_tail = np.flatnonzero((locators < 0) & (locators != NO_VECTOR))
+            fresh.dim, fresh.base = state.dim, state.base
+            if state.tail is not None:
+                fresh.tail = state.tail[-locators[in_tail] - 1]
+                fresh.tail_size = len(in_tail)
+                locators[in_tail] = -np.arange(1, len(in_tail) + 1)
+        return fresh
+
+    def _gather(self, state: _State, live: np.ndarray) -> _State:
+        """A new state with the rows ``live`` of ``state``, in that order. Vector
+        locators are copied as they are; interned values no row uses are dropped.
+        Safe without the writers' lock: only rows already written are read."""
+        fresh = _State({name: column[live] for name, column in list(state.columns.items())})
+        fresh.ids = [state.ids[row] for row in live.tolist()]
+        fresh.rows = dict(zip(fresh.ids, range(len(fresh.ids))))
+
+        # The payloads, copied one run of adjacent rows at a time.
+        lengths = np.zeros(len(live), dtype=np.int64)
+        for field in self._payload_fields:
+            lengths += fresh.columns[field]
+        starts = fresh.columns[START]
+        ends = starts + lengths
+        fresh.columns[START] = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)[: len(live)]
+        breaks = (np.flatnonzero(starts[1:] != ends[:-1]) + 1).tolist()
+        arena = state.arena
+        pieces = [
+            arena[starts[first] : ends[last - 1]]
+            for first, last in zip([0] + breaks, breaks + [len(live)])
+            if last > first
+        ]
+        fresh.arena = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.uint8)
+        fresh.arena_size = len(fresh.arena)
+
+        fresh.strings, fresh.string_numbers = self._reintern(
+            state.strings, [fresh.columns[field] for field in self._refs]
+        )
+        fresh.keys, fresh.key_numbers = self._reintern(
+            state.keys, [fresh.columns[field + ".keys"] for field, kind in self._fields if kind == "json"]
+        )
+
+        if state.extras:
+            position = np.full(len(state.ids), -1, dtype=np.int64)
+            position[live] = np.arange(len(live))
+            for row, extra in list(state.extras.items()):
+                # A concurrent write records a row's extras before its id: such rows are past ``position``.
+                if row < len(position) and position[row] >= 0:
+                    fresh.extras[int(position[row])] = extra
+        return fresh
+
+    @staticmethod
+    def _reintern(values: list, columns: List[np.ndarray]) -> Tuple[list, dict]:
+        """Renumber ``columns`` (in place) to the values they still use."""
+        used = np.unique(np.concatenate([column[column >= 0] for column in columns])) if columns else []
+        mapping = np.full(len(values), -1, dtype=np.int32)
+        mapping[used] = np.arange(len(used), dtype=np.int32)
+        for column in columns:
+            column[column >= 0] = mapping[column[column >= 0]]
+        kept = [values[number] for number in np.asarray(used).tolist()]
+        return kept, {value: number for number, value in enumerate(kept)}
+
+    # === SNAPSHOTS ===
+    def freeze(self) -> "FrozenTable":
+        """The records as of now, to write out without the lock; call with writes held off."""
+        state = self._state
+        return FrozenTable(state, self._live_rows(state), len(state.ids), self)
+
+    def adopt(self, frozen: "FrozenTable", vectors: np.ndarray):
+        """Serve the vectors ``frozen`` wrote (``FrozenTable.write_vectors``) from
+        ``vectors``, their rows of the snapshot, freeing their in-memory copies;
+        a no-op if rows were renumbered since. Call with writes held off."""
+        state = self._state
+        if state is not frozen.state or self._vector is None:
+            return
+        fresh = state.copy()
+        locators = fresh.columns[self._vector] = state.columns[self._vector].copy()
+        locators[frozen.vector_rows()] = np.arange(len(vectors))
+        # Rows written since the freeze keep their vectors, in a tail of their own.
+        live = self._live_rows(state)
+        later = live[live >= frozen.size]
+        in_tail = later[(locators[later] < 0) & (locators[later] != NO_VECTOR)]
+        fresh.tail = state.tail[-locators[in_tail] - 1]
+        fresh.tail_size = len(in_tail)
+        locators[in_tail] = -np.arange(1, len(in_tail) + 1)
+        fresh.base = vectors
+        self._state = fresh
+
+    @classmethod
+    def restore(cls, data: dict, vectors: Optional[np.ndarray] = None) -> "RecordTable":
+        """The table ``FrozenTable.columns`` was taken from, with vectors served from ``vectors``."""
+        table = cls(data["schema"])
+        state = table._state
+        state.ids = data["ids"]
+        state.rows = dict(zip(state.ids, range(len(state.ids))))
+        state.columns = data["columns"]
+        state.arena = data["arena"]
+        state.arena_size = len(state.arena)
+        state.strings = data["strings"]
+        state.string_numbers = {value: number for number, value in enumerate(state.strings)}
+        state.keys = data["keys"]
+        state.key_numbers = {value: number for number, value in enumerate(state.keys)}
+        state.extras = data["extras"]
+        state.dim = data["dim"]
+        if state.dim is not None:
+            state.base = vectors
+            state.tail = np.zeros((0, state.dim), dtype=np.float32)
+        return table
+
+
+class FrozenTable:
+    """The live records of a ``RecordTable`` at ``freeze``. Rows are never
+    changed once written, so these are read without the lock."""
+
+    def __init__(self, state: _State, live: np.ndarray, size: int, table: RecordTable):
+        self.state = state
+        self.live = live
+        self.size = size
+        self.table = table
+
+    @property
+    def dim(self) -> int:
+        return self.state.dim or 0
+
+    def vector_rows(self) -> np.ndarray:
+        """The rows whose vectors ``write_vectors`` writes, in that order."""
+        if self.table._vector is None:
+            return self.live[:0]
+        return self.live[self.state.columns[self.table._vector][self.live] != NO_VECTOR]
+
+    def write_vectors(self, file, block_rows: int = 65536) -> int:
+        """Write the vectors as one row-major float32 matrix; returns its row count."""
+        rows = self.vector_rows()
+        state = self.state
+        for start in range(0, len(rows), block_rows):
+            locators = state.columns[self.table._vector][rows[start : start + block_rows]]
+            block = np.empty((len(locators), state.dim), dtype=np.float32)
+            in_base = locators >= 0
+            if in_base.any():
+                block[in_base] = state.base[locators[in_base]]
+            if not in_base.all():
+                block[~in_base] = state.tail[-locators[~in_base] - 1]
+            file.write(block.tobytes())
+        return len(rows)
+
+    def columns(self) -> dict:
+        """The records as dense columns, for ``RecordTable.restore``; vector
+        locators number the rows of ``write_vectors``."""
+        fresh = self.table._gather(self.state, self.live)
+        vector = self.table._vector
+        if vector is not None:
+            locators = fresh.columns[vector]
+            has = locators != NO_VECTOR
+            locators[has] = np.arange(int(has.sum()))
+        return {
+            "schema": self.table.schema,
+            "ids": fresh.ids,
+            "columns": fresh.columns,
+            "arena": fresh.arena,
+            "strings": fresh.strings,
+            "keys": fresh.keys,
+            "extras": fresh.extras,
+            "dim": self.state.dim,
+        }
@@ -0,0 +1,122 @@
+import json
+import time
+import unicodedata
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Optional, Tuple
+
+from app.core import metrics
+from app.core.config import RESULT_CACHE_SIZE, RESULT_CACHE_TTL
+
+
+def normalize_query(query: str) -> str:
+    """Unicode-normalized with runs of whitespace collapsed; case is kept, as
+    embedding models and BM25 tokenization may not ignore it."""
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+def search_key(
+    library_id: str, mode: str, query: str, k: int, filters: Optional[dict] = None, embeddings: bool = False
+) -> Tuple:
+    return (
+        library_id,
+        mode,
+        normalize_query(query),
+        k,
+        json.dumps(filters, sort_keys=True) if filters else None,
+        embeddings,
+    )
+
+
+class ResultCache:
+    """Size-bounded LRU cache of search results with a TTL.
+
+    Each entry is stored with the version its library had when the search
+    started (``VectorDB.library_version``), and is only served while the
+    library is still at that version: any change to its chunks moves the
+    version on, so stale results are never returned and nothing needs
+    flushing. Superseded entries are dropped when next looked up, or age out.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[Hashable, float, Any]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: Hashable, version: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                result = "miss"
+                self.misses += 1
+            elif entry[0] != version:
+                result = "stale"
+                self.stale += 1
+                del self._entries[key]
+            elif entry[1] <= time.monotonic():
+                result = "expired"
+                self.expired += 1
+                del self._entries[key]
+            else:
+                result = "hit"
+                self.hits += 1
+                self._entries.move_to_end(key)
+        metrics.RESULT_CACHE_REQUESTS.inc(result=result)
+        return entry[2] if result == "hit" else None
+
+    def put(self, key: Hashable, version: Hashable, value: Any):
+        if not self.enabled:
+            return
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            metrics.RESULT_CACHE_EVICTIONS.inc(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.stale + self.expired
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+
+_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
@@ -0,0 +1,642 @@
+import asyncio
+import heapq
+import json
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Queue
+from threading import Condition, Event, Lock, Thread
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+import numpy as np
+
+from app.core.config import (
+    REBALANCE_INTERVAL,
+    SHARD_CONNECTIONS,
+    SHARD_PARTITION_CHUNKS,
+    SHARDS,
+    STORAGE_PATH,
+)
+from app.core.v_db import VectorDB, decode_cursor, encode_cursor
+from app.services.embedding import Embedder, aembed_texts, embed_texts
+
+logger = logging.getLogger(__name__)
+
+
+def _portable(error: Exception) -> Exception:
+    """``error``, or a RuntimeError describing it if it would not survive the
+    trip back to the router (exceptions whose constructor takes other arguments
+    than ``args`` do not unpickle)."""
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _serve(connections, storage_path: str):
+    """Shard worker process: one database, one thread per router connection.
+
+    Exits, closing the database, once the router has closed every connection.
+    """
+    db = VectorDB(storage_path=storage_path)
+
+    def handle(conn):
+        while True:
+            try:
+                method, args, kwargs = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", getattr(db, method)(*args, **kwargs))
+            except Exception as e:
+                reply = ("error", _portable(e))
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                return
+            except Exception as e:
+                # The reply did not pickle; nothing was written, so the router still waits for one.
+                try:
+                    conn.send(("error", RuntimeError(f"{method}: reply could not be sent ({type(e).__name__})")))
+                except Exception:
+                    conn.close()  # The router sees the connection drop instead of waiting forever
+                    return
+
+    threads = [Thread(target=handle, args=(conn,), daemon=True) for conn in connections]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.close()
+
+
+class _Shard:
+    """Router-side handle on one shard worker, with a pool of connections to it."""
+
+    def __init__(self, number: int, storage_path: Path, connections: int, context):
+        self.number = number
+        pipes = [context.Pipe() for _ in range(connections)]
+        self.process = context.Process(
+            target=_serve,
+            args=([worker for _, worker in pipes], str(storage_path)),
+            daemon=True,
+            name=f"vectordb-shard-{number}",
+        )
+        self.process.start()
+        self.connections = [router for router, _ in pipes]
+        self.idle: Queue = Queue()
+        for router, worker in pipes:
+            worker.close()  # The worker holds its own copy
+            self.idle.put(router)
+
+    def call(self, method: str, *args, **kwargs):
+        conn = self.idle.get()
+        try:
+            # Pickling happens before anything is written and a reply is read whole before it is unpickled,
+            # so a request or reply that fails to (un)pickle leaves the connection in step.
+            conn.send((method, args, kwargs))
+            status, value = conn.recv()
+        except (EOFError, OSError):
+            raise RuntimeError(f"Shard {self.number} is not running")
+        finally:
+            # A dead connection goes back too: later calls fail on it at once rather than waiting for it.
+            self.idle.put(conn)
+        if status == "error":
+            raise value
+        return value
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.process.join()
+
+
+class _WriteGate:
+    """Writes run concurrently with each other but never while data is moving."""
+
+    def __init__(self):
+        self._cond = Condition()
+        self._writers = 0
+        self._moving = False
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._moving)
+            self._writers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def move(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._moving)
+            self._moving = True
+            self._cond.wait_for(lambda: not self._writers)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._moving = False
+                self._cond.notify_all()
+
+
+def _path(record: dict, depth: int) -> Tuple[str, ...]:
+    """A record's key path in the hierarchy (see ``VectorDB.iter_libraries``)."""
+    if depth == 0:
+        return (record["id"],)
+    if depth == 1:
+        return (record["library_id"], record["id"])
+    return (record["library_id"], record["document_id"], record["id"])
+
+
+def _merge_hits(results: Sequence[List[Tuple[dict, float]]], k: int) -> List[Tuple[dict, float]]:
+    """Top ``k`` of several shards' hits; a chunk caught mid-move counts once."""
+    merged, seen = [], set()
+    for chunk, score in sorted((hit for hits in results for hit in hits), key=lambda hit: hit[1], reverse=True):
+        if chunk["id"] not in seen:
+            seen.add(chunk["id"])
+            merged.append((chunk, score))
+            if len(merged) == k:
+                break
+    return merged
+
+
+class ShardedVectorDB:
+    """The ``VectorDB`` interface over libraries spread across worker processes.
+
+    Each of ``n_shards`` shards is a process owning a ``VectorDB`` under
+    ``storage_path/shard-<n>``, so ingest and search run on as many cores as
+    there are shards instead of under one GIL. A library lives on one shard
+    until it holds more than ``partition_chunks`` chunks per shard, and is then
+    hash-partitioned by document: a document and its chunks live on
+    ``placement[library_id][crc32(document_id) % len(placement[library_id])]``.
+
+    Searches scatter to the shards of the library and merge their top k. BM25
+    statistics are per shard, so lexical and hybrid scores of a partitioned
+    library are merged approximately. Lookups by document or chunk id ask every
+    shard. Listings merge the shards' keyset-ordered pages, so cursors work as
+    they do unsharded.
+
+    ``rebalance`` (every ``rebalance_interval`` seconds) partitions libraries
+    that outgrew their shards, then moves whole libraries from the most to the
+    least loaded shard while the loads differ by more than ``imbalance`` of the
+    mean. Data is copied, the placement switched, then the source copies are
+    deleted; writes wait while data moves, reads do not.
+
+    The placement is owned by this router and kept in ``placement.json``, so
+    exactly one process routes (a single API worker); scale with shards.
+    """
+
+    def __init__(
+        self,
+        n_shards: int = SHARDS,
+        storage_path: str = STORAGE_PATH,
+        connections: int = SHARD_CONNECTIONS,
+        partition_chunks: int = SHARD_PARTITION_CHUNKS,
+        rebalance_interval: float = REBALANCE_INTERVAL,
+        imbalance: float = 0.2,
+        embedder: Optional[Embedder] = None,
+    ):
+        if n_shards < 1:
+            raise ValueError("n_shards must be positive")
+        self.storage_path = Path(storage_path)
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        self.partition_chunks = partition_chunks
+        self.imbalance = imbalance
+        self.embedder = embedder
+
+        self.placement: Dict[str, List[int]] = {}
+        placement_file = self.storage_path / "placement.json"
+        if placement_file.exists():
+            with open(placement_file) as f:
+                saved = json.load(f)
+            if saved["shards"] > n_shards:
+                raise ValueError(f"Storage at {storage_path} is spread over {saved['shards']} shards, got {n_shards}")
+            self.placement = saved["libraries"]
+
+        context = multiprocessing.get_context("spawn")
+        self.shards = [
+            _Shard(number, self.storage_path / f"shard-{number}", connections, context) for number in range(n_shards)
+        ]
+        self._executor = ThreadPoolExecutor(max_workers=n_shards * connections, thread_name_prefix="vectordb-scatter")
+        self._gate = _WriteGate()
+        self._placement_lock = Lock()
+        self._rebalance_lock = Lock()
+        self._recover_placement()
+
+        self._closed = Event()
+        self._rebalancer = None
+        if rebalance_interval > 0:
+            self._rebalancer = Thread(
+                target=self._rebalance_loop, args=(rebalance_interval,), daemon=True, name="vectordb-rebalance"
+            )
+            self._rebalancer.start()
+
+    def _scatter(self, shards: Sequence[_Shard], method: str, *args, **kwargs) -> list:
+        """Call ``method`` on every shard in parallel; results in shard order."""
+        if len(shards) == 1:
+            return [shards[0].call(method, *args, **kwargs)]
+        return list(self._executor.map(lambda shard: shard.call(method, *args, **kwargs), shards))
+
+    def _library_shards(self, library_id: str) -> List[_Shard]:
+        return [self.shards[number] for number in self.placement.get(library_id, ())]
+
+    def _document_shards(self, document_id: str) -> List[_Shard]:
+        found = self._scatter(self.shards, "document_exists", document_id)
+        return [shard for shard, holds in zip(self.shards, found) if holds]
+
+    def _partition(self, library_id: str, document_id: str) -> _Shard:
+        placed = self.placement[library_id]
+        return self.shards[placed[zlib.crc32(document_id.encode()) % len(placed)]]
+
+    def _save_placement(self):
+        path = self.storage_path / "placement.json"
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"shards": len(self.shards), "libraries": self.placement}, f)
+        os.replace(tmp, path)
+
+    def _set_placement(self, library_id: str, shards: Optional[List[int]]):
+        with self._placement_lock:
+            if shards is None:
+                self.placement.pop(library_id, None)
+            else:
+                self.placement[library_id] = list(shards)
+            self._save_placement()
+
+    def _recover_placement(self):
+        """Reconcile the saved placement with what the shards hold, after a crash
+        between a shard write and the placement update."""
+        held: Dict[str, List[int]] = {}
+        for shard, sizes in zip(self.shards, self._scatter(self.shards, "library_sizes")):
+            for library_id in sizes:
+                held.setdefault(library_id, []).append(shard.number)
+        placement = {}
+        for library_id, shards in held.items():
+            saved = [number for number in self.placement.get(library_id, ()) if number in shards]
+            placement[library_id] = saved + [number for number in shards if number not in saved]
+        with self._placement_lock:
+            self.placement = placement
+            self._save_placement()
+
+    # === LIBRARY ===
+    def create_library(
+        self, name: str, metadata: dict = None, index_type: str = None, index_params: dict = None
+    ) -> str:
+        with self._gate.write():
+            counts = [0] * len(self.shards)
+            for placed in list(self.placement.values()):
+                for number in placed:
+                    counts[number] += 1
+            shard = self.shards[counts.index(min(counts))]
+            library_id = shard.call("create_library", name, metadata, index_type, index_params)
+            self._set_placement(library_id, [shard.number])
+        return library_id
+
+    def get_library(self, library_id: str, expand: str = "chunks") -> Optional[dict]:
+        shards = self._library_shards(library_id)
+        records = [record for record in self._scatter(shards, "get_library", library_id, expand) if record]
+        if not records:
+            return None
+        if len(records) == 1:
+            return records[0]
+        documents = {document["id"]: document for record in records for document in record["documents"]}
+        return {**records[0], "documents": list(documents.values())}
+
+    def update_library(self, library_id: str, name: str, metadata: dict):
+        with self._gate.write():
+            self._scatter(self._library_shards(library_id), "update_library", library_id, name, metadata)
+
+    def delete_library(self, library_id: str) -> bool:
+        with self._gate.write():
+            shards = self._library_shards(library_id)
+            if not shards:
+                return False
+            self._scatter(shards, "delete_library", library_id)
+            self._set_placement(library_id, None)
+        return True
+
+    def library_exists(self, library_id: str) -> bool:
+        return library_id in self.placement
+
+    def library_version(self, library_id: str) -> Tuple[Tuple[int, int], ...]:
+        """The version of the library on each shard holding it; a move changes
+        the set of shards, and the target's clock never repeats a version."""
+        shards = self._library_shards(library_id)
+        return tuple(zip((shard.number for shard in shards), self._scatter(shards, "library_version", library_id)))
+
+    # === DOCUMENT ===
+    def create_document(self, library_id: str, title: str, metadata: dict = None) -> str:
+        with self._gate.write():
+            if library_id not in self.placement:
+                raise ValueError("Library not found")
+            document_id = f"doc_{uuid4().hex}"
+            return self._partition(library_id, document_id).call(
+                "create_document", library_id, title, metadata, document_id
+            )
+
+    def get_document(self, document_id: str, expand: str = "chunks") -> Optional[dict]:
+        return next(filter(None, self._scatter(self.shards, "get_document", document_id, expand)), None)
+
+    def update_document(self, document_id: str, title: str, metadata: dict):
+        with self._gate.write():
+            self._scatter(self.shards, "update_document", document_id, title, metadata)
+
+    def delete_document(self, document_id: str) -> bool:
+        with self._gate.write():
+            return any(self._scatter(self.shards, "delete_document", document_id))
+
+    def document_exists(self, document_id: str) -> bool:
+        return bool(self._document_shards(document_id))
+
+    # === CHUNK ===
+    def create_chunk(self, document_id: str, content: str, metadata: dict = None) -> str:
+        return self.create_chunks(document_id, [{"content": content, "metadata": metadata}])[0]
+
+    def create_chunks(self, document_id: str, chunks: List[dict]) -> List[str]:
+        """Embedded here, in provider-sized batches, then inserted by the document's shard."""
+        if not self.document_exists(document_id):
+            raise ValueError("Document not found")
+        embeddings = embed_texts([c["content"] for c in chunks], embedder=self.embedder)
+        return self._insert_chunks(document_id, chunks, embeddings)
+
+    async def acreate_chunk(self, document_id: str, content: str, metadata: dict = None) -> str:
+        return (await self.acreate_chunks(document_id, [{"content": content, "metadata": metadata}]))[0]
+
+    async def acreate_chunks(self, document_id: str, chunks: List[dict]) -> List[str]:
+        if not await asyncio.to_thread(self.document_exists, document_id):
+            raise ValueError("Document not found")
+        embeddings = await aembed_texts([c["content"] for c in chunks], embedder=self.embedder)
+        return await asyncio.to_thread(self._insert_chunks, document_id, chunks, embeddings)
+
+    def _insert_chunks(self, document_id: str, chunks: List[dict], embeddings: List[List[float]]) -> List[str]:
+        with self._gate.write():
+            shards = self._document_shards(document_id)
+            if not shards:
+                raise ValueError("Document not found")
+            # One float32 array pickles far smaller than lists of Python floats.
+            return shards[0].call("_insert_chunks", document_id, chunks, np.asarray(embeddings, dtype=np.float32))
+
+    def get_chunk(self, chunk_id: str) -> Optional[dict]:
+        return next(filter(None, self._scatter(self.shards, "get_chunk", chunk_id)), None)
+
+    def update_chunk(
+        self, chunk_id: str, content: str, metadata: dict = None, embedding: Optional[List[float]] = None
+    ):
+        """Sent to every shard; only the one holding the chunk re-embeds and writes it."""
+        with self._gate.write():
+            self._scatter(self.shards, "update_chunk", chunk_id, content, metadata, embedding)
+
+    async def aupdate_chunk(
+        self, chunk_id: str, content: str, metadata: dict = None, embedding: Optional[List[float]] = None
+    ):
+        await asyncio.to_thread(self.update_chunk, chunk_id, content, metadata, embedding)
+
+    def delete_chunk(self, chunk_id: str) -> bool:
+        with self._gate.write():
+            return any(self._scatter(self.shards, "delete_chunk", chunk_id))
+
+    def chunk_exists(self, chunk_id: str) -> bool:
+        return any(self._scatter(self.shards, "chunk_exists", chunk_id))
+
+    # === ORDERED ITERATION ===
+    def iter_libraries(
+        self, after: Sequence[str] = (), page_size: int = 1000
+    ) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+        return self._merged(self.shards, "list_libraries", (), 0, 0, after, page_size)
+
+    def iter_documents(
+        self, library_id: Optional[str] = None, after: Sequence[str] = (), page_size: int = 1000
+    ) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+        if library_id is not None:
+            shards = self._library_shards(library_id)
+            return self._merged(shards, "list_documents", (library_id,), 1, 1, after, page_size)
+        return self._merged(self.shards, "list_documents", (None,), 1, 0, after, page_size)
+
+    def iter_chunks(
+        self,
+        library_id: Optional[str] = None,
+        document_id: Optional[str] = None,
+        after: Sequence[str] = (),
+        page_size: int = 1000,
+    ) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+        if document_id is not None:
+            shards = self._document_shards(document_id)
+            return self._merged(shards, "list_chunks", (library_id, document_id), 2, 2, after, page_size)
+        if library_id is not None:
+            shards = self._library_shards(library_id)
+            return self._merged(shards, "list_chunks", (library_id, None), 2, 1, after, page_size)
+        return self._merged(self.shards, "list_chunks", (None, None), 2, 0, after, page_size)
+
+    def _merged(
+        self,
+        shards: List[_Shard],
+        method: str,
+        args: tuple,
+        depth: int,
+        start: int,
+        after: Sequence[str],
+        page_size: int,
+    ) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+        """Merge the shards' pages of ``method`` into one keyset-ordered stream."""
+        if len(after) not in (0, depth - start + 1):
+            raise ValueError("Invalid cursor")
+        cursor = encode_cursor(after) if after else None
+
+        def pages(shard: _Shard) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+            position = cursor
+            while True:
+                items, position = shard.call(method, *args, position, page_size)
+                for record in items:
+                    yield _path(record, depth)[start:], record
+                if position is None:
+                    return
+
+        def merged() -> Iterator[Tuple[Tuple[str, ...], dict]]:
+            previous = None
+            for path, record in heapq.merge(*map(pages, shards), key=lambda item: item[0]):
+                # A partitioned library is listed by each of its shards, and a moving record by two.
+                if path != previous:
+                    previous = path
+                    yield path, record
+
+        return merged()
+
+    def list_libraries(self, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[dict], Optional[str]]:
+        return VectorDB._page(self.iter_libraries(decode_cursor(cursor), page_size=limit + 1), limit)
+
+    def list_documents(
+        self, library_id: Optional[str] = None, cursor: Optional[str] = None, limit: int = 100
+    ) -> Tuple[List[dict], Optional[str]]:
+        return VectorDB._page(self.iter_documents(library_id, decode_cursor(cursor), page_size=limit + 1), limit)
+
+    def list_chunks(
+        self,
+        library_id: Optional[str] = None,
+        document_id: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[dict], Optional[str]]:
+        records = self.iter_chunks(library_id, document_id, decode_cursor(cursor), page_size=limit + 1)
+        return VectorDB._page(records, limit)
+
+    # === SEARCH ===
+    def search_chunks(
+        self,
+        library_id: str,
+        query_embedding: List[float],
+        k: int = 5,
+        filters: dict = None,
+        embeddings: bool = True,
+    ) -> List[Tuple[dict, float]]:
+        shards = self._library_shards(library_id)
+        results = self._scatter(shards, "search_chunks", library_id, query_embedding, k, filters, embeddings)
+        return _merge_hits(results, k)
+
+    def lexical_search_chunks(
+        self, library_id: str, query: str, k: int = 5, filters: dict = None, embeddings: bool = True
+    ) -> List[Tuple[dict, float]]:
+        shards = self._library_shards(library_id)
+        results = self._scatter(shards, "lexical_search_chunks", library_id, query, k, filters, embeddings)
+        return _merge_hits(results, k)
+
+    def hybrid_search_chunks(
+        self,
+        library_id: str,
+        query: str,
+        query_embedding: List[float],
+        k: int = 5,
+        candidates: int = None,
+        filters: dict = None,
+        embeddings: bool = True,
+    ) -> List[Tuple[dict, float]]:
+        shards = self._library_shards(library_id)
+        results = self._scatter(
+            shards, "hybrid_search_chunks", library_id, query, query_embedding, k, candidates, filters, embeddings
+        )
+        return _merge_hits(results, k)
+
+    def search_chunks_batch(self, queries: List[dict]) -> List[List[Tuple[dict, float]]]:
+        """Each shard gets, in one call, the queries on the libraries it holds."""
+        assigned: Dict[int, List[int]] = {}
+        for i, query in enumerate(queries):
+            for number in self.placement.get(query["library_id"], ()):
+                assigned.setdefault(number, []).append(i)
+        futures = {
+            number: self._executor.submit(
+                self.shards[number].call, "search_chunks_batch", [queries[i] for i in positions]
+            )
+            for number, positions in assigned.items()
+        }
+        partial: List[List[List[Tuple[dict, float]]]] = [[] for _ in queries]
+        for number, future in futures.items():
+            for i, hits in zip(assigned[number], future.result()):
+                partial[i].append(hits)
+        return [_merge_hits(results, query.get("k", 5)) for query, results in zip(queries, partial)]
+
+    # === REBALANCING ===
+    def rebalance(self):
+        """Partition libraries that outgrew their shards, then even out the
+        shards' chunk counts by moving whole unpartitioned libraries."""
+        with self._rebalance_lock:
+            sizes = self._scatter(self.shards, "library_sizes")
+            loads = [sum(shard_sizes.values()) for shard_sizes in sizes]
+            for library_id, placed in list(self.placement.items()):
+                total = sum(sizes[number].get(library_id, 0) for number in placed)
+                wanted = min(len(self.shards), math.ceil(total / self.partition_chunks))
+                if wanted > len(placed):
+                    spare = sorted((n for n in range(len(self.shards)) if n not in placed), key=loads.__getitem__)
+                    self._place(library_id, placed + spare[: wanted - len(placed)])
+                    sizes = self._scatter(self.shards, "library_sizes")
+                    loads = [sum(shard_sizes.values()) for shard_sizes in sizes]
+
+            for _ in range(len(self.placement)):
+                high = max(range(len(loads)), key=loads.__getitem__)
+                low = min(range(len(loads)), key=loads.__getitem__)
+                gap = loads[high] - loads[low]
+                if gap <= self.imbalance * max(sum(loads) / len(loads), 1):
+                    return
+                # Moving a library smaller than the gap always narrows it; aim for half of it.
+                movable = [
+                    (size, library_id)
+                    for library_id, size in sizes[high].items()
+                    if 0 < size < gap and self.placement.get(library_id) == [high]
+                ]
+                if not movable:
+                    return
+                size, library_id = min(movable, key=lambda item: abs(gap / 2 - item[0]))
+                self._place(library_id, [low])
+                sizes[high].pop(library_id)
+                sizes[low][library_id] = size
+                loads[high] -= size
+                loads[low] += size
+
+    def _place(self, library_id: str, targets: List[int], batch_size: int = 256):
+        """Move the library's documents to where they hash among ``targets``."""
+        with self._gate.move():
+            current = self.placement.get(library_id)
+            if current is None:
+                return
+            library = self.shards[current[0]].call("get_library", library_id, "none")
+            library.pop("documents", None)
+            for number in targets:
+                if number not in current:
+                    self.shards[number].call("import_records", library)
+
+            moved: Dict[int, List[str]] = {}
+            for number in current:
+                source = self.shards[number]
+                outgoing: Dict[int, List[str]] = {}
+                for _, document in self._merged([source], "list_documents", (library_id,), 1, 1, (), 10_000):
+                    target = targets[zlib.crc32(document["id"].encode()) % len(targets)]
+                    if target != number:
+                        outgoing.setdefault(target, []).append(document["id"])
+                for target, document_ids in outgoing.items():
+                    for start in range(0, len(document_ids), batch_size):
+                        documents, chunks = source.call("export_documents", document_ids[start : start + batch_size])
+                        self.shards[target].call("import_records", library, documents, chunks)
+                    moved.setdefault(number, []).extend(document_ids)
+
+            self._set_placement(library_id, targets)
+            for number in current:
+                if number not in targets:
+                    self.shards[number].call("delete_library", library_id)
+                elif moved.get(number):
+                    self.shards[number].call("delete_documents", moved[number])
+
+    def _rebalance_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            try:
+                self.rebalance()
+            except Exception:
+                logger.exception("Rebalancing shards failed")
+
+    # === LIFECYCLE ===
+    def save_to_disk(self):
+        self._scatter(self.shards, "save_to_disk")
+
+    def compact(self):
+        self._scatter(self.shards, "compact")
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._rebalancer is not None:
+            self._rebalancer.join()
+        self._executor.shutdown()
+        for shard in self.shards:
+            shard.close()
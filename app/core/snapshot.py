@@ -0,0 +1,176 @@
+import io
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.records import FrozenTable, RecordTable
+
+SNAPSHOT_VERSION = 1
+
+# Index arrays at least this large are stored as .npy files and memory-mapped on load.
+EXTERNAL_ARRAY_BYTES = 64 * 1024
+
+
+class _ArrayPickler(pickle.Pickler):
+    def __init__(self, file, arrays: List[np.ndarray]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays = arrays
+
+    def persistent_id(self, obj):
+        if type(obj) in (np.ndarray, np.memmap) and obj.nbytes >= EXTERNAL_ARRAY_BYTES and obj.dtype != object:
+            self.arrays.append(np.array(obj))
+            return ("array", len(self.arrays) - 1)
+        return None
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    def __init__(self, file, directory: Path):
+        super().__init__(file)
+        self.directory = directory
+
+    def persistent_load(self, pid):
+        _, number = pid
+        # Copy-on-write: pages stay shared with every process mapping the file until written.
+        return np.load(self.directory / f"{number}.npy", mmap_mode="c")
+
+
+def dump_indexes(indexes) -> Tuple[bytes, List[np.ndarray]]:
+    """Pickle ``indexes`` with large numpy arrays split out (as copies) for ``write_snapshot``."""
+    arrays: List[np.ndarray] = []
+    buffer = io.BytesIO()
+    _ArrayPickler(buffer, arrays).dump(indexes)
+    return buffer.getvalue(), arrays
+
+
+def current_segment(directory: Path) -> int:
+    """WAL segment of the published snapshot, 0 if there is none."""
+    try:
+        return int((Path(directory) / "CURRENT").read_text().strip().split("-")[1])
+    except FileNotFoundError:
+        return 0
+
+
+def _fsync_write(path: Path, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_snapshot(
+    directory: Path,
+    wal_segment: int,
+    libraries: FrozenTable,
+    documents: FrozenTable,
+    chunks: FrozenTable,
+    indexes: Optional[bytes] = None,
+    arrays: Sequence[np.ndarray] = (),
+) -> Path:
+    """Write a snapshot into ``directory/snapshot-<wal_segment>`` and publish it.
+
+    Layout:
+
+    - ``embeddings.f32``: chunk embeddings as one raw row-major float32 matrix.
+    - ``records.pkl``: the columns of the libraries, documents and chunks
+      tables (``FrozenTable.columns``); chunk vector locators are rows of the matrix.
+    - ``indexes.pkl``: the pickled index structures, so they load warm; the large
+      arrays split out by ``dump_indexes`` go to ``arrays/<n>.npy``.
+    - ``manifest.json``: shape and WAL position, written last.
+
+    ``CURRENT`` is then atomically pointed at the new directory and older
+    snapshot directories are removed.
+    """
+    directory = Path(directory)
+    name = f"snapshot-{wal_segment:08d}"
+    target = directory / name
+    shutil.rmtree(target, ignore_errors=True)
+    target.mkdir(parents=True)
+
+    dim = chunks.dim
+    with open(target / "embeddings.f32", "wb") as f:
+        rows = chunks.write_vectors(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    tables = {"libraries": libraries.columns(), "documents": documents.columns(), "chunks": chunks.columns()}
+    _fsync_write(target / "records.pkl", pickle.dumps({"tables": tables}, protocol=pickle.HIGHEST_PROTOCOL))
+    if indexes is not None:
+        (target / "arrays").mkdir()
+        for number, array in enumerate(arrays):
+            with open(target / "arrays" / f"{number}.npy", "wb") as f:
+                np.save(f, array)
+                f.flush()
+                os.fsync(f.fileno())
+        _fsync_write(target / "indexes.pkl", indexes)
+    manifest = {"version": SNAPSHOT_VERSION, "wal_segment": wal_segment, "dim": dim, "rows": rows}
+    _fsync_write(target / "manifest.json", json.dumps(manifest).encode())
+
+    current_tmp = directory / "CURRENT.tmp"
+    _fsync_write(current_tmp, name.encode())
+    os.replace(current_tmp, directory / "CURRENT")
+
+    for old in directory.glob("snapshot-*"):
+        if old.name != name:
+            shutil.rmtree(old, ignore_errors=True)
+    return target
+
+
+def map_embeddings(target: Path) -> Optional[np.memmap]:
+    """The embedding matrix of the snapshot in ``target`` as a read-only map."""
+    manifest = json.loads((Path(target) / "manifest.json").read_text())
+    if not manifest["rows"]:
+        return None
+    return np.memmap(
+        Path(target) / "embeddings.f32", dtype=np.float32, mode="r", shape=(manifest["rows"], manifest["dim"])
+    )
+
+
+def read_snapshot(directory: Path) -> Optional[dict]:
+    """Load the published snapshot as ``RecordTable``s, with chunk embeddings
+    served from a read-only ``np.memmap`` and large index arrays as copy-on-write
+    maps, so processes loading the same snapshot share one copy of both in the
+    page cache.
+
+    Returns None when there is no snapshot. ``indexes`` is None if the index
+    file is missing or cannot be unpickled; callers rebuild in that case.
+    """
+    directory = Path(directory)
+    try:
+        name = (directory / "CURRENT").read_text().strip()
+    except FileNotFoundError:
+        return None
+    target = directory / name
+    manifest = json.loads((target / "manifest.json").read_text())
+
+    with open(target / "records.pkl", "rb") as f:
+        records = pickle.load(f)
+
+    embeddings = map_embeddings(target)
+
+    tables = records["tables"]
+    libraries = RecordTable.restore(tables["libraries"])
+    documents = RecordTable.restore(tables["documents"])
+    chunks = RecordTable.restore(tables["chunks"], embeddings)
+
+    indexes = None
+    # Index layouts change between versions; older ones are rebuilt from the records.
+    if manifest["version"] == SNAPSHOT_VERSION:
+        try:
+            with open(target / "indexes.pkl", "rb") as f:
+                indexes = _ArrayUnpickler(f, target / "arrays").load()
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+            pass
+
+    return {
+        "wal_segment": manifest["wal_segment"],
+        "libraries": libraries,
+        "documents": documents,
+        "chunks": chunks,
+        "embeddings": embeddings,
+        "indexes": indexes,
+    }
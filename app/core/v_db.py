@@ -1,246 +1,1144 @@
+import asyncio
+import atexit
+import base64
+import bisect
 import datetime
+import fcntl
+import itertools
 import json
-from heapq import nlargest
+import logging
+import os
+from contextlib import contextmanager
 from pathlib import Path
-from threading import RLock
-from typing import Dict, List, Optional, Tuple
+from threading import Event, Lock, RLock, Thread
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 from uuid import uuid4
 
-from app.services.cohere_embedding import get_embedding
-from app.utils import cosine_similarity, GridIndex, InvertedIndex
+import numpy as np
+
+from app.core import metrics
+from app.core.config import (
+    CHECKPOINT_INTERVAL,
+    COMPACT_INTERVAL,
+    DEFAULT_INDEX_TYPE,
+    INDEX_MANAGER_INTERVAL,
+    FILTER_PREFILTER_RATIO,
+    SHARDS,
+    SHARED_STORAGE,
+    STORAGE_PATH,
+    SYNC_INTERVAL,
+    WAL_FSYNC,
+)
+from app.core.indexing import (
+    AutoIndex,
+    BM25Index,
+    FilterMatch,
+    MetadataIndex,
+    create_index,
+    filtered_search,
+    reciprocal_rank_fusion,
+)
+from app.core.records import CHUNK_SCHEMA, DOCUMENT_SCHEMA, LIBRARY_SCHEMA, FrozenTable, RecordTable
+from app.core.snapshot import current_segment, dump_indexes, map_embeddings, read_snapshot, write_snapshot
+from app.core.wal import WriteAheadLog
+from app.services.embedding import Embedder, aembed_texts, embed_texts
+
+logger = logging.getLogger(__name__)
 
 
 class VectorDB:
-    def __init__(self, storage_path: str = "data/vectordb"):
+    """In-memory vector database persisted through a WAL and binary snapshots.
+
+    With ``shared=True`` several processes (e.g. uvicorn workers) open the same
+    ``storage_path``. They load the same snapshot, whose embeddings and index
+    arrays are memory-mapped and so held once in the page cache, and then follow
+    one shared WAL: writes take an inter-process lock, apply the other workers'
+    records first and append their own before releasing it, and a background
+    thread tails the log every ``sync_interval`` seconds. Reads in one worker may
+    lag writes made through another by up to that interval; lookups that miss
+    sync first.
+
+    Records are held in columnar ``RecordTable``s; reads return a new dict per
+    record, built from the columns.
+    """
+
+    def __init__(
+        self,
+        storage_path: str = STORAGE_PATH,
+        wal_fsync: str = WAL_FSYNC,
+        checkpoint_interval: float = CHECKPOINT_INTERVAL,
+        embedder: Optional[Embedder] = None,
+        shared: bool = SHARED_STORAGE,
+        sync_interval: float = SYNC_INTERVAL,
+        compact_interval: float = COMPACT_INTERVAL,
+        index_manager_interval: float = INDEX_MANAGER_INTERVAL,
+    ):
         self.storage_path = Path(storage_path)
         self.storage_path.mkdir(parents=True, exist_ok=True)
+        self.shared = shared
 
-        self.libraries: Dict[str, dict] = {}
-        self.documents: Dict[str, dict] = {}
-        self.chunks: Dict[str, dict] = {}
+        self.libraries = RecordTable(LIBRARY_SCHEMA)
+        self.documents = RecordTable(DOCUMENT_SCHEMA)
+        self.chunks = RecordTable(CHUNK_SCHEMA)
+        # Writers serialize on ``lock``. Readers never take it: records are
+        # replaced rather than mutated, and every vector index publishes an
+        # immutable view per write, so a read sees either the old state or the new.
         self.lock = RLock()
+        self.embedder = embedder  # None means the process-wide default from app.services.embedding
+
+        self.vector_indexes: Dict[str, object] = {}
+        self.lexical_indexes: Dict[str, BM25Index] = {}
+        self.metadata_indexes: Dict[str, MetadataIndex] = {}
+        # Moved on by every change to a library's chunks, to a process-wide clock so a version never recurs.
+        self.library_versions: Dict[str, int] = {}
+        self._version_clock = itertools.count(1)
+        # Parent -> children id maps, used as insertion-ordered sets.
+        self.library_documents: Dict[str, Dict[str, None]] = {}
+        self.document_chunks: Dict[str, Dict[str, None]] = {}
+
+        self.wal = WriteAheadLog(self.storage_path / "wal", fsync=wal_fsync, shared=shared)
+        # Position up to which the shared log has been applied.
+        self._wal_position: Tuple[int, int] = (0, 0)
+        # Held shared while loading and exclusively while checkpointing, across processes.
+        self._snapshot_lock_file = open(self.storage_path / "SNAPSHOT.lock", "a+b") if shared else None
+        self.load_from_disk()
+
+        self._checkpoint_lock = Lock()
+        self._closed = Event()
+        self._checkpointer = None
+        if checkpoint_interval > 0:
+            self._checkpointer = Thread(
+                target=self._checkpoint_loop, args=(checkpoint_interval,), daemon=True, name="vectordb-checkpoint"
+            )
+            self._checkpointer.start()
+        self._compactor = None
+        if compact_interval > 0:
+            self._compactor = Thread(
+                target=self._compact_loop, args=(compact_interval,), daemon=True, name="vectordb-compactor"
+            )
+            self._compactor.start()
+        self._index_manager = None
+        if index_manager_interval > 0:
+            self._index_manager = Thread(
+                target=self._manage_indexes_loop,
+                args=(index_manager_interval,),
+                daemon=True,
+                name="vectordb-index-manager",
+            )
+            self._index_manager.start()
+        self._follower = None
+        if shared:
+            self._follower = Thread(
+                target=self._follow_loop, args=(sync_interval,), daemon=True, name="vectordb-follower"
+            )
+            self._follower.start()
+        atexit.register(self.close)
 
-        self.grid_index = GridIndex(bin_size=0.5)
-        self.inverted_index = InvertedIndex()
+    @contextmanager
+    def _writing(self):
+        """Hold the write lock; in shared mode also the log lock, with the other
+        processes' records applied first and ours flushed before release."""
+        start = perf_counter()
+        with self.lock:
+            acquired = perf_counter()
+            try:
+                if not self.shared:
+                    yield
+                    return
+                with self.wal.lock():
+                    self.wal.follow()
+                    self._sync()
+                    try:
+                        yield
+                    finally:
+                        self.wal.flush()
+                        self._wal_position = self.wal.position()
+            finally:
+                released = perf_counter()
+                metrics.LOCK_WAIT_SECONDS.observe(acquired - start)
+                metrics.LOCK_HOLD_SECONDS.observe(released - acquired)
+                metrics.record("lock_wait", acquired - start)
+                metrics.record("lock_hold", released - acquired)
+
+    def sync(self):
+        """Apply records other processes have added to the shared log."""
+        if self.shared:
+            with self.lock:
+                self._sync()
+
+    def _sync(self):
+        segment, offset = self._wal_position
+        try:
+            records, segment, offset = self.wal.tail(segment, offset)
+        except FileNotFoundError:
+            # Fell behind a checkpoint that truncated the log; start over from the snapshot.
+            self._reload()
+            return
+        for entry in records:
+            self._apply_log_entry(entry)
+        self._wal_position = (segment, offset)
 
+    def _reload(self):
+        self.libraries = RecordTable(LIBRARY_SCHEMA)
+        self.documents = RecordTable(DOCUMENT_SCHEMA)
+        self.chunks = RecordTable(CHUNK_SCHEMA)
         self.load_from_disk()
 
+    def _follow_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Applying other workers' log records failed")
+
     def save_to_disk(self):
+        """Write a binary snapshot and drop the log segments it covers.
+
+        Only freezing the tables and the pickling of the indexes happen under the
+        lock; table rows are never changed once written, so writing them out
+        afterwards is safe.
+        """
+        with self._checkpoint_lock, metrics.CHECKPOINT_SECONDS.time():
+            with self._writing():
+                segment = self.wal.rotate()
+                libraries = self.libraries.freeze()
+                documents = self.documents.freeze()
+                chunks = self.chunks.freeze()
+                indexes, arrays = dump_indexes(
+                    {
+                        "vector": self.vector_indexes,
+                        "lexical": self.lexical_indexes,
+                        "metadata": self.metadata_indexes,
+                    }
+                )
+
+            with self._snapshot_lock(fcntl.LOCK_EX):
+                previous = current_segment(self.storage_path)
+                if previous >= segment:
+                    return  # another worker published a newer checkpoint meanwhile
+                target = write_snapshot(self.storage_path, segment, libraries, documents, chunks, indexes, arrays)
+                (self.storage_path / "db.json").unlink(missing_ok=True)
+                # Other workers may still be tailing the segments of the previous snapshot.
+                self.wal.truncate_before(previous if self.shared else segment)
+            self._adopt_embeddings(chunks, target)
+
+    def _adopt_embeddings(self, chunks: FrozenTable, target: Path):
+        """Serve the checkpointed chunks' embeddings from the new snapshot's
+        embedding map, so their in-memory copies can be freed."""
+        embeddings = map_embeddings(target)
+        if embeddings is None:
+            return
         with self.lock:
-            data = {
-                "libraries": self.libraries,
-                "documents": self.documents,
-                "chunks": self.chunks,
-            }
-            with open(self.storage_path / "db.json", "w") as f:
-                json.dump(data, f, default=str)
+            self.chunks.adopt(chunks, embeddings)
+
+    @contextmanager
+    def _snapshot_lock(self, operation: int):
+        """Shared while loading, exclusive while publishing (``shared`` mode only)."""
+        if not self.shared:
+            yield
+            return
+        fcntl.flock(self._snapshot_lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._snapshot_lock_file, fcntl.LOCK_UN)
 
     def load_from_disk(self):
+        # Checkpoints in other workers may not delete the snapshot or log segments mid-load.
+        with self._snapshot_lock(fcntl.LOCK_SH):
+            self._load_from_disk()
+
+    def _load_from_disk(self):
+        wal_segment = 0
+        indexes = None
+        snapshot = read_snapshot(self.storage_path)
+        if snapshot is not None:
+            self.libraries = snapshot["libraries"]
+            self.documents = snapshot["documents"]
+            self.chunks = snapshot["chunks"]
+            wal_segment = snapshot["wal_segment"]
+            indexes = snapshot["indexes"]
+        else:
+            # Databases written before binary snapshots existed.
+            try:
+                with open(self.storage_path / "db.json", "r") as f:
+                    data = json.load(f)
+                    self.libraries = RecordTable.from_records(LIBRARY_SCHEMA, data.get("libraries", {}).values())
+                    self.documents = RecordTable.from_records(DOCUMENT_SCHEMA, data.get("documents", {}).values())
+                    self.chunks = RecordTable.from_records(CHUNK_SCHEMA, data.get("chunks", {}).values())
+                    wal_segment = data.get("wal_segment", 0)
+            except FileNotFoundError:
+                pass
+
+        self.rebuild_relations()
+        self.library_versions = {library_id: next(self._version_clock) for library_id in self.libraries}
+        if indexes is not None:
+            self.vector_indexes = indexes["vector"]
+            self.lexical_indexes = indexes["lexical"]
+            self.metadata_indexes = indexes["metadata"]
+            for index in self.vector_indexes.values():
+                self._attach(index)
+        else:
+            self.rebuild_indexes()
+
+        if self.shared:
+            self._wal_position = (wal_segment, 0)
+            self._sync()
+        else:
+            for entry in self.wal.replay(from_segment=wal_segment):
+                self._apply_log_entry(entry)
+
+    def _apply_log_entry(self, entry: dict):
+        """Redo one logged operation, keeping the indexes in step with the tables."""
+        table = getattr(self, entry["table"])
+        if entry["op"] == "put_many":
+            for record in entry["records"]:
+                self._apply_log_entry({"op": "put", "table": entry["table"], "record": record})
+        elif entry["op"] == "put":
+            record = entry["record"]
+            if entry["table"] == "chunks":
+                record["embedding"] = np.asarray(record["embedding"], dtype=np.float32)
+            previous = table.get(record["id"])
+            table[record["id"]] = record
+            if entry["table"] == "documents" and previous is None:
+                self._link(self.library_documents, record["library_id"], record["id"])
+            elif entry["table"] == "chunks":
+                if previous is not None:
+                    self._reindex_chunk(record, previous)
+                else:
+                    self._index_chunk(record)
+        else:
+            record = table.pop(entry["id"], None)
+            if record is None:
+                return
+            if entry["table"] == "chunks":
+                self._unindex_chunk(record)
+            elif entry["table"] == "documents":
+                self._unlink(self.library_documents, record["library_id"], record["id"])
+                self.document_chunks.pop(record["id"], None)
+            elif entry["table"] == "libraries":
+                self.library_documents.pop(record["id"], None)
+                self.library_versions.pop(record["id"], None)
+                self.vector_indexes.pop(record["id"], None)
+                self.lexical_indexes.pop(record["id"], None)
+                self.metadata_indexes.pop(record["id"], None)
+
+    def _checkpoint_loop(self, interval: float):
+        failed = False
+        while not self._closed.wait(interval):
+            # In shared mode any worker may have written to the current segment.
+            if failed or self.wal.records_since_rotate or (self.shared and self._wal_position[1]):
+                try:
+                    self.save_to_disk()
+                    failed = False
+                except Exception:
+                    # e.g. a full disk; the log keeps every write meanwhile, so the next interval retries.
+                    logger.exception("Checkpoint failed")
+                    failed = True
+
+    def compact(self):
+        """Rebuild the vector indexes whose tombstones passed their threshold.
+
+        Indexes that compact cheaply do so inline as they are written; this is
+        for those that rebuild (HNSW graphs). Each rebuild reads a read view
+        without the lock, then the writes made meanwhile are replayed onto it
+        and it is swapped in under the lock.
+        """
+        for library_id, index in list(self.vector_indexes.items()):
+            if not getattr(index, "needs_compaction", False):
+                continue
+            try:
+                fresh, covered = index.rebuild()
+                with self.lock:
+                    if self.vector_indexes.get(library_id) is not index:
+                        continue  # library deleted or reloaded meanwhile
+                    index.catch_up(fresh, covered)
+                    self.vector_indexes[library_id] = self._attach(fresh)
+            except Exception:
+                # The old index keeps serving; the rebuild is retried on the next pass.
+                logger.exception("Compacting the index of library %s failed", library_id)
+
+    def _compact_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            self.compact()
+
+    def manage_indexes(self):
+        """Let each auto-indexed library measure its recall and re-plan its
+        engine, building the planned engine where that changes.
+
+        A build reads the library's vectors under the lock, then inserts them
+        into the new engine without it while the old engine keeps serving and
+        journals the writes made meanwhile; the journal is replayed and the
+        engines swapped under the lock.
+        """
+        for library_id, index in list(self.vector_indexes.items()):
+            if not isinstance(index, AutoIndex):
+                continue
+            try:
+                index.measure_recall(lambda: self._library_chunk_ids(library_id))
+                plan = index.plan()
+                if plan is not None:
+                    self._build_index(library_id, index, *plan)
+            except Exception:
+                # One library's failure must not hold back the others; it is retried next round.
+                logger.exception("Managing the index of library %s failed", library_id)
+            if self._closed.is_set():
+                return
+
+    def _build_index(self, library_id: str, index: AutoIndex, engine: str, params: dict, report_every: int = 1000):
+        with self.lock:
+            if self.vector_indexes.get(library_id) is not index:
+                return
+            chunk_ids = self._library_chunk_ids(library_id)
+            vectors = self.chunks.vectors(chunk_ids)
+            index.begin_build(engine, params, len(chunk_ids))
         try:
-            with open(self.storage_path / "db.json", "r") as f:
-                data = json.load(f)
-                self.libraries = data.get("libraries", {})
-                self.documents = data.get("documents", {})
-                self.chunks = data.get("chunks", {})
-        except FileNotFoundError:
-            pass
+            fresh = self._attach(create_index(engine, params))
+            for done, (chunk_id, vector) in enumerate(zip(chunk_ids, vectors), start=1):
+                fresh.add_vector(vector, chunk_id)
+                if done % report_every == 0:
+                    index.progress(done)
+                    if self._closed.is_set():
+                        index.abort_build()
+                        return
+            # Most of the writes made meanwhile are replayed here, so few are left for under the lock.
+            index.catch_up(fresh)
+        except Exception:
+            index.abort_build()
+            raise
+        with self.lock:
+            if self.vector_indexes.get(library_id) is index:
+                index.finish_build(fresh)
 
-    # === LIBRARY ===
-    def create_library(self, name: str, metadata: dict = None) -> str:
+    def _manage_indexes_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            self.manage_indexes()
+
+    def _library_chunk_ids(self, library_id: str) -> List[str]:
+        document_chunks = self.document_chunks
+        return [
+            chunk_id
+            for document_id in list(self.library_documents.get(library_id, ()))
+            for chunk_id in list(document_chunks.get(document_id, ()))
+        ]
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        for thread in (self._checkpointer, self._compactor, self._index_manager, self._follower):
+            if thread is not None:
+                thread.join()
+        self.wal.close()
+        if self._snapshot_lock_file is not None:
+            self._snapshot_lock_file.close()
+
+    def _get(self, table: str, record_id: str) -> Optional[dict]:
+        record = getattr(self, table).get(record_id)
+        if record is None and self.shared:
+            # Possibly written by another worker since the last sync.
+            self.sync()
+            record = getattr(self, table).get(record_id)
+        return record
+
+    def _log_put(self, table: str, record: dict) -> int:
+        return self.wal.append({"op": "put", "table": table, "record": record})
+
+    def _log_put_many(self, table: str, records: List[dict]) -> int:
+        return self.wal.append({"op": "put_many", "table": table, "records": records})
+
+    def _log_delete(self, table: str, record_id: str) -> int:
+        return self.wal.append({"op": "delete", "table": table, "id": record_id})
+
+    def rebuild_relations(self):
         with self.lock:
+            self.library_documents = {library_id: {} for library_id in self.libraries}
+            self.document_chunks = {document_id: {} for document_id in self.documents}
+            for document_id, library_id in self.documents.column("library_id"):
+                self._link(self.library_documents, library_id, document_id)
+            for chunk_id, document_id in self.chunks.column("document_id"):
+                self._link(self.document_chunks, document_id, chunk_id)
+
+    @staticmethod
+    def _link(relation: Dict[str, Dict[str, None]], parent_id: str, child_id: str):
+        relation.setdefault(parent_id, {})[child_id] = None
+
+    @staticmethod
+    def _unlink(relation: Dict[str, Dict[str, None]], parent_id: str, child_id: str):
+        children = relation.get(parent_id)
+        if children is not None:
+            children.pop(child_id, None)
+
+    def rebuild_indexes(self):
+        with self.lock:
+            self.vector_indexes = {}
+            self.lexical_indexes = {}
+            self.metadata_indexes = {}
+            for chunk in self.chunks.values():
+                self._index_chunk(chunk)
+
+    def _index_chunk(self, chunk: dict):
+        self.library_versions[chunk["library_id"]] = next(self._version_clock)
+        self._link(self.document_chunks, chunk["document_id"], chunk["id"])
+        self._vector_index(chunk["library_id"]).add_vector(chunk["embedding"], chunk["id"])
+        self._lexical_index(chunk["library_id"]).add_text(chunk["content"], chunk["id"])
+        self._metadata_index(chunk["library_id"]).add(chunk["id"], chunk["document_id"], chunk["metadata"])
+
+    def _reindex_chunk(self, chunk: dict, previous: dict):
+        """Refresh only the indexes whose inputs differ from ``previous``."""
+        library_id = chunk["library_id"]
+        self.library_versions[library_id] = next(self._version_clock)
+        embedding = chunk["embedding"]
+        if embedding is not previous["embedding"] and not np.array_equal(embedding, previous["embedding"]):
+            self._vector_index(library_id).update_vector(embedding, chunk["id"])
+        if chunk["content"] != previous["content"]:
+            self._lexical_index(library_id).update_text(chunk["content"], chunk["id"])
+        if chunk["metadata"] != previous["metadata"]:
+            self._metadata_index(library_id).update(chunk["id"], chunk["document_id"], chunk["metadata"])
+            self._compact_metadata(library_id)
+
+    def _unindex_chunk(self, chunk: dict):
+        self.library_versions[chunk["library_id"]] = next(self._version_clock)
+        self._unlink(self.document_chunks, chunk["document_id"], chunk["id"])
+        index = self.vector_indexes.get(chunk["library_id"])
+        if index is not None:
+            index.remove_vector(chunk["id"])
+        lexical = self.lexical_indexes.get(chunk["library_id"])
+        if lexical is not None:
+            lexical.remove_text(chunk["id"])
+        metadata = self.metadata_indexes.get(chunk["library_id"])
+        if metadata is not None:
+            metadata.remove(chunk["id"])
+            self._compact_metadata(chunk["library_id"])
+
+    def _compact_metadata(self, library_id: str):
+        index = self.metadata_indexes[library_id]
+        if index.needs_compaction:
+            # Swapped whole: searches still holding the old index see it unchanged.
+            self.metadata_indexes[library_id] = index.compacted()
+
+    def _vector_index(self, library_id: str):
+        index = self.vector_indexes.get(library_id)
+        if index is None:
+            library = self.libraries.get(library_id, {})
+            index = self.vector_indexes[library_id] = self._attach(
+                create_index(library.get("index_type", DEFAULT_INDEX_TYPE), library.get("index_params"))
+            )
+        return index
+
+    def _attach(self, index):
+        # Quantized indexes re-rank their candidates against the full-precision embeddings.
+        if hasattr(index, "vector_source"):
+            index.vector_source = self._embeddings
+        return index
+
+    def _embeddings(self, chunk_ids: Sequence[str]) -> List[Optional[np.ndarray]]:
+        return self.chunks.vectors(chunk_ids)
+
+    def _lexical_index(self, library_id: str) -> BM25Index:
+        index = self.lexical_indexes.get(library_id)
+        if index is None:
+            index = self.lexical_indexes[library_id] = BM25Index()
+        return index
+
+    def _metadata_index(self, library_id: str) -> MetadataIndex:
+        index = self.metadata_indexes.get(library_id)
+        if index is None:
+            index = self.metadata_indexes[library_id] = MetadataIndex()
+        return index
+
+    # === LIBRARY ===
+    def create_library(
+        self, name: str, metadata: dict = None, index_type: str = None, index_params: dict = None
+    ) -> str:
+        with self._writing():
+            index_type = index_type or DEFAULT_INDEX_TYPE
+            index = self._attach(create_index(index_type, index_params))
+
             library_id = f"lib_{uuid4().hex}"
-            self.libraries[library_id] = {
+            library = {
                 "id": library_id,
                 "name": name,
                 "metadata": metadata or {},
+                "index_type": index_type,
+                "index_params": index_params or {},
                 "created_at": datetime.datetime.now(datetime.UTC).isoformat(),
             }
-            self.save_to_disk()
-            return library_id
+            self.libraries[library_id] = library
+            self.vector_indexes[library_id] = index
+            lsn = self._log_put("libraries", library)
+        self.wal.commit(lsn)
+        return library_id
 
-    def get_library(self, library_id: str) -> Optional[dict]:
-        library = self.libraries.get(library_id)
+    def get_library(self, library_id: str, expand: str = "chunks") -> Optional[dict]:
+        """The library with its documents nested (``expand="documents"``), also
+        their chunks (``"chunks"``), or neither (``"none"``); use ``iter_*`` or
+        ``list_*`` to read large libraries incrementally."""
+        library = self._get("libraries", library_id)
         if not library:
             return None
 
-        library_copy = library.copy()
         documents = []
-        for doc_id, doc in self.documents.items():
-            if doc["library_id"] == library_id:
-                doc_copy = doc.copy()
-                doc_copy["chunks"] = [
-                    self.chunks[chk_id]
-                    for chk_id, chk in self.chunks.items()
-                    if chk["document_id"] == doc_id
-                ]
-                documents.append(doc_copy)
-
-        library_copy["documents"] = documents
-        return library_copy
+        if expand != "none":
+            for doc_id in list(self.library_documents.get(library_id, ())):
+                doc_copy = self.get_document(doc_id, expand="chunks" if expand == "chunks" else "none")
+                if doc_copy is not None:
+                    documents.append(doc_copy)
+
+        library["documents"] = documents
+        library["index"] = self.index_status(library_id)
+        return library
+
+    def index_status(self, library_id: str) -> Optional[dict]:
+        """The library's vector engine, its parameters and size, and for auto
+        indexes the measured recall and latency and any build in progress."""
+        library = self.libraries.get(library_id)
+        if library is None:
+            return None
+        index = self.vector_indexes.get(library_id)
+        if isinstance(index, AutoIndex):
+            return index.status()
+        return {
+            "engine": library.get("index_type", DEFAULT_INDEX_TYPE),
+            "params": library.get("index_params") or {},
+            "size": len(index) if index is not None else 0,
+        }
 
     def get_all_libraries(self) -> List[dict]:
         return list(self.libraries.values())
 
     def update_library(self, library_id: str, name: str, metadata: dict):
-        with self.lock:
+        lsn = None
+        with self._writing():
             if library_id in self.libraries:
-                self.libraries[library_id]["name"] = name
-                self.libraries[library_id]["metadata"] = metadata or {}
-                self.save_to_disk()
+                library = {**self.libraries[library_id], "name": name, "metadata": metadata or {}}
+                self.libraries[library_id] = library
+                lsn = self._log_put("libraries", library)
+        self.wal.commit(lsn)
 
     def delete_library(self, library_id: str) -> bool:
-        with self.lock:
-            if library_id in self.libraries:
-                doc_ids = [
-                    doc_id for doc_id, doc in self.documents.items()
-                    if doc["library_id"] == library_id
-                ]
-                for doc_id in doc_ids:
-                    self.delete_document(doc_id)
-                del self.libraries[library_id]
-                self.save_to_disk()
-                return True
-            return False
+        with self._writing():
+            lsn = self._delete_library(library_id)
+        self.wal.commit(lsn)
+        return lsn is not None
+
+    def _delete_library(self, library_id: str) -> Optional[int]:
+        if library_id not in self.libraries:
+            return None
+        for doc_id in list(self.library_documents.get(library_id, ())):
+            self._delete_document(doc_id)
+        del self.libraries[library_id]
+        self.library_documents.pop(library_id, None)
+        self.vector_indexes.pop(library_id, None)
+        self.lexical_indexes.pop(library_id, None)
+        self.metadata_indexes.pop(library_id, None)
+        self.library_versions.pop(library_id, None)
+        return self._log_delete("libraries", library_id)
+
+    def library_version(self, library_id: str) -> int:
+        """Changes whenever the library's chunks do; 0 before its first chunk."""
+        return self.library_versions.get(library_id, 0)
 
     def library_exists(self, library_id: str) -> bool:
-        return library_id in self.libraries
+        return self._get("libraries", library_id) is not None
 
     # === DOCUMENT ===
-    def create_document(self, library_id: str, title: str, metadata: dict = None) -> str:
-        with self.lock:
-            document_id = f"doc_{uuid4().hex}"
-            self.documents[document_id] = {
+    def create_document(self, library_id: str, title: str, metadata: dict = None, document_id: str = None) -> str:
+        with self._writing():
+            document_id = document_id or f"doc_{uuid4().hex}"
+            document = {
                 "id": document_id,
                 "library_id": library_id,
                 "title": title,
                 "metadata": metadata or {},
                 "created_at": datetime.datetime.now(datetime.UTC).isoformat(),
             }
-            self.save_to_disk()
-            return document_id
+            self.documents[document_id] = document
+            self._link(self.library_documents, library_id, document_id)
+            lsn = self._log_put("documents", document)
+        self.wal.commit(lsn)
+        return document_id
 
-    def get_document(self, document_id: str) -> Optional[dict]:
-        document = self.documents.get(document_id)
+    def get_document(self, document_id: str, expand: str = "chunks") -> Optional[dict]:
+        document = self._get("documents", document_id)
         if not document:
             return None
 
-        document_copy = document.copy()
-        document_copy["chunks"] = [
-            self.chunks[chk_id]
-            for chk_id, chk in self.chunks.items()
-            if chk["document_id"] == document_id
-        ]
-        return document_copy
+        document["chunks"] = []
+        if expand == "chunks":
+            # A chunk deleted since the document's chunk ids were listed is skipped.
+            chunks = map(self.chunks.get, list(self.document_chunks.get(document_id, ())))
+            document["chunks"] = [chunk for chunk in chunks if chunk is not None]
+        return document
 
     def get_all_documents(self) -> List[dict]:
-        with self.lock:
-            return list(self.documents.values())
+        return list(self.documents.values())
 
     def update_document(self, document_id: str, title: str, metadata: dict):
-        with self.lock:
+        lsn = None
+        with self._writing():
             if document_id in self.documents:
-                self.documents[document_id]["title"] = title
-                self.documents[document_id]["metadata"] = metadata or {}
-                self.save_to_disk()
+                document = {**self.documents[document_id], "title": title, "metadata": metadata or {}}
+                self.documents[document_id] = document
+                lsn = self._log_put("documents", document)
+        self.wal.commit(lsn)
 
     def delete_document(self, document_id: str) -> bool:
-        with self.lock:
-            if document_id in self.documents:
-                chunk_ids = [
-                    cid for cid, c in self.chunks.items()
-                    if c["document_id"] == document_id
-                ]
-                for cid in chunk_ids:
-                    self.delete_chunk(cid)
-                del self.documents[document_id]
-                self.save_to_disk()
-                return True
-            return False
+        with self._writing():
+            lsn = self._delete_document(document_id)
+        self.wal.commit(lsn)
+        return lsn is not None
+
+    def _delete_document(self, document_id: str) -> Optional[int]:
+        if document_id not in self.documents:
+            return None
+        for cid in list(self.document_chunks.get(document_id, ())):
+            self._delete_chunk(cid)
+        document = self.documents.pop(document_id)
+        self.document_chunks.pop(document_id, None)
+        self._unlink(self.library_documents, document["library_id"], document_id)
+        return self._log_delete("documents", document_id)
 
     def document_exists(self, document_id: str) -> bool:
-        return document_id in self.documents
+        return self._get("documents", document_id) is not None
 
     # === CHUNK ===
     def create_chunk(self, document_id: str, content: str, metadata: dict = None) -> str:
-        with self.lock:
-            document = self.documents.get(document_id)
-            if not document:
-                raise ValueError("Document not found")
+        return self.create_chunks(document_id, [{"content": content, "metadata": metadata}])[0]
 
-            library_id = document["library_id"]
-            embedding = get_embedding(content)
+    def create_chunks(self, document_id: str, chunks: List[dict]) -> List[str]:
+        """Embed and insert many chunks (dicts with ``content`` and optional
+        ``metadata``). Texts are embedded in provider-sized batches before the lock
+        is taken; the inserts then land under one lock and one log record."""
+        if not self.document_exists(document_id):
+            raise ValueError("Document not found")
+        embeddings = embed_texts([c["content"] for c in chunks], embedder=self.embedder)
+        return self._insert_chunks(document_id, chunks, embeddings)
 
-            chunk_id = f"chk_{uuid4().hex}"
-            chunk = {
-                "id": chunk_id,
-                "document_id": document_id,
-                "library_id": library_id,
-                "content": content,
-                "embedding": embedding,
-                "metadata": metadata or {},
-                "created_at": datetime.datetime.now(datetime.UTC).isoformat(),
-            }
+    async def acreate_chunk(self, document_id: str, content: str, metadata: dict = None) -> str:
+        return (await self.acreate_chunks(document_id, [{"content": content, "metadata": metadata}]))[0]
 
-            self.chunks[chunk_id] = chunk
+    async def acreate_chunks(self, document_id: str, chunks: List[dict]) -> List[str]:
+        if not self.document_exists(document_id):
+            raise ValueError("Document not found")
+        embeddings = await aembed_texts([c["content"] for c in chunks], embedder=self.embedder)
+        # The insert may wait on the lock and the WAL fsync; keep both off the event loop.
+        return await asyncio.to_thread(self._insert_chunks, document_id, chunks, embeddings)
 
-            for token in content.lower().split():
-                self.inverted_index.add(token, chunk_id)
+    def _insert_chunks(self, document_id: str, chunks: List[dict], embeddings: List[List[float]]) -> List[str]:
+        with self._writing():
+            document = self.documents.get(document_id)
+            if not document:
+                raise ValueError("Document not found")
 
-            self.grid_index.add(embedding, chunk_id)
+            library_id = document["library_id"]
+            created_at = datetime.datetime.now(datetime.UTC).isoformat()
+            records = []
+            for item, embedding in zip(chunks, embeddings):
+                chunk_id = f"chk_{uuid4().hex}"
+                chunk = {
+                    "id": chunk_id,
+                    "document_id": document_id,
+                    "library_id": library_id,
+                    "content": item["content"],
+                    # float32 arrays take a fraction of the memory of a list of Python floats.
+                    "embedding": np.asarray(embedding, dtype=np.float32),
+                    "metadata": item.get("metadata") or {},
+                    "created_at": created_at,
+                }
+                self.chunks[chunk_id] = chunk
+                self._index_chunk(chunk)
+                records.append(chunk)
 
-            self.save_to_disk()
-            return chunk_id
+            lsn = self._log_put_many("chunks", records)
+        self.wal.commit(lsn)
+        return [record["id"] for record in records]
 
     def get_chunk(self, chunk_id: str) -> Optional[dict]:
-        chunk = self.chunks.get(chunk_id)
+        chunk = self._get("chunks", chunk_id)
         if not chunk:
             return None
 
-        chunk_copy = chunk.copy()
-        doc = self.documents.get(chunk["document_id"])
+        doc = self.documents.view(chunk["document_id"], skip=("metadata", "created_at"))
         if doc:
-            chunk_copy["document_title"] = doc["title"]
-            chunk_copy["library_id"] = doc["library_id"]
-        return chunk_copy
+            chunk["document_title"] = doc["title"]
+            chunk["library_id"] = doc["library_id"]
+        return chunk
 
-    def update_chunk(self, chunk_id: str, content: str, embedding: List[float], metadata: dict):
-        with self.lock:
-            if chunk_id in self.chunks:
-                self.chunks[chunk_id]["content"] = content
-                self.chunks[chunk_id]["embedding"] = embedding
-                self.chunks[chunk_id]["metadata"] = metadata or {}
-                self.save_to_disk()
+    def update_chunk(
+        self, chunk_id: str, content: str, metadata: dict = None, embedding: Optional[List[float]] = None
+    ):
+        """Replace a chunk's content and metadata. The content is re-embedded
+        (before the lock is taken) only if it changed, unless ``embedding`` is given."""
+        while True:
+            chunk = self._get("chunks", chunk_id)
+            if chunk is None:
+                return
+            if embedding is None and content != chunk["content"]:
+                embedding = embed_texts([content], embedder=self.embedder)[0]
+            if self._update_chunk(chunk_id, content, metadata, embedding):
+                return
+
+    async def aupdate_chunk(
+        self, chunk_id: str, content: str, metadata: dict = None, embedding: Optional[List[float]] = None
+    ):
+        while True:
+            chunk = self._get("chunks", chunk_id)
+            if chunk is None:
+                return
+            if embedding is None and content != chunk["content"]:
+                embedding = (await aembed_texts([content], embedder=self.embedder))[0]
+            if await asyncio.to_thread(self._update_chunk, chunk_id, content, metadata, embedding):
+                return
+
+    def _update_chunk(self, chunk_id: str, content: str, metadata: dict, embedding: Optional[List[float]]) -> bool:
+        """False, without writing, if the content changed since it was checked and needs embedding."""
+        lsn = None
+        with self._writing():
+            previous = self.chunks.get(chunk_id)
+            if previous is not None:
+                if embedding is None and content != previous["content"]:
+                    return False
+                if embedding is not None:
+                    embedding = np.asarray(embedding, dtype=np.float32)
+                chunk = {
+                    **previous,
+                    "content": content,
+                    "embedding": previous["embedding"] if embedding is None else embedding,
+                    "metadata": metadata or {},
+                }
+                self.chunks[chunk_id] = chunk
+                self._reindex_chunk(chunk, previous)
+                lsn = self._log_put("chunks", chunk)
+        self.wal.commit(lsn)
+        return True
 
     def delete_chunk(self, chunk_id: str) -> bool:
-        with self.lock:
-            if chunk_id in self.chunks:
-                del self.chunks[chunk_id]
-                self.save_to_disk()
-                return True
-            return False
+        with self._writing():
+            lsn = self._delete_chunk(chunk_id)
+        self.wal.commit(lsn)
+        return lsn is not None
+
+    def _delete_chunk(self, chunk_id: str) -> Optional[int]:
+        if chunk_id not in self.chunks:
+            return None
+        chunk = self.chunks.pop(chunk_id)
+        self._unindex_chunk(chunk)
+        return self._log_delete("chunks", chunk_id)
 
     def chunk_exists(self, chunk_id: str) -> bool:
-        return chunk_id in self.chunks
+        return self._get("chunks", chunk_id) is not None
 
-    def search_chunks(self, library_id: str, query_embedding: List[float], k: int = 5) -> List[Tuple[dict, float]]:
-        results = []
+    # === MOVING DATA ===
+    # Used by the sharding layer to move documents, with their chunks, between databases.
 
-        bin_candidates = self.grid_index.search(query_embedding)
-        chunk_ids_in_library = {
-            cid for cid, _ in bin_candidates
-            if self.chunks[cid]["library_id"] == library_id
+    def library_sizes(self) -> Dict[str, int]:
+        """Chunk count per library."""
+        library_documents, document_chunks = self.library_documents, self.document_chunks
+        return {
+            library_id: sum(
+                len(document_chunks.get(document_id, ())) for document_id in list(library_documents.get(library_id, ()))
+            )
+            for library_id in list(self.libraries)
         }
 
-        for chunk_id in chunk_ids_in_library:
-            chunk = self.chunks[chunk_id]
-            sim = cosine_similarity(query_embedding, chunk["embedding"])
-            results.append((chunk, sim))
+    def export_documents(self, document_ids: Sequence[str]) -> Tuple[List[dict], List[dict]]:
+        """The records of ``document_ids`` (missing ones skipped) and of their chunks."""
+        documents, chunks = [], []
+        for document_id in document_ids:
+            document = self.documents.get(document_id)
+            if document is None:
+                continue
+            documents.append(document)
+            chunks.extend(
+                chunk for chunk in map(self.chunks.get, list(self.document_chunks.get(document_id, ()))) if chunk
+            )
+        return documents, chunks
+
+    def import_records(self, library: dict, documents: List[dict] = (), chunks: List[dict] = ()):
+        """Insert records exported from another database as they are, ids included;
+        existing records with the same ids are replaced."""
+        lsn = None
+        with self._writing():
+            for table, records in (("libraries", [library]), ("documents", documents), ("chunks", chunks)):
+                if records:
+                    records = [dict(record) for record in records]
+                    self._apply_log_entry({"op": "put_many", "table": table, "records": records})
+                    lsn = self._log_put_many(table, records)
+        self.wal.commit(lsn)
+
+    def delete_documents(self, document_ids: Sequence[str]) -> int:
+        """Delete many documents under one lock; returns how many existed."""
+        lsn, deleted = None, 0
+        with self._writing():
+            for document_id in document_ids:
+                logged = self._delete_document(document_id)
+                if logged is not None:
+                    lsn, deleted = logged, deleted + 1
+        self.wal.commit(lsn)
+        return deleted
+
+    # === ORDERED ITERATION ===
+    # Records are listed in key order along the hierarchy: libraries by id,
+    # documents by (library id, id), chunks by (library id, document id, id).
+    # A cursor is the key path of the last record returned, so a page resumes
+    # exactly after it however the tables changed in between.
+
+    def iter_libraries(self, after: Sequence[str] = ()) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+        return self._iter(self.libraries, 0, 0, None, after)
+
+    def iter_documents(
+        self, library_id: Optional[str] = None, after: Sequence[str] = ()
+    ) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+        if library_id is not None:
+            return self._iter(self.documents, 1, 1, library_id, after)
+        return self._iter(self.documents, 1, 0, None, after)
+
+    def iter_chunks(
+        self, library_id: Optional[str] = None, document_id: Optional[str] = None, after: Sequence[str] = ()
+    ) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+        if document_id is not None:
+            document = self.documents.get(document_id)
+            if document is None or library_id not in (None, document["library_id"]):
+                return iter(())
+            return self._iter(self.chunks, 2, 2, document_id, after)
+        if library_id is not None:
+            return self._iter(self.chunks, 2, 1, library_id, after)
+        return self._iter(self.chunks, 2, 0, None, after)
+
+    def _iter(
+        self, table: RecordTable, depth: int, start: int, parent: Optional[str], after: Sequence[str]
+    ) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+        """Yield ``(key path, record)`` for the records of ``table``, which sits at
+        ``depth`` in the hierarchy, walking down from the children of ``parent``
+        at ``start``; paths (and cursors) begin at that level."""
+        if len(after) not in (0, depth - start + 1):
+            raise ValueError("Invalid cursor")
+        return self._records(table, self._walk(start, depth, parent, tuple(after)))
+
+    @staticmethod
+    def _records(table: RecordTable, paths: Iterator[Tuple[str, ...]]) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+        for path in paths:
+            # Deleted since its parent's children were listed.
+            record = table.get(path[-1])
+            if record is not None:
+                yield path, record
+
+    def _children(self, depth: int, parent: Optional[str]) -> List[str]:
+        if depth == 0:
+            return sorted(self.libraries)
+        relation = self.library_documents if depth == 1 else self.document_chunks
+        # list() copies in one step, so concurrent writers cannot break the sort.
+        return sorted(list(relation.get(parent, ())))
+
+    def _walk(
+        self, depth: int, target: int, parent: Optional[str], after: Tuple[str, ...]
+    ) -> Iterator[Tuple[str, ...]]:
+        keys = self._children(depth, parent)
+        if not after:
+            position = 0
+        elif depth == target:
+            position = bisect.bisect_right(keys, after[0])
+        else:
+            position = bisect.bisect_left(keys, after[0])
+        for key in keys[position:]:
+            if depth == target:
+                yield (key,)
+            else:
+                rest = after[1:] if after and key == after[0] else ()
+                for path in self._walk(depth + 1, target, key, rest):
+                    yield (key,) + path
+
+    def list_libraries(self, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[dict], Optional[str]]:
+        return self._page(self.iter_libraries(decode_cursor(cursor)), limit)
+
+    def list_documents(
+        self, library_id: Optional[str] = None, cursor: Optional[str] = None, limit: int = 100
+    ) -> Tuple[List[dict], Optional[str]]:
+        return self._page(self.iter_documents(library_id, decode_cursor(cursor)), limit)
+
+    def list_chunks(
+        self,
+        library_id: Optional[str] = None,
+        document_id: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[dict], Optional[str]]:
+        return self._page(self.iter_chunks(library_id, document_id, decode_cursor(cursor)), limit)
+
+    @staticmethod
+    def _page(records: Iterator[Tuple[Tuple[str, ...], dict]], limit: int) -> Tuple[List[dict], Optional[str]]:
+        """Up to ``limit`` records, and the cursor of the next page if there is one."""
+        items, last = [], None
+        for path, record in records:
+            if len(items) == limit:
+                return items, encode_cursor(last)
+            items.append(record)
+            last = path
+        return items, None
+
+    def search_chunks(
+        self,
+        library_id: str,
+        query_embedding: List[float],
+        k: int = 5,
+        filters: dict = None,
+        embeddings: bool = True,
+    ) -> List[Tuple[dict, float]]:
+        """Vector search; ``filters`` is evaluated by ``MetadataIndex.match``.
+        With ``embeddings=False`` the hits' records come without their embedding."""
+        index = self.vector_indexes.get(library_id)
+        if index is None:
+            return []
+        return self._resolve(self._search(index, query_embedding, k, self._match(library_id, filters)), embeddings)
+
+    def lexical_search_chunks(
+        self, library_id: str, query: str, k: int = 5, filters: dict = None, embeddings: bool = True
+    ) -> List[Tuple[dict, float]]:
+        """BM25 keyword search; needs no query embedding."""
+        index = self.lexical_indexes.get(library_id)
+        if index is None:
+            return []
+        return self._resolve(self._search(index, query, k, self._match(library_id, filters)), embeddings)
+
+    def hybrid_search_chunks(
+        self,
+        library_id: str,
+        query: str,
+        query_embedding: List[float],
+        k: int = 5,
+        candidates: int = None,
+        filters: dict = None,
+        embeddings: bool = True,
+    ) -> List[Tuple[dict, float]]:
+        """Fuse the vector and BM25 rankings with reciprocal rank fusion; scores
+        are the fused RRF scores. Each ranking contributes its top ``candidates``
+        (default ``4 * k``)."""
+        candidates = candidates or 4 * k
+        match = self._match(library_id, filters)
+        rankings = []
+        index = self.vector_indexes.get(library_id)
+        if index is not None:
+            rankings.append(self._search(index, query_embedding, candidates, match))
+        lexical = self.lexical_indexes.get(library_id)
+        if lexical is not None:
+            rankings.append(self._search(lexical, query, candidates, match))
+        return self._resolve(reciprocal_rank_fusion(rankings)[:k], embeddings)
+
+    def search_chunks_batch(self, queries: List[dict]) -> List[List[Tuple[dict, float]]]:
+        """Run many searches at once; results come back in the order of ``queries``.
+
+        Each query is a dict with ``library_id``, ``k`` and optional ``mode``
+        ("vector", "lexical" or "hybrid", default "vector"), ``query`` text,
+        ``query_embedding``, ``filters`` and ``embeddings``, as for the
+        single-query methods.
+        Unfiltered vector queries against indexes that support it are grouped by
+        library and scored together, one query-matrix x corpus-matrix product per
+        library, at the largest ``k`` of the group.
+        """
+        results: List[Optional[List[Tuple[dict, float]]]] = [None] * len(queries)
+        batches: Dict[str, List[int]] = {}
+        for i, query in enumerate(queries):
+            mode = query.get("mode", "vector")
+            library_id = query["library_id"]
+            filters = query.get("filters")
+            embeddings = query.get("embeddings", True)
+            if mode == "lexical":
+                results[i] = self.lexical_search_chunks(library_id, query["query"], query["k"], filters, embeddings)
+            elif mode == "hybrid":
+                results[i] = self.hybrid_search_chunks(
+                    library_id,
+                    query["query"],
+                    query["query_embedding"],
+                    query["k"],
+                    filters=filters,
+                    embeddings=embeddings,
+                )
+            elif filters or not hasattr(self.vector_indexes.get(library_id), "search_batch"):
+                results[i] = self.search_chunks(library_id, query["query_embedding"], query["k"], filters, embeddings)
+            else:
+                batches.setdefault(library_id, []).append(i)
+
+        for library_id, members in batches.items():
+            index = self.vector_indexes.get(library_id)
+            if index is None:
+                for i in members:
+                    results[i] = []
+                continue
+            matrix = np.asarray([queries[i]["query_embedding"] for i in members], dtype=np.float32)
+            with metrics.searching(type(index).__name__):
+                hits = index.search_batch(matrix, max(queries[i]["k"] for i in members))
+            for i, found in zip(members, hits):
+                results[i] = self._resolve(found[: queries[i]["k"]], queries[i].get("embeddings", True))
+        return results
+
+    def _match(self, library_id: str, filters: Optional[dict]) -> Optional[FilterMatch]:
+        if not filters:
+            return None
+        index = self.metadata_indexes.get(library_id)
+        if index is None:
+            index = MetadataIndex()  # empty library: still validates the filter
+        return index.match(filters)
+
+    @staticmethod
+    def _search(index, query, k: int, match: Optional[FilterMatch]) -> List[Tuple[str, float]]:
+        with metrics.searching(type(index).__name__):
+            if match is None:
+                return index.search(query, k)
+            return filtered_search(
+                index.search, index.search_subset, len(index), query, k, match, FILTER_PREFILTER_RATIO
+            )
+
+    def _resolve(self, hits: List[Tuple[str, float]], embeddings: bool = True) -> List[Tuple[dict, float]]:
+        chunks = self.chunks
+        skip = () if embeddings else ("embedding",)
+        results = []
+        for cid, score in hits:
+            # A chunk deleted after the index view was taken is simply dropped.
+            chunk = chunks.view(cid, skip)
+            if chunk is not None:
+                results.append((chunk, score))
+        return results
+
+
+def encode_cursor(path: Sequence[str]) -> str:
+    """Opaque page cursor for a record's key path."""
+    return base64.urlsafe_b64encode(json.dumps(list(path)).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Tuple[str, ...]:
+    """Inverse of ``encode_cursor``; raises ValueError for malformed cursors."""
+    if not cursor:
+        return ()
+    try:
+        path = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(path, list) or not all(isinstance(key, str) for key in path):
+        raise ValueError("Invalid cursor")
+    return tuple(path)
+
+
+_db: Optional[VectorDB] = None
+_db_lock = Lock()
+
+
+def get_db() -> VectorDB:
+    """The process-wide database; FastAPI routes receive it as a dependency."""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                if SHARDS:
+                    from app.core.sharding import ShardedVectorDB
+
+                    _db = ShardedVectorDB()
+                else:
+                    _db = VectorDB()
+    return _db
 
-        if len(results) < k:
-            for chunk in self.chunks.values():
-                if chunk["id"] not in chunk_ids_in_library and chunk["library_id"] == library_id:
-                    sim = cosine_similarity(query_embedding, chunk["embedding"])
-                    results.append((chunk, sim))
 
-        top_k = nlargest(k, results, key=lambda x: x[1])
-        return top_k
+def set_db(db: VectorDB):
+    global _db
+    _db = db
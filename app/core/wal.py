@@ -0,0 +1,288 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ("always", "interval", "never")
+# Pause between attempts to write a batch after a failed write or fsync.
+RETRY_INTERVAL = 0.1
+
+
+def _json_default(value):
+    # numpy arrays and scalars (e.g. memory-mapped embeddings) serialize as plain lists/numbers.
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+class WriteAheadLog:
+    """Append-only, segmented operation log with group commit.
+
+    Records are JSON lines appended to ``wal-<segment>.log`` files. Writers call
+    ``append`` (cheap, buffers the record and returns its LSN) and then ``commit``
+    once they no longer hold any caller-side lock. A single flusher thread writes
+    every buffered record in one batch, so concurrent writers share one write and
+    one fsync. The ``fsync`` policy controls durability:
+
+    - ``always``: ``commit`` returns once the record is fsynced.
+    - ``interval``: records are fsynced in the background every ``flush_interval``
+      seconds; ``commit`` does not wait.
+    - ``never``: records are handed to the OS only; no fsync is issued.
+
+    With ``shared=True`` several processes append to one log. Each appends to
+    the newest segment while holding the directory ``lock`` and flushes before
+    releasing it, and picks up the others' records with ``tail``.
+
+    A batch whose write or fsync fails goes back to the buffer and is retried;
+    ``commit`` raises for the records it holds rather than waiting on them.
+    """
+
+    def __init__(self, directory: Path, fsync: str = "always", flush_interval: float = 0.005, shared: bool = False):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}', expected one of {FSYNC_POLICIES}")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.flush_interval = flush_interval
+        self.shared = shared
+
+        self._cond = threading.Condition()
+        self._io_lock = threading.RLock()
+        self._buffer: List[bytes] = []
+        self._next_lsn = 1
+        self._flushed_lsn = 0
+        self._closed = False
+        # The last failed write, the last LSN it covered, and where its batch began in the file.
+        self._error: Optional[BaseException] = None
+        self._failed_lsn = 0
+        self._torn: Optional[int] = None
+        self.records_since_rotate = 0
+
+        self._lock_file = open(self.directory / "LOCK", "a+b") if shared else None
+        segments = self.segments()
+        if shared:
+            with self.lock():
+                self.segment = segments[-1] if segments else 1
+                self._file = self._open_segment(self.segment)
+        else:
+            self.segment = (segments[-1] + 1) if segments else 1
+            self._file = open(self._path(self.segment), "ab")
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="wal-flusher")
+        self._flusher.start()
+
+    def _path(self, segment: int) -> Path:
+        return self.directory / f"wal-{segment:08d}.log"
+
+    def segments(self) -> List[int]:
+        return sorted(int(p.stem.split("-")[1]) for p in self.directory.glob("wal-*.log"))
+
+    def _open_segment(self, segment: int):
+        f = open(self._path(segment), "ab")
+        if f.tell():
+            with open(self._path(segment), "rb") as reader:
+                reader.seek(-1, os.SEEK_END)
+                torn = reader.read(1) != b"\n"
+            if torn:
+                # Terminate a torn record left by a crashed process so it cannot swallow the next one.
+                f.write(b"\n")
+                f.flush()
+        return f
+
+    @contextmanager
+    def lock(self):
+        """Exclusive inter-process lock on the log (``shared`` mode only)."""
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def follow(self):
+        """Switch appends to the newest segment if another process rotated. Caller holds ``lock``."""
+        segments = self.segments()
+        if segments and segments[-1] != self.segment:
+            with self._io_lock:
+                self._write_buffer()
+                self._file.close()
+                self.segment = segments[-1]
+                self._file = self._open_segment(self.segment)
+
+    def position(self) -> Tuple[int, int]:
+        """End of the log as written by this process: ``(segment, byte offset)``."""
+        with self._io_lock:
+            return self.segment, self._file.tell()
+
+    def append(self, record: dict) -> int:
+        line = json.dumps(record, default=_json_default, separators=(",", ":")).encode() + b"\n"
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-ahead log is closed")
+            lsn = self._next_lsn
+            self._next_lsn += 1
+            self._buffer.append(line)
+            self.records_since_rotate += 1
+            self._cond.notify_all()
+            return lsn
+
+    def commit(self, lsn: Optional[int]):
+        if lsn is None or self.fsync != "always":
+            return
+        start = time.perf_counter()
+        with self._cond:
+            while self._flushed_lsn < lsn:
+                if self._error is not None and lsn <= self._failed_lsn:
+                    raise RuntimeError(f"Write-ahead log write failed: {self._error}") from self._error
+                if self._closed:
+                    break
+                self._cond.wait()
+        elapsed = time.perf_counter() - start
+        metrics.WAL_COMMIT_SECONDS.observe(elapsed)
+        metrics.record("wal_commit", elapsed)
+
+    def _write_buffer(self):
+        with self._io_lock:
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+                last_lsn = self._next_lsn - 1
+            start = None
+            try:
+                if self._torn is not None:
+                    self._reopen()
+                if batch:
+                    start = self._file.tell()
+                    self._file.write(b"".join(batch))
+                    self._file.flush()
+                    if self.fsync != "never":
+                        os.fsync(self._file.fileno())
+            except Exception as e:
+                metrics.WAL_WRITE_ERRORS.inc()
+                with self._cond:
+                    # Ahead of anything appended since, so the log keeps LSN order.
+                    self._buffer[:0] = batch
+                    self._error = e
+                    self._failed_lsn = last_lsn
+                    self._cond.notify_all()
+                if start is not None:
+                    self._torn = start
+                raise
+            with self._cond:
+                self._flushed_lsn = max(self._flushed_lsn, last_lsn)
+                self._error = None
+                self._cond.notify_all()
+
+    def _reopen(self):
+        """Drop whatever a failed write left of its batch, before the batch is written again."""
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        if not self.shared:
+            os.truncate(self._path(self.segment), self._torn)
+        # Other processes may have appended after it since: a torn record is terminated instead.
+        self._file = self._open_segment(self.segment)
+        self._torn = None
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            if self.fsync == "interval":
+                # Let more writers join this batch before paying for the fsync.
+                time.sleep(self.flush_interval)
+            try:
+                self._write_buffer()
+            except Exception:
+                logger.exception("Writing the write-ahead log failed")
+                time.sleep(RETRY_INTERVAL)
+
+    def flush(self):
+        self._write_buffer()
+
+    def rotate(self) -> int:
+        """Seal the current segment and start a new one; returns the new segment
+        number. Everything before it is covered by a checkpoint taken now."""
+        with self._io_lock:
+            self._write_buffer()
+            self._file.close()
+            self.segment = max([self.segment, *self.segments()]) + 1
+            self._file = open(self._path(self.segment), "ab")
+            self.records_since_rotate = 0
+            return self.segment
+
+    def truncate_before(self, segment: int):
+        for old in self.segments():
+            if old < segment:
+                self._path(old).unlink(missing_ok=True)
+
+    def replay(self, from_segment: int = 0) -> Iterator[dict]:
+        for segment in self.segments():
+            if segment < from_segment or segment == self.segment:
+                continue
+            with open(self._path(segment), "rb") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final record from a crash mid-write; nothing after it was acknowledged.
+                        break
+
+    def tail(self, segment: int, offset: int) -> Tuple[List[dict], int, int]:
+        """Complete records written after ``(segment, offset)``, by any process,
+        and the position just past them.
+
+        Raises FileNotFoundError if that segment was truncated away before it was
+        read to the end; the caller must reload from the latest snapshot.
+        """
+        records = []
+        while True:
+            segments = self.segments()
+            if segment == 0 and offset == 0 and segments:
+                segment = segments[0]
+            newer = [s for s in segments if s > segment]
+            # ``newer`` is listed before reading: once a newer segment exists this one is sealed.
+            with open(self._path(segment), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Torn record from a crashed writer, terminated when the log was reopened.
+                    continue
+            offset += end
+            if not newer:
+                return records, segment, offset
+            segment, offset = newer[0], 0
+
+    def close(self):
+        with self._io_lock:
+            if self._closed:
+                return
+            try:
+                self._write_buffer()
+            finally:
+                with self._cond:
+                    self._closed = True
+                    self._cond.notify_all()
+                try:
+                    self._file.close()
+                except OSError:
+                    # Only after a failed final write, which is raised instead.
+                    pass
+                if self._lock_file is not None:
+                    self._lock_file.close()
+        self._flusher.join(timeout=1)
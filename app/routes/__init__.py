@@ -1,3 +1,4 @@
 from .chunk import router as chunk_router
 from .document import router as document_router
 from .library import router as library_router
+from .metrics import router as metrics_router
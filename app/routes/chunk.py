@@ -1,19 +1,47 @@
-from typing import List
+from typing import List, Literal, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.result_cache import ResultCache, get_result_cache, search_key
+from app.core.v_db import VectorDB, decode_cursor, get_db
+from app.routes.pagination import RawJSONResponse, field_value, ndjson_response, page_response, parse_fields
+from app.schemas.chunk import (
+    BatchSearchRequestSchema,
+    Chunk,
+    ChunkBulkCreate,
+    ChunkCreate,
+    ChunkUpdate,
+    SearchResultChunk,
+    SearchRequestSchema,
+)
+from app.schemas.page import Page
+from app.services.embedding import aembed_texts, aget_embedding
 
-from fastapi import APIRouter, HTTPException, status, Path
+router = APIRouter(prefix="/v1/chunk",tags=["Chunk"])
 
-from app.core.v_db import VectorDB
-from app.schemas.chunk import Chunk, ChunkCreate, ChunkUpdate, SearchResultChunk, SearchRequestSchema
-from app.services.cohere_embedding import get_embedding
+CHUNK_FIELDS = list(Chunk.model_fields)
 
-router = APIRouter(prefix="/v1/chunk",tags=["Chunk"])
-db = VectorDB()
+
+def search_hits(results: List[Tuple[dict, float]], fields: Optional[List[str]]) -> List[dict]:
+    """Hits as plain dicts, read from the stored records without copying them:
+    the full chunk (as in ``SearchResultChunk``), or with ``fields`` a flat
+    ``{"id", "score", *fields}``."""
+    if fields is None:
+        return [
+            {"chunk": {field: field_value(chunk, field) for field in CHUNK_FIELDS}, "score": score}
+            for chunk, score in results
+        ]
+    return [
+        {"id": chunk["id"], "score": score, **{field: field_value(chunk, field) for field in fields}}
+        for chunk, score in results
+    ]
 
 
 @router.post("/", response_model=Chunk, status_code=status.HTTP_201_CREATED)
-def create_chunk(chunk_in: ChunkCreate):
+async def create_chunk(chunk_in: ChunkCreate, db: VectorDB = Depends(get_db)):
     try:
-        chunk_id = db.create_chunk(
+        chunk_id = await db.acreate_chunk(
             document_id=chunk_in.document_id,
             content=chunk_in.content,
             metadata=chunk_in.metadata,
@@ -23,13 +51,50 @@ def create_chunk(chunk_in: ChunkCreate):
         raise HTTPException(status_code=404, detail=str(e))
 
 
-@router.get("/", response_model=List[Chunk])
-def list_chunks():
-    return db.get_all_chunks()
+@router.post("/bulk", response_model=List[Chunk], status_code=status.HTTP_201_CREATED)
+async def create_chunks(bulk_in: ChunkBulkCreate, db: VectorDB = Depends(get_db)):
+    try:
+        chunk_ids = await db.acreate_chunks(
+            document_id=bulk_in.document_id,
+            chunks=[chunk.model_dump() for chunk in bulk_in.chunks],
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return [db.get_chunk(chunk_id) for chunk_id in chunk_ids]
+
+
+@router.get("/", response_model=Page[Chunk])
+async def list_chunks(
+    library_id: Optional[str] = None,
+    document_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    fields: Optional[str] = Query(
+        None, description="Comma-separated fields to return; 'embedding' is only returned when asked for"
+    ),
+    format: Literal["json", "ndjson"] = "json",
+    db: VectorDB = Depends(get_db),
+):
+    """Chunks (of ``document_id``, ``library_id``, or everything) in id order,
+    one page at a time; ``format=ndjson`` streams every chunk from ``cursor`` on
+    instead."""
+    selected = parse_fields(fields, CHUNK_FIELDS + ["embedding"])
+    if library_id is not None and not db.library_exists(library_id):
+        raise HTTPException(status_code=404, detail="Library not found")
+    if document_id is not None and not db.document_exists(document_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    try:
+        if format == "ndjson":
+            records = db.iter_chunks(library_id, document_id, decode_cursor(cursor))
+            return ndjson_response(records, selected or CHUNK_FIELDS)
+        items, next_cursor = await run_in_threadpool(db.list_chunks, library_id, document_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(items, next_cursor, selected)
 
 
 @router.get("/{chunk_id}", response_model=Chunk)
-def get_chunk(chunk_id: str = Path(..., description="The ID of the chunk")):
+async def get_chunk(chunk_id: str = Path(..., description="The ID of the chunk"), db: VectorDB = Depends(get_db)):
     chunk = db.get_chunk(chunk_id)
     if not chunk:
         raise HTTPException(status_code=404, detail="Chunk not found")
@@ -37,38 +102,140 @@ def get_chunk(chunk_id: str = Path(..., description="The ID of the chunk")):
 
 
 @router.put("/{chunk_id}", response_model=Chunk)
-def update_chunk(chunk_id: str, chunk_update: ChunkUpdate):
+async def update_chunk(chunk_id: str, chunk_update: ChunkUpdate, db: VectorDB = Depends(get_db)):
     if not db.chunk_exists(chunk_id):
         raise HTTPException(status_code=404, detail="Chunk not found")
-    db.update_chunk(
-        chunk_id,
-        content=chunk_update.content,
-        embedding=chunk_update.embedding,
-        metadata=chunk_update.metadata,
-    )
+    try:
+        await db.aupdate_chunk(chunk_id, content=chunk_update.content, metadata=chunk_update.metadata)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return db.get_chunk(chunk_id)
 
 
 @router.delete("/{chunk_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_chunk(chunk_id: str):
-    if not db.delete_chunk(chunk_id):
+async def delete_chunk(chunk_id: str, db: VectorDB = Depends(get_db)):
+    if not await run_in_threadpool(db.delete_chunk, chunk_id):
         raise HTTPException(status_code=404, detail="Chunk not found")
 
 
 
+@router.get("/search/cache")
+def search_cache_stats(cache: ResultCache = Depends(get_result_cache)):
+    """Hit rate and size of the search result cache."""
+    return cache.stats()
+
+
 @router.post("/search", response_model=List[SearchResultChunk])
-def search_chunks(request: SearchRequestSchema, vector_db=None):
-    # Embed the query using Cohere
+async def search_chunks(
+    request: SearchRequestSchema,
+    db: VectorDB = Depends(get_db),
+    cache: ResultCache = Depends(get_result_cache),
+):
+    filters = request.filter.model_dump(exclude_none=True) if request.filter else None
+    # Embeddings stay out of the hits (and, sharded, out of the shards' replies) unless asked for.
+    embeddings = "embedding" in (request.fields or ())
+    key = version = None
+    if cache.enabled:
+        key = search_key(request.library_id, request.mode, request.query, request.k, filters, embeddings)
+        version = await run_in_threadpool(db.library_version, request.library_id)
+        results = cache.get(key, version)
+        if results is not None:
+            return RawJSONResponse(search_hits(results, request.fields))
+
     try:
-        query_embedding = get_embedding(request.query)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Cohere embedding failed: {str(e)}")
-
-    # Search in VectorDB
-    results = vector_db.search_chunks(
-        library_id=request.library_id,
-        query_embedding=query_embedding,
-        k=request.k
-    )
-
-    return [{"chunk": chunk, "score": score} for chunk, score in results]
\ No newline at end of file
+        if request.mode == "lexical":
+            results = await run_in_threadpool(
+                db.lexical_search_chunks,
+                library_id=request.library_id,
+                query=request.query,
+                k=request.k,
+                filters=filters,
+                embeddings=embeddings,
+            )
+        else:
+            # Embed the query with the model the library's chunks were embedded with
+            try:
+                query_embedding = await aget_embedding(request.query, input_type="search_query", embedder=db.embedder)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Cohere embedding failed: {str(e)}")
+
+            # Search in VectorDB
+            if request.mode == "hybrid":
+                results = await run_in_threadpool(
+                    db.hybrid_search_chunks,
+                    library_id=request.library_id,
+                    query=request.query,
+                    query_embedding=query_embedding,
+                    k=request.k,
+                    filters=filters,
+                    embeddings=embeddings,
+                )
+            else:
+                results = await run_in_threadpool(
+                    db.search_chunks,
+                    library_id=request.library_id,
+                    query_embedding=query_embedding,
+                    k=request.k,
+                    filters=filters,
+                    embeddings=embeddings,
+                )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if key is not None:
+        # Tagged with the version from before the search: a write made meanwhile makes it stale at once.
+        cache.put(key, version, results)
+    return RawJSONResponse(search_hits(results, request.fields))
+
+
+@router.post("/search/batch", response_model=List[List[SearchResultChunk]])
+async def search_chunks_batch(
+    request: BatchSearchRequestSchema,
+    db: VectorDB = Depends(get_db),
+    cache: ResultCache = Depends(get_result_cache),
+):
+    """Many searches in one request; results are returned in the order of ``queries``."""
+    queries = [
+        {
+            "library_id": item.library_id,
+            "query": item.query,
+            "k": item.k,
+            "mode": item.mode,
+            "filters": item.filter.model_dump(exclude_none=True) if item.filter else None,
+            "embeddings": "embedding" in (item.fields or ()),
+        }
+        for item in request.queries
+    ]
+    results: List[Optional[List[Tuple[dict, float]]]] = [None] * len(queries)
+    keys, versions = [], {}
+    if cache.enabled:
+        keys = [
+            search_key(q["library_id"], q["mode"], q["query"], q["k"], q["filters"], q["embeddings"]) for q in queries
+        ]
+        library_ids = {query["library_id"] for query in queries}
+        versions = await run_in_threadpool(lambda: {lid: db.library_version(lid) for lid in library_ids})
+        results = [cache.get(key, versions[query["library_id"]]) for key, query in zip(keys, queries)]
+    pending = [i for i, hits in enumerate(results) if hits is None]
+
+    # Every query that needs an embedding is embedded in one provider call.
+    to_embed = [queries[i] for i in pending if queries[i]["mode"] != "lexical"]
+    if to_embed:
+        try:
+            embeddings = await aembed_texts(
+                [query["query"] for query in to_embed], input_type="search_query", embedder=db.embedder
+            )
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Cohere embedding failed: {str(e)}")
+        for query, embedding in zip(to_embed, embeddings):
+            query["query_embedding"] = embedding
+
+    if pending:
+        try:
+            found = await run_in_threadpool(db.search_chunks_batch, [queries[i] for i in pending])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        for i, hits in zip(pending, found):
+            results[i] = hits
+            if keys:
+                cache.put(keys[i], versions[queries[i]["library_id"]], hits)
+    return RawJSONResponse([search_hits(hits, item.fields) for item, hits in zip(request.queries, results)])
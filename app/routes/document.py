@@ -1,47 +1,75 @@
-from typing import List
+from typing import Literal, Optional
 
-from fastapi import APIRouter, HTTPException, status, Path
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
+from fastapi.concurrency import run_in_threadpool
 
-from app.core.v_db import VectorDB
+from app.core.v_db import VectorDB, decode_cursor, get_db
+from app.routes.pagination import ndjson_response, page_response, parse_fields
 from app.schemas.document import Document, DocumentCreate, DocumentUpdate
+from app.schemas.page import Page
 
 router = APIRouter(prefix="/v1/documnet",tags=["Document"])
-db = VectorDB()
+
+DOCUMENT_FIELDS = [field for field in Document.model_fields if field != "chunks"]
 
 
 @router.post("/", response_model=Document, status_code=status.HTTP_201_CREATED)
-def create_document(doc: DocumentCreate):
+async def create_document(doc: DocumentCreate, db: VectorDB = Depends(get_db)):
     if not db.library_exists(doc.library_id):
         raise HTTPException(status_code=404, detail="Library not found")
-    document_id = db.create_document(doc.library_id, doc.title, doc.metadata)
+    document_id = await run_in_threadpool(db.create_document, doc.library_id, doc.title, doc.metadata)
     document = db.get_document(document_id)
     if not document:
         raise HTTPException(status_code=500, detail="Document creation failed")
     return document
 
 
-@router.get("/", response_model=List[Document])
-def list_documents():
-    return db.get_all_documents()
+@router.get("/", response_model=Page[Document])
+async def list_documents(
+    library_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    format: Literal["json", "ndjson"] = "json",
+    db: VectorDB = Depends(get_db),
+):
+    """Documents (of ``library_id``, or of every library) in id order, one page
+    at a time (without their chunks); ``format=ndjson`` streams every document
+    from ``cursor`` on instead."""
+    selected = parse_fields(fields, DOCUMENT_FIELDS)
+    if library_id is not None and not db.library_exists(library_id):
+        raise HTTPException(status_code=404, detail="Library not found")
+    try:
+        if format == "ndjson":
+            records = db.iter_documents(library_id, decode_cursor(cursor))
+            return ndjson_response(records, selected or DOCUMENT_FIELDS)
+        items, next_cursor = await run_in_threadpool(db.list_documents, library_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(items, next_cursor, selected)
 
 
 @router.get("/{document_id}", response_model=Document)
-def get_document(document_id: str = Path(..., description="The ID of the document")):
-    doc = db.get_document(document_id)
+async def get_document(
+    document_id: str = Path(..., description="The ID of the document"),
+    expand: Literal["chunks", "none"] = "chunks",
+    db: VectorDB = Depends(get_db),
+):
+    doc = db.get_document(document_id, expand)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     return doc
 
 
 @router.put("/{document_id}", response_model=Document)
-def update_document(document_id: str, doc_update: DocumentUpdate):
+async def update_document(document_id: str, doc_update: DocumentUpdate, db: VectorDB = Depends(get_db)):
     if not db.document_exists(document_id):
         raise HTTPException(status_code=404, detail="Document not found")
-    db.update_document(document_id, doc_update.title, doc_update.metadata)
+    await run_in_threadpool(db.update_document, document_id, doc_update.title, doc_update.metadata)
     return db.get_document(document_id)
 
 
 @router.delete("/{document_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_document(document_id: str):
-    if not db.delete_document(document_id):
+async def delete_document(document_id: str, db: VectorDB = Depends(get_db)):
+    if not await run_in_threadpool(db.delete_document, document_id):
         raise HTTPException(status_code=404, detail="Document not found")
@@ -1,49 +1,81 @@
-from typing import List
+from typing import Literal, Optional
 
-from fastapi import APIRouter, HTTPException, status, Path
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
+from fastapi.concurrency import run_in_threadpool
 
-from app.core.v_db import VectorDB
+from app.core.v_db import VectorDB, decode_cursor, get_db
+from app.routes.pagination import ndjson_response, page_response, parse_fields
 from app.schemas.library import Library, LibraryCreate, LibraryUpdate
+from app.schemas.page import Page
 
 router = APIRouter(prefix="/v1/library",tags=["Library"])
-db = VectorDB()
+
+LIBRARY_FIELDS = [field for field in Library.model_fields if field not in ("documents", "index")]
 
 
 @router.post("/", response_model=Library, status_code=status.HTTP_201_CREATED)
-def create_library(library: LibraryCreate):
-    library_id = db.create_library(name=library.name, metadata=library.metadata)
+async def create_library(library: LibraryCreate, db: VectorDB = Depends(get_db)):
+    try:
+        library_id = await run_in_threadpool(
+            db.create_library,
+            name=library.name,
+            metadata=library.metadata,
+            index_type=library.index_type,
+            index_params=library.index_params,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     created = db.get_library(library_id)
     if not created:
         raise HTTPException(status_code=500, detail="Library creation failed")
     return created
 
 
-@router.get("/", response_model=List[Library])
-def list_libraries():
-    return db.get_all_libraries()  # already includes documents & chunks
+@router.get("/", response_model=Page[Library])
+async def list_libraries(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    format: Literal["json", "ndjson"] = "json",
+    db: VectorDB = Depends(get_db),
+):
+    """Libraries in id order, one page at a time (without their documents);
+    ``format=ndjson`` streams every library from ``cursor`` on instead."""
+    selected = parse_fields(fields, LIBRARY_FIELDS)
+    try:
+        if format == "ndjson":
+            return ndjson_response(db.iter_libraries(decode_cursor(cursor)), selected or LIBRARY_FIELDS)
+        items, next_cursor = await run_in_threadpool(db.list_libraries, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(items, next_cursor, selected)
 
 
 @router.get("/{library_id}", response_model=Library)
-def get_library(library_id: str = Path(..., description="The ID of the library")):
-    lib = db.get_library(library_id)
+async def get_library(
+    library_id: str = Path(..., description="The ID of the library"),
+    expand: Literal["chunks", "documents", "none"] = "chunks",
+    db: VectorDB = Depends(get_db),
+):
+    lib = await run_in_threadpool(db.get_library, library_id, expand)
     if not lib:
         raise HTTPException(status_code=404, detail="Library not found")
     return lib  # already enriched
 
 
 @router.put("/{library_id}", response_model=Library)
-def update_library(library_id: str, library_update: LibraryUpdate):
+async def update_library(library_id: str, library_update: LibraryUpdate, db: VectorDB = Depends(get_db)):
     if not db.library_exists(library_id):
         raise HTTPException(status_code=404, detail="Library not found")
-    db.update_library(
-        library_id, name=library_update.name, metadata=library_update.metadata
+    await run_in_threadpool(
+        db.update_library, library_id, name=library_update.name, metadata=library_update.metadata
     )
     updated = db.get_library(library_id)
     return updated
 
 
 @router.delete("/{library_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_library(library_id: str):
-    deleted = db.delete_library(library_id)
+async def delete_library(library_id: str, db: VectorDB = Depends(get_db)):
+    deleted = await run_in_threadpool(db.delete_library, library_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Library not found")
@@ -0,0 +1,87 @@
+import datetime
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+
+NDJSON_BATCH = 256
+_DATETIME = TypeAdapter(datetime.datetime)
+
+
+def _json_default(value):
+    # Embeddings are numpy arrays (or memory-mapped rows).
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def api_time(value: Any) -> Any:
+    """A stored ``created_at`` written the way the response models write it
+    (UTC as ``Z``), so raw and model-encoded responses agree byte for byte."""
+    if isinstance(value, str) and value.endswith("+00:00"):
+        return value[:-6] + "Z"
+    try:
+        return _DATETIME.dump_python(_DATETIME.validate_python(value), mode="json")
+    except ValidationError:
+        return value
+
+
+def field_value(record: dict, field: str) -> Any:
+    value = record.get(field)
+    return api_time(value) if field == "created_at" and value is not None else value
+
+
+class RawJSONResponse(Response):
+    """JSON encoded straight from plain dicts and lists, bypassing the route's
+    response model; project record fields with ``field_value`` to match it."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> Optional[List[str]]:
+    """The comma-separated ``fields`` projection, validated against ``allowed``;
+    None when no projection was asked for. ``id`` is always included."""
+    if not fields:
+        return None
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = sorted(set(selected) - set(allowed))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}, expected some of {list(allowed)}")
+    return ["id"] + [field for field in dict.fromkeys(selected) if field != "id"]
+
+
+def project(record: dict, fields: Sequence[str]) -> dict:
+    return {field: field_value(record, field) for field in fields}
+
+
+def page_response(items: List[dict], next_cursor: Optional[str], fields: Optional[List[str]]):
+    if fields is None:
+        return {"items": items, "next_cursor": next_cursor}
+    # Projected items no longer fit the response model, so they bypass it.
+    return RawJSONResponse({"items": [project(item, fields) for item in items], "next_cursor": next_cursor})
+
+
+def ndjson_response(records: Iterator[Tuple[Tuple[str, ...], dict]], fields: Sequence[str]) -> StreamingResponse:
+    """Stream ``records`` as newline-delimited JSON, one projected record per
+    line, without materializing the whole result."""
+
+    def lines() -> Iterator[bytes]:
+        batch = []
+        for _, record in records:
+            batch.append(dumps(project(record, fields)))
+            if len(batch) == NDJSON_BATCH:
+                yield b"\n".join(batch) + b"\n"
+                batch = []
+        if batch:
+            yield b"\n".join(batch) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
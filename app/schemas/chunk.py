@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Literal, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class ChunkBase(BaseModel):
@@ -13,6 +13,11 @@ class ChunkCreate(ChunkBase):
     document_id: str
 
 
+class ChunkBulkCreate(BaseModel):
+    document_id: str
+    chunks: List[ChunkBase]
+
+
 class ChunkUpdate(ChunkBase):
     pass
 
@@ -24,10 +29,30 @@ class Chunk(ChunkBase):
     created_at: datetime
 
 
+class SearchFilter(BaseModel):
+    document_id: Optional[Union[str, List[str]]] = None
+    # field -> value (equality), list of values (any of), or operators
+    # {"eq", "in", "gt", "gte", "lt", "lte"}, e.g. {"year": {"gte": 2020}}
+    metadata: Optional[Dict[str, Any]] = None
+
+
 class SearchRequestSchema(BaseModel):
     library_id: str
     query: str
-    k: int = 5
+    k: int = Field(5, ge=1, le=1000)
+    # "lexical" ranks by BM25 without embedding the query; "hybrid" fuses both rankings.
+    mode: Literal["vector", "lexical", "hybrid"] = "vector"
+    filter: Optional[SearchFilter] = None
+    # Return flat hits with only id, score and these chunk fields instead of the full chunk;
+    # the embedding is sent only when listed here.
+    fields: Optional[
+        List[Literal["content", "metadata", "document_id", "library_id", "created_at", "embedding"]]
+    ] = None
+
+class BatchSearchRequestSchema(BaseModel):
+    # Each query may target its own library, k, mode and filter.
+    queries: List[SearchRequestSchema] = Field(..., min_length=1, max_length=256)
+
 
 class SearchResultChunk(BaseModel):
     chunk: Chunk
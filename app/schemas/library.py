@@ -12,14 +12,37 @@ class LibraryBase(BaseModel):
 
 
 class LibraryCreate(LibraryBase):
-    pass
+    index_type: Optional[str] = None
+    index_params: Optional[dict] = None
 
 
 class LibraryUpdate(LibraryBase):
     pass
 
 
+class IndexBuild(BaseModel):
+    engine: str
+    params: dict = Field(default_factory=dict)
+    done: int
+    total: int
+    started_at: datetime
+
+
+class IndexStatus(BaseModel):
+    # For "auto" libraries, the engine currently serving searches.
+    engine: str
+    params: dict = Field(default_factory=dict)
+    search_params: dict = Field(default_factory=dict)
+    size: int = 0
+    recall: Optional[float] = None
+    latency_p95_ms: Optional[float] = None
+    build: Optional[IndexBuild] = None
+
+
 class Library(LibraryBase):
     id: str
+    index_type: str = "flat"
+    index_params: dict = Field(default_factory=dict)
     created_at: datetime
     documents: List[Document] = Field(default_factory=list)
+    index: Optional[IndexStatus] = None
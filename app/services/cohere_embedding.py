@@ -1,10 +1,101 @@
+import asyncio
+import random
+from typing import List, Optional
+
 import cohere
+import httpx
+from cohere.core.api_error import ApiError
+
+from app.core.config import (
+    COHERE_API_KEY,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_MAX_CONNECTIONS,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_MODEL,
+    EMBEDDING_TIMEOUT,
+)
+from app.services.embedding import Embedder
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CohereEmbedder(Embedder):
+    def __init__(
+        self,
+        model: str = EMBEDDING_MODEL,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        api_key: str = None,
+        timeout: float = EMBEDDING_TIMEOUT,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        max_connections: int = EMBEDDING_MAX_CONNECTIONS,
+        max_concurrency: int = EMBEDDING_CONCURRENCY,
+    ):
+        self.model = model
+        self.batch_size = batch_size
+        self.api_key = api_key or COHERE_API_KEY
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.client = cohere.Client(self.api_key, timeout=timeout)
+
+        # The async client and its connection pool are bound to the event loop
+        # that first uses them, so they are created lazily.
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._async_client: Optional[cohere.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def embed(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
+        response = self.client.embed(
+            texts=texts,
+            model=self.model,
+            input_type=input_type,
+            request_options={"max_retries": self.max_retries},
+        )
+        return response.embeddings
 
-from app.core.config import COHERE_API_KEY
+    def _get_async_client(self) -> cohere.AsyncClient:
+        if self._async_client is None:
+            self._http_client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections, max_keepalive_connections=self.max_connections
+                ),
+            )
+            self._async_client = cohere.AsyncClient(self.api_key, timeout=self.timeout, httpx_client=self._http_client)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._async_client
 
-co = cohere.Client(COHERE_API_KEY)
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, ApiError):
+            return error.status_code is None or error.status_code in RETRYABLE_STATUS_CODES
+        return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
 
+    async def aembed(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
+        client = self._get_async_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    response = await asyncio.wait_for(
+                        client.embed(
+                            texts=texts,
+                            model=self.model,
+                            input_type=input_type,
+                            request_options={"max_retries": 0},
+                        ),
+                        timeout=self.timeout,
+                    )
+                return response.embeddings
+            except Exception as e:
+                if attempt == self.max_retries or not self._is_retryable(e):
+                    raise
+                # Exponential backoff with full jitter: 0.25s, 0.5s, 1s, ... capped at 8s.
+                await asyncio.sleep(random.uniform(0, min(8.0, 0.25 * 2**attempt)))
 
-def get_embedding(text: str) -> list[float]:
-    response = co.embed(texts=[text], model="embed-english-v3.0",input_type="search_document")
-    return response.embeddings[0]
+    async def aclose(self):
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+            self._async_client = None
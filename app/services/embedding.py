@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+import numpy as np
+
+from app.core import metrics
+from app.core.config import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_MAX_BYTES,
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_MODEL,
+    EMBEDDING_PROVIDER,
+    LOCAL_EMBEDDING_DIM,
+)
+
+
+class Embedder:
+    """Turns batches of texts into vectors. ``batch_size`` is the most texts the
+    provider accepts in a single call, or None when there is no limit."""
+
+    model: str = ""
+    batch_size: Optional[int] = EMBEDDING_BATCH_SIZE
+
+    def embed(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
+        raise NotImplementedError
+
+    async def aembed(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
+        # Providers without a native async client run the blocking call off the event loop.
+        return await asyncio.to_thread(self.embed, texts, input_type)
+
+
+class LocalEmbedder(Embedder):
+    """Deterministic, offline stand-in for a real provider.
+
+    Texts are embedded by signed feature hashing of their lowercased tokens, so
+    texts sharing words land close together. ``latency`` adds a fixed delay per
+    call to mimic a provider round-trip in benchmarks.
+    """
+
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM, batch_size: int = EMBEDDING_BATCH_SIZE, latency: float = 0.0):
+        self.dim = dim
+        self.batch_size = batch_size
+        self.latency = latency
+        self.model = f"local-hash-{dim}"
+
+    def _embed_one(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token in text.lower().split() or [text]:
+            h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if h >> 63 else -1.0
+        if not vec.any():
+            vec[0] = 1.0
+        return (vec / np.linalg.norm(vec)).tolist()
+
+    def embed(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed_one(text) for text in texts]
+
+    async def aembed(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._embed_one(text) for text in texts]
+
+
+_embedder: Optional[Embedder] = None
+_embedder_lock = threading.Lock()
+
+
+def create_embedder(provider: str = EMBEDDING_PROVIDER, cache_max_bytes: int = EMBEDDING_CACHE_MAX_BYTES) -> Embedder:
+    if provider == "cohere":
+        from app.services.cohere_embedding import CohereEmbedder
+
+        embedder = CohereEmbedder(model=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE)
+    elif provider == "local":
+        embedder = LocalEmbedder()
+    else:
+        raise ValueError(f"Unknown embedding provider '{provider}'")
+
+    if cache_max_bytes > 0:
+        from app.services.embedding_cache import CachedEmbedder, EmbeddingCache
+
+        disk_path = f"{EMBEDDING_CACHE_DIR}/embeddings.sqlite" if EMBEDDING_CACHE_DIR else None
+        embedder = CachedEmbedder(embedder, EmbeddingCache(max_bytes=cache_max_bytes, disk_path=disk_path))
+    return embedder
+
+
+def get_embedder() -> Embedder:
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = create_embedder()
+    return _embedder
+
+
+def set_embedder(embedder: Embedder):
+    global _embedder
+    _embedder = embedder
+
+
+_observing: ContextVar[bool] = ContextVar("embedding_observed", default=False)
+
+
+@contextmanager
+def _observed(texts: List[str], input_type: str):
+    """Time one embedding call; a call nested in another (a cache wrapping the
+    provider) is part of the outer one and not observed again."""
+    if _observing.get():
+        yield
+        return
+    token = _observing.set(True)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _observing.reset(token)
+        elapsed = time.perf_counter() - start
+        metrics.EMBEDDING_SECONDS.observe(elapsed, input_type=input_type)
+        metrics.EMBEDDED_TEXTS.inc(len(texts), input_type=input_type)
+        metrics.record("embedding", elapsed)
+
+
+def embed_texts(
+    texts: List[str],
+    input_type: str = "search_document",
+    embedder: Optional[Embedder] = None,
+    max_concurrency: int = EMBEDDING_CONCURRENCY,
+) -> List[List[float]]:
+    """Embed ``texts`` in provider-sized batches, at most ``max_concurrency`` in
+    flight, returning vectors in input order."""
+    embedder = embedder or get_embedder()
+    batch_size = embedder.batch_size or max(len(texts), 1)
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    with _observed(texts, input_type):
+        if len(batches) <= 1 or max_concurrency <= 1:
+            results = [embedder.embed(batch, input_type) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as pool:
+                results = list(pool.map(lambda batch: embedder.embed(batch, input_type), batches))
+    return [vector for batch in results for vector in batch]
+
+
+async def aembed_texts(
+    texts: List[str],
+    input_type: str = "search_document",
+    embedder: Optional[Embedder] = None,
+    max_concurrency: int = EMBEDDING_CONCURRENCY,
+) -> List[List[float]]:
+    """Async counterpart of ``embed_texts``: batches are awaited concurrently,
+    at most ``max_concurrency`` at a time."""
+    embedder = embedder or get_embedder()
+    batch_size = embedder.batch_size or max(len(texts), 1)
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+    async def run(batch: List[str]) -> List[List[float]]:
+        async with semaphore:
+            return await embedder.aembed(batch, input_type)
+
+    with _observed(texts, input_type):
+        results = await asyncio.gather(*(run(batch) for batch in batches))
+    return [vector for batch in results for vector in batch]
+
+
+def get_embedding(
+    text: str, input_type: str = "search_document", embedder: Optional[Embedder] = None
+) -> List[float]:
+    with _observed([text], input_type):
+        return (embedder or get_embedder()).embed([text], input_type)[0]
+
+
+async def aget_embedding(
+    text: str, input_type: str = "search_document", embedder: Optional[Embedder] = None
+) -> List[float]:
+    with _observed([text], input_type):
+        return (await (embedder or get_embedder()).aembed([text], input_type))[0]
@@ -0,0 +1,193 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core import metrics
+from app.core.config import EMBEDDING_CONCURRENCY
+from app.services.embedding import Embedder, aembed_texts, embed_texts
+
+# Rough per-entry bookkeeping cost (OrderedDict slot, key string, ndarray header).
+_ENTRY_OVERHEAD = 200
+
+
+class EmbeddingCache:
+    """Content-addressed embedding store.
+
+    Keys are a SHA-256 over (model, input_type, text). The memory tier is an LRU
+    bounded by ``max_bytes``; the optional disk tier is a SQLite file that
+    survives restarts and is consulted on memory misses. Lookups, evictions and
+    the memory tier's size are exported to ``/metrics`` as well as ``stats``.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, disk_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if disk_path:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._db_lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, input_type: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{input_type}\0{text}".encode()).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, key: str, vector: np.ndarray) -> int:
+        """Insert into the memory tier; returns how many entries it evicted. Caller holds ``self._lock``."""
+        size = vector.nbytes + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return 0
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.nbytes + _ENTRY_OVERHEAD
+        self._entries[key] = vector
+        self._bytes += size
+        evicted = 0
+        while self._bytes > self.max_bytes:
+            _, dropped = self._entries.popitem(last=False)
+            self._bytes -= dropped.nbytes + _ENTRY_OVERHEAD
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def _publish(self, evicted: int = 0):
+        """Export the memory tier's size. Caller holds ``self._lock``."""
+        if evicted:
+            metrics.EMBEDDING_CACHE_EVICTIONS.inc(evicted)
+        metrics.EMBEDDING_CACHE_ENTRIES.set(len(self._entries))
+        metrics.EMBEDDING_CACHE_BYTES.set(self._bytes)
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._entries.move_to_end(key)
+                    found[key] = vector.tolist()
+                    self.hits += 1
+
+        disk_found = 0
+        if missing and self._db is not None:
+            rows = []
+            with self._db_lock:
+                for start in range(0, len(missing), 500):
+                    batch = missing[start : start + 500]
+                    rows += self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall()
+            with self._lock:
+                evicted = 0
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32).copy()
+                    evicted += self._remember(key, vector)
+                    found[key] = vector.tolist()
+                disk_found = len(rows)
+                self.disk_hits += disk_found
+                self._publish(evicted)
+
+        misses = len(missing) - disk_found
+        with self._lock:
+            self.misses += misses
+        for result, count in (("hit", len(keys) - len(missing)), ("disk_hit", disk_found), ("miss", misses)):
+            if count:
+                metrics.EMBEDDING_CACHE_REQUESTS.inc(count, result=result)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        vectors = {key: np.asarray(vector, dtype=np.float32) for key, vector in items.items()}
+        with self._lock:
+            evicted = 0
+            for key, vector in vectors.items():
+                evicted += self._remember(key, vector)
+            self._publish(evicted)
+        if self._db is not None and vectors:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, vector.tobytes()) for key, vector in vectors.items()],
+                )
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._publish()
+
+
+class CachedEmbedder(Embedder):
+    """Serves repeated texts from an ``EmbeddingCache`` and forwards only the
+    misses, deduplicated, to the wrapped embedder in provider-sized batches."""
+
+    batch_size = None
+
+    def __init__(self, embedder: Embedder, cache: EmbeddingCache, max_concurrency: int = EMBEDDING_CONCURRENCY):
+        self.embedder = embedder
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.model = embedder.model
+
+    def _lookup(self, texts: List[str], input_type: str):
+        keys = [EmbeddingCache.key(self.model, input_type, text) for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+        pending = {key: text for key, text in zip(keys, texts) if key not in found}
+        return keys, found, pending
+
+    def _store(self, keys: List[str], found: dict, pending: dict, vectors: List[List[float]]) -> List[List[float]]:
+        computed = dict(zip(pending.keys(), vectors))
+        self.cache.put_many(computed)
+        found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
+        keys, found, pending = self._lookup(texts, input_type)
+        vectors = []
+        if pending:
+            vectors = embed_texts(
+                list(pending.values()), input_type, embedder=self.embedder, max_concurrency=self.max_concurrency
+            )
+        return self._store(keys, found, pending, vectors)
+
+    async def aembed(self, texts: List[str], input_type: str = "search_document") -> List[List[float]]:
+        keys, found, pending = self._lookup(texts, input_type)
+        vectors = []
+        if pending:
+            vectors = await aembed_texts(
+                list(pending.values()), input_type, embedder=self.embedder, max_concurrency=self.max_concurrency
+            )
+        return self._store(keys, found, pending, vectors)
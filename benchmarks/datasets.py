@@ -0,0 +1,44 @@
+from typing import Tuple
+
+import numpy as np
+
+DATASETS = ("uniform", "clustered")
+
+
+def uniform(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    """Isotropic Gaussian vectors: no structure, the hardest case for pruning."""
+    return rng.standard_normal((n, dim), dtype=np.float32)
+
+
+def clustered(n: int, dim: int, rng: np.random.Generator, n_clusters: int = 64, spread: float = 0.3) -> np.ndarray:
+    """Gaussian blobs around random unit centers, closer to real embedding corpora."""
+    centers = rng.standard_normal((n_clusters, dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    noise = rng.standard_normal((n, dim), dtype=np.float32) * (spread / np.sqrt(dim))
+    return centers[rng.integers(n_clusters, size=n)] + noise
+
+
+def make_dataset(kind: str, n: int, n_queries: int, dim: int, seed: int = 0, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+    """``n`` corpus vectors and ``n_queries`` held-out queries from the same distribution."""
+    if kind not in DATASETS:
+        raise ValueError(f"Unknown dataset '{kind}', expected one of {DATASETS}")
+    rng = np.random.default_rng(seed)
+    if kind == "uniform":
+        data = uniform(n + n_queries, dim, rng)
+    else:
+        data = clustered(n + n_queries, dim, rng, **kwargs)
+    return data[:n], data[n:]
+
+
+def ground_truth(data: np.ndarray, queries: np.ndarray, k: int, batch_size: int = 256) -> np.ndarray:
+    """Exact cosine top-``k`` row numbers for every query, by brute force."""
+    corpus = data / (np.linalg.norm(data, axis=1, keepdims=True) + 1e-10)
+    queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-10)
+    k = min(k, len(corpus))
+    truth = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), batch_size):
+        scores = queries[start : start + batch_size] @ corpus.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+        truth[start : start + batch_size] = np.take_along_axis(top, order, axis=1)
+    return truth
@@ -0,0 +1,213 @@
+"""Benchmark the vector index engines on recall, latency, build cost and memory.
+
+    python -m benchmarks --dataset clustered --n 20000 --dim 128 \\
+        --engine flat --engine "hnsw:m=16,ef=64" --engine "ivf:nprobe=16" \\
+        --output results.json
+
+Each engine spec is ``<index type>[:param=value,...]`` as accepted by
+``create_index``, or ``linear_scan`` for the pure-Python baseline in
+``app.utils``. Every spec runs in a fresh process so its resident memory is
+measured in isolation. Engines that train a codebook (IVF, quantized) are
+trained on the corpus once it is loaded, whatever its size, and the training
+counts towards build time. Results are written as JSON (to ``--output`` or
+stdout) and summarized as a table on stderr.
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.core.indexing import create_index
+from app.utils import linear_scan
+from benchmarks.datasets import DATASETS, ground_truth, make_dataset
+
+DEFAULT_ENGINES = [
+    "flat",
+    "hnsw",
+    "ivf",
+    "lsh",
+    "quantized:quantizer=sq8",
+    "quantized:quantizer=pq",
+]
+
+
+def parse_engine(spec: str) -> Tuple[str, Dict]:
+    """``"hnsw:m=32,ef=128"`` -> ``("hnsw", {"m": 32, "ef": 128})``."""
+    name, _, rest = spec.partition(":")
+    params = {}
+    for item in filter(None, rest.split(",")):
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Expected param=value in engine spec '{spec}'")
+        try:
+            params[key.strip()] = json.loads(value)
+        except json.JSONDecodeError:
+            params[key.strip()] = value.strip()
+    return name.strip(), params
+
+
+def rss_bytes() -> int:
+    """Current resident set size; falls back to the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _LinearScan:
+    """Adapter giving ``app.utils.linear_scan`` the index interface."""
+
+    def __init__(self):
+        self.vectors: List[List[float]] = []
+        self.ids: List[str] = []
+
+    def add_vector(self, vector, vector_id: str):
+        self.vectors.append(list(map(float, vector)))
+        self.ids.append(vector_id)
+
+    def search(self, query, k: int = 5):
+        return [(self.ids[i], score) for i, score in linear_scan(self.vectors, list(map(float, query)), k)]
+
+
+def run_engine(spec: str, data: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    name, params = parse_engine(spec)
+    gc.collect()
+    baseline = rss_bytes()
+
+    index = _LinearScan() if name == "linear_scan" else create_index(name, params)
+    if hasattr(index, "vector_source"):
+        # Re-ranking reads full vectors from the corpus, as the database does from its records.
+        index.vector_source = lambda ids: [data[int(i)] for i in ids]
+    start = time.perf_counter()
+    for row, vector in enumerate(data):
+        index.add_vector(vector, str(row))
+    if not getattr(index, "is_trained", True):
+        # Below ``train_size`` these engines are still a flat scan; train them on the whole corpus instead.
+        index.train()
+    build_seconds = time.perf_counter() - start
+    gc.collect()
+    memory_bytes = rss_bytes() - baseline
+
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = index.search(query, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len({int(vector_id) for vector_id, _ in results} & set(expected.tolist()))
+    latencies = np.asarray(latencies) * 1000
+
+    return {
+        "engine": name,
+        "params": params,
+        "spec": spec,
+        "trained": getattr(index, "is_trained", None),
+        f"recall_at_{k}": hits / max(truth.size, 1),
+        "latency_ms": {
+            "mean": float(latencies.mean()),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+        },
+        "qps": float(len(latencies) / (latencies.sum() / 1000)),
+        "build_seconds": build_seconds,
+        "inserts_per_second": len(data) / build_seconds if build_seconds else None,
+        "memory_bytes": memory_bytes,
+        "bytes_per_vector": memory_bytes / len(data),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _print_header(k: int):
+    columns = ("recall@%d" % k, "p50 ms", "p95 ms", "p99 ms", "build s", "ins/s", "MiB")
+    print(f"{'engine':<36}" + "".join(f"{column:>10}" for column in columns), file=sys.stderr)
+
+
+def _print_row(result: dict, k: int):
+    latency = result["latency_ms"]
+    values = (
+        f"{result[f'recall_at_{k}']:.4f}",
+        f"{latency['p50']:.3f}",
+        f"{latency['p95']:.3f}",
+        f"{latency['p99']:.3f}",
+        f"{result['build_seconds']:.2f}",
+        f"{result['inserts_per_second'] or 0:.0f}",
+        f"{result['memory_bytes'] / 2**20:.1f}",
+    )
+    print(f"{result['spec'][:36]:<36}" + "".join(f"{value:>10}" for value in values), file=sys.stderr)
+
+
+def main(argv: List[str] = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", choices=DATASETS, default="clustered")
+    parser.add_argument("--n", type=int, default=10_000, help="corpus size")
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=64, help="blobs in the clustered dataset")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", action="append", help="engine spec, repeatable (default: all engines)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    extra = {"n_clusters": args.clusters} if args.dataset == "clustered" else {}
+    data, queries = make_dataset(args.dataset, args.n, args.queries, args.dim, seed=args.seed, **extra)
+    truth = ground_truth(data, queries, args.k)
+
+    results = []
+    _print_header(args.k)
+    # A fresh process per engine keeps each one's memory measurement clean.
+    context = multiprocessing.get_context("spawn")
+    for spec in args.engine or DEFAULT_ENGINES:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_engine, (spec, data, queries, truth, args.k)))
+        _print_row(results[-1], args.k)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": _git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "dataset": {
+            "kind": args.dataset,
+            "n": args.n,
+            "dim": args.dim,
+            "queries": args.queries,
+            "k": args.k,
+            "seed": args.seed,
+            **extra,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
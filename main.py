@@ -1,10 +1,26 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
-from app.routes import library_router, document_router, chunk_router
+from app.core.config import PROFILE_SAMPLE_RATE, SLOW_QUERY_SECONDS
+from app.core.metrics import SlowQueryProfiler, TraceMiddleware
+from app.core.v_db import get_db
+from app.routes import library_router, document_router, chunk_router, metrics_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the database once per worker before serving, rather than on the first request.
+    db = get_db()
+    yield
+    db.close()
+
 
-app = FastAPI(title="TAH Task BE(VectorDB)")
+app = FastAPI(title="TAH Task BE(VectorDB)", lifespan=lifespan)
+app.add_middleware(TraceMiddleware, profiler=SlowQueryProfiler(SLOW_QUERY_SECONDS, PROFILE_SAMPLE_RATE))
 
 # Register routes
 app.include_router(library_router)
 app.include_router(document_router)
 app.include_router(chunk_router)
+app.include_router(metrics_router)
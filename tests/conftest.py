@@ -0,0 +1,38 @@
+import os
+
+# Before any app module reads its configuration; shard worker processes inherit it.
+os.environ["EMBEDDING_PROVIDER"] = "local"
+os.environ["LOCAL_EMBEDDING_DIM"] = "16"
+
+import pytest
+
+from app.core.v_db import VectorDB
+from app.services.embedding import LocalEmbedder
+
+
+@pytest.fixture
+def embedder():
+    return LocalEmbedder()
+
+
+@pytest.fixture
+def open_db(tmp_path, embedder):
+    """Open a VectorDB on ``tmp_path`` (or ``path``) with its background
+    threads off; every database opened is closed at teardown."""
+    opened = []
+
+    def open_db(path=None, **kwargs):
+        options = {
+            "embedder": embedder,
+            "checkpoint_interval": 0,
+            "compact_interval": 0,
+            "index_manager_interval": 0,
+            **kwargs,
+        }
+        db = VectorDB(str(path or tmp_path), **options)
+        opened.append(db)
+        return db
+
+    yield open_db
+    for db in opened:
+        db.close()
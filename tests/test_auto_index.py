@@ -0,0 +1,53 @@
+import numpy as np
+
+from app.core.indexing import create_index
+from app.core.indexing.auto import AutoIndex
+
+IVF_PARAMS = {"train_size": 100, "n_clusters": 8, "background_retrain": False, "seed": 0}
+
+
+def test_recall_counts_tied_hits_as_correct():
+    rng = np.random.default_rng(1)
+    # Every vector has 19 exact duplicates, so top-k results are full of ties.
+    base = rng.normal(size=(20, 8))
+    vector_ids = [f"v{i}" for i in range(400)]
+    index = AutoIndex(flat_max=100, min_ann=50, ann="ivf", ann_params=IVF_PARAMS, sample_every=1)
+    for i, vector_id in enumerate(vector_ids):
+        index.add_vector(base[i % 20].tolist(), vector_id)
+
+    index.begin_build("ivf", IVF_PARAMS, len(vector_ids))
+    fresh = create_index("ivf", IVF_PARAMS)
+    for i, vector_id in enumerate(vector_ids):
+        fresh.add_vector(base[i % 20].tolist(), vector_id)
+    index.finish_build(fresh)
+    index.serving = (fresh, {"nprobe": 8})  # Every list probed: the search is exact
+
+    for query in base[:10]:
+        index.search(query.tolist(), 5)
+    index.measure_recall(lambda: vector_ids)
+    assert index.recall == 1.0
+    assert index.plan() is None
+    assert index.serving[1] == {"nprobe": 8}
+
+
+def test_index_manager_carries_on_past_a_failing_library(open_db, caplog):
+    db = open_db()
+    params = {"flat_max": 20, "min_ann": 10}
+    libraries = [db.create_library(name, index_type="auto", index_params=params) for name in ("broken", "healthy")]
+    for library_id in libraries:
+        document_id = db.create_document(library_id, "document")
+        db.create_chunks(document_id, [{"content": f"chunk {i}"} for i in range(30)])
+    broken, healthy = (db.vector_indexes[library_id] for library_id in libraries)
+
+    def measure_recall(vector_ids):
+        raise RuntimeError("broken")
+
+    broken.measure_recall = measure_recall
+    db.manage_indexes()
+    assert broken.engine == "flat" and broken.build is None
+    assert healthy.engine == "hnsw"
+    assert f"Managing the index of library {libraries[0]} failed" in caplog.text
+
+    del broken.measure_recall
+    db.manage_indexes()
+    assert broken.engine == "hnsw"
@@ -0,0 +1,44 @@
+import re
+
+from fastapi.testclient import TestClient
+
+from app.services.embedding import LocalEmbedder
+from app.services.embedding_cache import CachedEmbedder, EmbeddingCache
+from main import app
+
+
+def scrape():
+    """The embedding cache samples of ``/metrics``, by name and labels."""
+    text = TestClient(app).get("/metrics").text
+    return {
+        name: float(value)
+        for name, value in re.findall(r"^(vectordb_embedding_cache_\S+) (\S+)$", text, flags=re.MULTILINE)
+    }
+
+
+def test_lookups_and_size_are_exported(tmp_path):
+    before = scrape()
+    # Room for three 16-dimensional vectors in memory.
+    cache = EmbeddingCache(max_bytes=3 * (16 * 4 + 200), disk_path=str(tmp_path / "embeddings.sqlite"))
+    embedder = CachedEmbedder(LocalEmbedder(), cache)
+
+    embedder.embed(["a", "b", "c", "d"])
+    embedder.embed(["c", "d", "a", "e"])
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (2, 1, 5)
+    assert stats["entries"] == 3 and stats["evictions"] == 3
+    after = scrape()
+
+    def added(sample):
+        return after.get(sample, 0) - before.get(sample, 0)
+
+    assert added('vectordb_embedding_cache_requests_total{result="hit"}') == 2
+    assert added('vectordb_embedding_cache_requests_total{result="disk_hit"}') == 1
+    assert added('vectordb_embedding_cache_requests_total{result="miss"}') == 5
+    assert added("vectordb_embedding_cache_evictions_total") == 3
+    assert after["vectordb_embedding_cache_entries"] == 3
+    assert after["vectordb_embedding_cache_bytes"] == stats["bytes"]
+
+    cache.clear()
+    assert scrape()["vectordb_embedding_cache_entries"] == 0
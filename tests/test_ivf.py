@@ -0,0 +1,61 @@
+import numpy as np
+
+from app.core.indexing.inf import IVFIndex, _IVFState, _IVFView
+
+
+def trained_index(n=300, dim=16, **params):
+    rng = np.random.default_rng(0)
+    index = IVFIndex(train_size=200, background_retrain=False, seed=0, **params)
+    vectors = rng.normal(size=(n, dim))
+    for i, vector in enumerate(vectors):
+        index.add_vector(vector.tolist(), f"v{i}")
+    assert isinstance(index.snapshot(), _IVFView)
+    return index, vectors, rng
+
+
+def test_returns_k_hits_when_the_probed_lists_hold_fewer():
+    index, _, rng = trained_index(n_clusters=64, nprobe=1)
+    for query in rng.normal(size=(50, 16)):
+        assert len(index.search(query.tolist(), k=20)) == 20
+
+
+def test_returns_every_vector_left_after_removals():
+    index, vectors, _ = trained_index(n_clusters=16, nprobe=2)
+    for i in range(290):
+        index.remove_vector(f"v{i}")
+    hits = index.search(vectors[0].tolist(), k=20)
+    assert sorted(vector_id for vector_id, _ in hits) == sorted(f"v{i}" for i in range(290, 300))
+    assert len(index.search(vectors[0].tolist(), k=5)) == 5
+
+
+def test_removals_after_the_view_was_taken_are_topped_up():
+    index, vectors, _ = trained_index(n_clusters=8, nprobe=8)
+    view = index.snapshot()
+    exact = [vector_id for vector_id, _ in index.search(vectors[3].tolist(), k=10)]
+    for vector_id in exact[:4]:
+        index.remove_vector(vector_id)
+    # As a search that took its view just before the removals sees it.
+    index._view = (index.version, view)
+    hits = index.search(vectors[3].tolist(), k=10)
+    assert len(hits) == 10
+    assert not {vector_id for vector_id, _ in hits} & set(exact[:4])
+
+
+def test_views_are_immutable_across_removes_and_adds():
+    centroids = np.eye(2, dtype=np.float32)
+    state = _IVFState(centroids, capacity=16)
+    vectors = np.array([[1.0, i / 10] for i in range(10)], dtype=np.float32)
+    for i in range(8):
+        state.add(i, vectors[i])
+    view = state.snapshot()
+    ids, stored, size = view.lists[0]
+    ids, stored = ids[:size].copy(), stored[:size].copy()
+
+    # Removing the last slot frees it; the next add must not reuse it under the view.
+    state.remove(7)
+    state.add(8, vectors[8])
+    state.remove(0)
+    state.add(9, vectors[9])
+    assert view.lists[0][2] == size == 8
+    assert np.array_equal(view.lists[0][0][:size], ids)
+    assert np.array_equal(view.lists[0][1][:size], stored)
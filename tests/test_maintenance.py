@@ -0,0 +1,54 @@
+import time
+
+
+def churned_library(db, name):
+    """A library whose index has piled up enough deletes to need compaction."""
+    library_id = db.create_library(name, index_type="hnsw", index_params={"compact_threshold": 0.1})
+    document_id = db.create_document(library_id, "document")
+    chunk_ids = db.create_chunks(document_id, [{"content": f"{name} chunk {i}"} for i in range(30)])
+    for chunk_id in chunk_ids[:10]:
+        db.delete_chunk(chunk_id)
+    return library_id
+
+
+def test_compaction_carries_on_past_a_failed_rebuild(open_db, caplog):
+    db = open_db()
+    broken, healthy = churned_library(db, "broken"), churned_library(db, "healthy")
+    broken_index, healthy_index = db.vector_indexes[broken], db.vector_indexes[healthy]
+    assert broken_index.needs_compaction and healthy_index.needs_compaction
+
+    def rebuild():
+        raise MemoryError("out of memory")
+
+    broken_index.rebuild = rebuild
+    db.compact()
+    assert db.vector_indexes[broken] is broken_index
+    assert db.vector_indexes[healthy] is not healthy_index
+    assert not db.vector_indexes[healthy].needs_compaction
+    assert f"Compacting the index of library {broken} failed" in caplog.text
+
+    # The failed library is tried again on the next pass.
+    del broken_index.rebuild
+    db.compact()
+    assert db.vector_indexes[broken] is not broken_index
+    assert len(db.search_chunks(broken, db.embedder.embed(["broken chunk"])[0], k=50)) == 20
+
+
+def test_compactor_thread_survives_failed_rebuilds(open_db):
+    db = open_db(compact_interval=0.02)
+    calls = []
+
+    def rebuild():
+        calls.append(True)
+        raise OSError("transient")
+
+    library_id = db.create_library("broken", index_type="hnsw", index_params={"compact_threshold": 0.1})
+    db.vector_indexes[library_id].rebuild = rebuild
+    document_id = db.create_document(library_id, "document")
+    for chunk_id in db.create_chunks(document_id, [{"content": f"chunk {i}"} for i in range(30)])[:10]:
+        db.delete_chunk(chunk_id)
+    deadline = time.monotonic() + 10
+    while len(calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert len(calls) >= 3
+    assert db._compactor.is_alive()
@@ -0,0 +1,182 @@
+import json
+import math
+import random
+
+import numpy as np
+import pytest
+
+from app.core.records import CHUNK_SCHEMA, DOCUMENT_SCHEMA, RecordTable
+
+DIM = 4
+
+
+def canonical(records):
+    """Records in a comparable form: embeddings as lists, NaN kept (stdlib json writes it)."""
+
+    def default(value):
+        if hasattr(value, "tolist"):
+            return value.tolist()
+        return repr(value)
+
+    return [json.dumps(record, sort_keys=True, default=default) for record in records]
+
+
+def chunk(number, rng):
+    record = {
+        "id": f"c{number}",
+        "document_id": f"d{rng.randrange(5)}",
+        "library_id": f"l{rng.randrange(2)}",
+        "content": rng.choice(["", "plain text", "ünïcödé ✓", "x" * 300]) + str(number),
+        "metadata": rng.choice(
+            [{}, {"n": number}, {"tags": ["a", "b"], "nested": {"deep": [1, 2.5, None]}}, {"n": number, "ok": True}]
+        ),
+        "created_at": "2025-01-02T03:04:05.123456+00:00",
+        "embedding": np.asarray([rng.random() for _ in range(DIM)], dtype=np.float32),
+    }
+    # Values the columns cannot hold as such, which must still read back unchanged.
+    odd = rng.randrange(12)
+    if odd == 0:
+        record["created_at"] = "2025-01-02T03:04:05+02:00"
+    elif odd == 1:
+        record["metadata"] = None
+    elif odd == 2:
+        record["metadata"] = {"x": float("nan"), "y": [float("inf")]}
+    elif odd == 3:
+        record["extra_field"] = {"kept": number}
+    elif odd == 4:
+        del record["metadata"]
+    elif odd == 5:
+        record["metadata"] = {1: "non-string key"}
+    elif odd == 6:
+        record["document_id"] = None
+    return record
+
+
+@pytest.mark.parametrize("compact_threshold", [0.05, 0.25, 1.0])
+def test_behaves_like_a_dict_of_records(compact_threshold):
+    rng = random.Random(compact_threshold)
+    table = RecordTable(CHUNK_SCHEMA, compact_threshold=compact_threshold)
+    expected = {}
+    for step in range(3000):
+        number = rng.randrange(400)
+        record_id = f"c{number}"
+        operation = rng.random()
+        if operation < 0.6:
+            record = chunk(number, rng)
+            table[record_id] = record
+            expected[record_id] = record
+        elif operation < 0.8:
+            assert canonical([table.pop(record_id, None)]) == canonical([expected.pop(record_id, None)])
+        elif record_id in expected:
+            del table[record_id]
+            del expected[record_id]
+        else:
+            with pytest.raises(KeyError):
+                del table[record_id]
+
+        if step % 250 == 0:
+            assert len(table) == len(expected)
+            assert list(table) == list(expected)
+            assert canonical(table.values()) == canonical(expected.values())
+            assert [record_id for record_id, _ in table.items()] == list(expected)
+
+    assert canonical(table[record_id] for record_id in expected) == canonical(expected.values())
+    assert all(record_id in table for record_id in expected)
+    assert "missing" not in table and table.get("missing") is None and table.get("missing", 1) == 1
+    with pytest.raises(KeyError):
+        table["missing"]
+    with pytest.raises(KeyError):
+        table.pop("missing")
+    assert dict(table.column("document_id")) == {
+        record_id: record.get("document_id") for record_id, record in expected.items()
+    }
+    vectors = table.vectors(list(expected) + ["missing"])
+    assert vectors[-1] is None
+    for vector, record in zip(vectors, expected.values()):
+        assert np.array_equal(vector, record["embedding"])
+
+
+def test_compaction_drops_superseded_rows():
+    table = RecordTable(DOCUMENT_SCHEMA, compact_threshold=0.25)
+    for round_ in range(20):
+        for number in range(100):
+            table[f"d{number}"] = {
+                "id": f"d{number}",
+                "library_id": f"l{round_}",
+                "title": f"title {round_}",
+                "metadata": {f"round {round_}": round_},
+                "created_at": "2025-01-02T03:04:05+00:00",
+            }
+    state = table._state
+    assert len(state.ids) < 100 / 0.75 + 1
+    # Interned library ids and metadata keys only superseded rows used are dropped as well.
+    assert set(state.strings) <= {"l18", "l19"} and set(state.keys) <= {("round 18",), ("round 19",)}
+    assert table["d7"]["title"] == "title 19" and table["d7"]["metadata"] == {"round 19": 19}
+
+
+def test_records_are_snapshots_of_their_row():
+    table = RecordTable(CHUNK_SCHEMA)
+    record = chunk(1, random.Random(0))
+    table["c1"] = record
+    read = table["c1"]
+    read["metadata"] = {"changed": True}
+    record["content"] = "changed after the write"
+    assert table["c1"]["content"] != "changed after the write"
+    assert table["c1"]["metadata"] != {"changed": True}
+    assert table.view("c1", skip=("metadata", "embedding")).keys() == set(record) - {"metadata", "embedding"}
+
+
+def test_freeze_ignores_rows_written_while_its_columns_are_gathered():
+    table = RecordTable(CHUNK_SCHEMA)
+    rng = random.Random(2)
+    for number in range(10):
+        table[f"c{number}"] = {**chunk(number, rng), "extra_field": number}
+    frozen = table.freeze()
+    # As a write in progress leaves it: the row's extras are recorded, its id not yet.
+    table._state.extras[len(table._state.ids)] = {"extra_field": "in flight"}
+
+    restored = RecordTable.restore(frozen.columns(), None)
+    assert [restored.view(record_id, skip=("embedding",))["extra_field"] for record_id in restored] == list(range(10))
+
+
+def test_freeze_restore_and_adopt(tmp_path):
+    rng = random.Random(1)
+    table = RecordTable(CHUNK_SCHEMA)
+    expected = {}
+    for number in range(300):
+        record = chunk(number, rng)
+        table[record["id"]] = expected[record["id"]] = record
+    for number in range(0, 300, 3):
+        table.pop(f"c{number}")
+        expected.pop(f"c{number}")
+
+    frozen = table.freeze()
+    # Writes made after the freeze are not part of it, and survive adoption.
+    late = chunk(1000, rng)
+    table["c1000"] = late
+    table.pop("c1")
+    expected_now = {**expected, "c1000": late}
+    expected_now.pop("c1")
+
+    path = tmp_path / "vectors.f32"
+    with open(path, "wb") as f:
+        rows = frozen.write_vectors(f)
+    vectors = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, frozen.dim)) if rows else None
+
+    restored = RecordTable.restore(frozen.columns(), vectors)
+    assert list(restored) == list(expected)
+    assert canonical(restored.values()) == canonical(expected.values())
+
+    table.adopt(frozen, vectors)
+    assert canonical(table.values()) == canonical(expected_now.values())
+    embedding = table.vectors(["c2"])[0]
+    assert isinstance(embedding, np.memmap)
+    assert table._state.tail_size == 1  # Only the vector written after the freeze stays in memory
+
+    # A restored table takes writes and compacts like any other.
+    rewritten = {f"c{number}" for number in range(2, 300, 3)}
+    for record_id in rewritten:
+        restored[record_id] = {**expected[record_id], "content": "rewritten"}
+    assert len(restored._state.ids) < 300
+    assert all((record["content"] == "rewritten") == (record["id"] in rewritten) for record in restored.values())
+    assert any(math.isnan((record.get("metadata") or {}).get("x", 0)) for record in restored.values())
@@ -0,0 +1,87 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.result_cache import get_result_cache
+from app.core.v_db import set_db
+from app.services.embedding import LocalEmbedder
+from main import app
+
+
+@pytest.fixture
+def client(open_db):
+    set_db(open_db())
+    get_result_cache().clear()
+    try:
+        with TestClient(app) as client:
+            yield client
+    finally:
+        set_db(None)
+
+
+@pytest.fixture
+def library_id(client):
+    library_id = client.post("/v1/library/", json={"name": "library", "index_type": "flat"}).json()["id"]
+    document_id = client.post("/v1/documnet/", json={"library_id": library_id, "title": "document"}).json()["id"]
+    chunks = [{"content": f"chunk number {i}", "metadata": {"i": i}} for i in range(5)]
+    client.post("/v1/chunk/bulk", json={"document_id": document_id, "chunks": chunks})
+    return library_id
+
+
+@pytest.mark.parametrize("k", [0, -1, 1001])
+def test_k_out_of_bounds_is_rejected(client, library_id, k):
+    response = client.post("/v1/chunk/search", json={"library_id": library_id, "query": "chunk", "k": k})
+    assert response.status_code == 422
+    queries = [{"library_id": library_id, "query": "chunk", "k": size} for size in (1, k)]
+    assert client.post("/v1/chunk/search/batch", json={"queries": queries}).status_code == 422
+    assert get_result_cache().stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("k,found", [(1, 1), (3, 3), (1000, 5)])
+def test_k_within_bounds_returns_min_k_n_hits(client, library_id, k, found):
+    response = client.post("/v1/chunk/search", json={"library_id": library_id, "query": "chunk", "k": k})
+    assert response.status_code == 200
+    assert len(response.json()) == found
+
+
+def test_raw_responses_write_records_as_the_response_models_do(client, library_id):
+    query = {"library_id": library_id, "query": "number 3", "k": 1}
+    search = client.post("/v1/chunk/search", json=query)
+    chunk_id = search.json()[0]["chunk"]["id"]
+    modelled = client.get(f"/v1/chunk/{chunk_id}")
+    created_at = modelled.json()["created_at"]
+    assert created_at.endswith("Z")
+
+    batch = client.post("/v1/chunk/search/batch", json={"queries": [query]})
+    for response in (search, batch):
+        # The same chunk object, byte for byte, inside the hit.
+        assert b'{"chunk":' + modelled.content + b',"score":' in response.content
+
+    projected = client.post("/v1/chunk/search", json={**query, "fields": ["created_at"]})
+    assert projected.json()[0]["created_at"] == created_at
+    page = client.get("/v1/chunk/", params={"library_id": library_id, "fields": "created_at"}).json()
+    assert {item["id"]: item["created_at"] for item in page["items"]}[chunk_id] == created_at
+    lines = client.get("/v1/chunk/", params={"library_id": library_id, "format": "ndjson"}).text.splitlines()
+    assert f'"created_at":"{created_at}"' in next(line for line in lines if chunk_id in line)
+
+
+def test_queries_are_embedded_with_the_databases_embedder(open_db, tmp_path):
+    # A different model than the process-wide default the app would otherwise use.
+    set_db(open_db(tmp_path / "other", embedder=LocalEmbedder(dim=24)))
+    try:
+        with TestClient(app) as client:
+            get_result_cache().clear()
+            library_id = client.post("/v1/library/", json={"name": "library", "index_type": "flat"}).json()["id"]
+            document = client.post("/v1/documnet/", json={"library_id": library_id, "title": "document"}).json()
+            chunks = [{"content": f"chunk number {i}", "metadata": {"i": i}} for i in range(5)]
+            client.post("/v1/chunk/bulk", json={"document_id": document["id"], "chunks": chunks})
+
+            for mode in ("vector", "hybrid"):
+                query = {"library_id": library_id, "query": "number 3", "k": 1, "mode": mode}
+                search = client.post("/v1/chunk/search", json=query)
+                assert search.status_code == 200
+                assert search.json()[0]["chunk"]["content"] == "chunk number 3"
+                batch = client.post("/v1/chunk/search/batch", json={"queries": [query]})
+                assert batch.status_code == 200
+                assert batch.json()[0][0]["chunk"]["content"] == "chunk number 3"
+    finally:
+        set_db(None)
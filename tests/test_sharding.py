@@ -0,0 +1,176 @@
+import json
+import threading
+
+import pytest
+
+from app.core.sharding import ShardedVectorDB
+
+QUERIES = ["topic 1 item", "topic 4", "item 17 topic 3"]
+
+
+@pytest.fixture
+def open_sharded(tmp_path, embedder):
+    opened = []
+
+    def open_sharded(n_shards=2, **kwargs):
+        db = ShardedVectorDB(n_shards, str(tmp_path / "sharded"), rebalance_interval=0, embedder=embedder, **kwargs)
+        opened.append(db)
+        return db
+
+    yield open_sharded
+    for db in opened:
+        db.close()
+
+
+def fill(db, library_id, chunks, documents=4, offset=0):
+    document_ids = [db.create_document(library_id, f"document {i}") for i in range(documents)]
+    for number, document_id in enumerate(document_ids):
+        db.create_chunks(
+            document_id,
+            [
+                {"content": f"topic {i % 7} item {i}", "metadata": {"topic": i % 7}}
+                for i in range(offset + number, offset + chunks, documents)
+            ],
+        )
+    return document_ids
+
+
+def hits(db, library_id, k=10, lexical=True):
+    """Vector, filtered and (with ``lexical``) BM25 rankings for every query."""
+    found = []
+    for query in QUERIES:
+        embedding = db.embedder.embed([query])[0]
+        found.append(ranking(db.search_chunks(library_id, embedding, k=k)))
+        found.append(ranking(db.search_chunks(library_id, embedding, k=k, filters={"metadata": {"topic": 3}})))
+        if lexical:
+            found.append(ranking(db.lexical_search_chunks(library_id, query, k=k)))
+    return found
+
+
+def ranking(results):
+    """The scores of ``results``, and the chunks ranked above the last score:
+    how chunks tied with it are ordered, or cut off, depends on the shard layout."""
+    scores = [round(score, 5) for _, score in results]
+    return scores, sorted(chunk["content"] for chunk, score in results if round(score, 5) > scores[-1])
+
+
+def shard_sizes(db):
+    return [shard.call("library_sizes") for shard in db.shards]
+
+
+def test_sharded_search_matches_a_single_database(open_sharded, open_db, tmp_path):
+    sharded = open_sharded()
+    single = open_db(tmp_path / "single")
+    libraries = []
+    for name in ("first", "second", "third"):
+        library_ids = [db.create_library(name, index_type="flat") for db in (sharded, single)]
+        for db, library_id in zip((sharded, single), library_ids):
+            fill(db, library_id, 40)
+        libraries.append(library_ids)
+
+    assert sorted(len(placed) for placed in sharded.placement.values()) == [1, 1, 1]
+    assert {placed[0] for placed in sharded.placement.values()} == {0, 1}
+    for sharded_id, single_id in libraries:
+        assert hits(sharded, sharded_id) == hits(single, single_id)
+        assert len(sharded.get_library(sharded_id)["documents"]) == 4
+
+    queries = [
+        {"library_id": sharded_id, "query_embedding": sharded.embedder.embed([query])[0], "k": 5, "mode": "vector"}
+        for sharded_id, _ in libraries
+        for query in QUERIES
+    ]
+    batch = sharded.search_chunks_batch(queries)
+    for query, results in zip(queries, batch):
+        expected = sharded.search_chunks(query["library_id"], query["query_embedding"], k=5)
+        assert [chunk["id"] for chunk, _ in results] == [chunk["id"] for chunk, _ in expected]
+
+
+def test_rebalance_partitions_a_large_library(open_sharded):
+    db = open_sharded(partition_chunks=30)
+    library_id = db.create_library("large", index_type="flat")
+    document_ids = fill(db, library_id, 60, documents=8)
+    before = hits(db, library_id, lexical=False)
+    matches = [chunk["id"] for chunk, _ in db.lexical_search_chunks(library_id, "item 17", k=1)]
+
+    db.rebalance()
+    assert sorted(db.placement[library_id]) == [0, 1]
+    held = [sizes.get(library_id, 0) for sizes in shard_sizes(db)]
+    assert sum(held) == 60 and all(held)
+    assert hits(db, library_id, lexical=False) == before
+    # BM25 scores use each shard's own term statistics, so only the best match is compared.
+    assert [chunk["id"] for chunk, _ in db.lexical_search_chunks(library_id, "item 17", k=1)] == matches
+    documents = db.get_library(library_id, expand="documents")["documents"]
+    assert sorted(document["id"] for document in documents) == sorted(document_ids)
+
+    # New documents and chunks land on the shard their document id hashes to, and are searchable.
+    fill(db, library_id, 10, documents=2, offset=60)
+    assert sum(sizes.get(library_id, 0) for sizes in shard_sizes(db)) == 70
+    assert len(db.search_chunks(library_id, db.embedder.embed(["topic 1"])[0], k=100)) == 70
+
+
+def test_rebalance_moves_libraries_to_the_less_loaded_shard(open_sharded):
+    db = open_sharded()
+    libraries = [db.create_library(f"library {i}", index_type="flat") for i in range(4)]
+    # Libraries 0 and 2 share a shard, 1 and 3 the other; only the first shard gets data.
+    for library_id, chunks in zip(libraries, (40, 0, 10, 0)):
+        if chunks:
+            fill(db, library_id, chunks)
+    loaded = db.placement[libraries[0]][0]
+    assert db.placement[libraries[2]] == [loaded]
+    before = {library_id: hits(db, library_id) for library_id in libraries}
+
+    db.rebalance()
+    loads = [sum(sizes.values()) for sizes in shard_sizes(db)]
+    assert sorted(loads) == [10, 40]
+    assert {library_id: hits(db, library_id) for library_id in libraries} == before
+
+
+def test_placement_survives_a_restart(open_sharded):
+    db = open_sharded(partition_chunks=30)
+    partitioned = db.create_library("partitioned", index_type="flat")
+    fill(db, partitioned, 60, documents=8)
+    db.rebalance()
+    single = db.create_library("single", index_type="flat")
+    fill(db, single, 12)
+    placement = {library_id: sorted(placed) for library_id, placed in db.placement.items()}
+    expected = {library_id: hits(db, library_id) for library_id in placement}
+    db.save_to_disk()
+    db.close()
+
+    reopened = open_sharded(partition_chunks=30)
+    assert {library_id: sorted(placed) for library_id, placed in reopened.placement.items()} == placement
+    assert {library_id: hits(reopened, library_id) for library_id in placement} == expected
+
+
+def test_placement_is_recovered_from_the_shards(open_sharded, tmp_path):
+    db = open_sharded(partition_chunks=30)
+    partitioned = db.create_library("partitioned", index_type="flat")
+    fill(db, partitioned, 60, documents=8)
+    db.rebalance()
+    single = db.create_library("single", index_type="flat")
+    fill(db, single, 12)
+    placement = {library_id: sorted(placed) for library_id, placed in db.placement.items()}
+    expected = {library_id: hits(db, library_id) for library_id in placement}
+    db.close()
+
+    # As a crash between a shard write and the placement update leaves it: the shards hold more than it records.
+    path = tmp_path / "sharded" / "placement.json"
+    saved = json.loads(path.read_text())
+    saved["libraries"] = {partitioned: saved["libraries"][partitioned][:1]}
+    path.write_text(json.dumps(saved))
+
+    reopened = open_sharded(partition_chunks=30)
+    assert {library_id: sorted(placed) for library_id, placed in reopened.placement.items()} == placement
+    assert {library_id: hits(reopened, library_id) for library_id in placement} == expected
+
+
+def test_failed_calls_do_not_use_up_connections(open_sharded):
+    db = open_sharded(n_shards=1, connections=2)
+    shard = db.shards[0]
+    for _ in range(5):
+        with pytest.raises(TypeError):
+            shard.call("get_library", threading.Lock())  # The request does not pickle
+        with pytest.raises(ValueError):
+            shard.call("create_library", "bad", None, "no such index", None)
+    library_id = db.create_library("still served", index_type="flat")
+    assert db.get_library(library_id, expand="none")["name"] == "still served"
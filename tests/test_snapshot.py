@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from app.core.indexing import INDEX_TYPES
+
+INDEXES = [
+    ("flat", {}),
+    ("hnsw", {"seed": 0}),
+    ("ivf", {"train_size": 64, "n_clusters": 4, "background_retrain": False, "seed": 0}),
+    ("lsh", {"seed": 0}),
+    ("quantized", {"train_size": 64, "seed": 0}),
+    ("quantized", {"quantizer": "pq", "m": 4, "train_size": 64, "seed": 0}),
+    ("auto", {"flat_max": 50, "min_ann": 20}),
+]
+QUERIES = ["topic 1 item", "topic 3", "item 42 topic 6", "unrelated words"]
+
+
+def populate(db, index_type, params, n=120):
+    library_id = db.create_library("library", {"team": "search"}, index_type=index_type, index_params=params)
+    document_id = db.create_document(library_id, "document")
+    chunk_ids = db.create_chunks(
+        document_id,
+        [{"content": f"topic {i % 7} item {i}", "metadata": {"topic": i % 7, "i": i}} for i in range(n)],
+    )
+    for chunk_id in chunk_ids[:5]:
+        db.delete_chunk(chunk_id)
+    for chunk_id in chunk_ids[5:10]:
+        db.update_chunk(chunk_id, "rewritten topic 2", {"topic": 2, "rewritten": True})
+    return library_id, document_id
+
+
+def results(db, library_id):
+    """Vector, filtered, lexical and hybrid hits for every query, as (id, score) pairs."""
+    found = []
+    for query in QUERIES:
+        embedding = db.embedder.embed([query])[0]
+        for hits in (
+            db.search_chunks(library_id, embedding, k=10),
+            db.search_chunks(library_id, embedding, k=10, filters={"metadata": {"topic": {"in": [1, 2]}}}),
+            db.lexical_search_chunks(library_id, query, k=10),
+            db.hybrid_search_chunks(library_id, query, embedding, k=10),
+        ):
+            found.append([(chunk["id"], round(score, 5)) for chunk, score in hits])
+    return found
+
+
+def records(db):
+    return (
+        [db.get_library(library_id, expand="none") for library_id in db.libraries],
+        [db.get_document(document_id, expand="none") for document_id in db.documents],
+        {
+            chunk["id"]: {**chunk, "embedding": np.asarray(chunk["embedding"]).tolist()}
+            for chunk in db.chunks.values()
+        },
+    )
+
+
+@pytest.mark.parametrize("index_type,params", INDEXES, ids=[f"{t}-{p.get('quantizer', '')}" for t, p in INDEXES])
+def test_snapshot_round_trip(open_db, tmp_path, index_type, params):
+    db = open_db(tmp_path)
+    library_id, document_id = populate(db, index_type, params)
+    if index_type == "auto":
+        db.manage_indexes()
+        assert db.vector_indexes[library_id].engine == "hnsw"
+    db.save_to_disk()
+    expected_records, expected_results = records(db), results(db, library_id)
+    engine = type(db.vector_indexes[library_id])
+    db.close()
+
+    reloaded = open_db(tmp_path)
+    assert type(reloaded.vector_indexes[library_id]) is engine is INDEX_TYPES[index_type]
+    if index_type == "auto":
+        assert reloaded.vector_indexes[library_id].engine == "hnsw"
+    assert records(reloaded) == expected_records
+    assert results(reloaded, library_id) == expected_results
+    # Embeddings are served from the snapshot's map rather than loaded into memory.
+    chunk_id = next(iter(reloaded.chunks))
+    assert isinstance(reloaded.chunks.vectors([chunk_id])[0], np.memmap)
+
+    # Writes on top of a loaded snapshot go through a second checkpoint as well.
+    reloaded.create_chunks(document_id, [{"content": f"topic 1 late {i}", "metadata": {"topic": 1}} for i in range(10)])
+    reloaded.delete_chunk(chunk_id)
+    reloaded.save_to_disk()
+    expected_records, expected_results = records(reloaded), results(reloaded, library_id)
+    reloaded.close()
+
+    again = open_db(tmp_path)
+    assert records(again) == expected_records
+    assert results(again, library_id) == expected_results
+
+
+def test_snapshot_of_an_empty_database(open_db, tmp_path):
+    db = open_db(tmp_path)
+    library_id = db.create_library("empty", index_type="flat")
+    db.save_to_disk()
+    db.close()
+
+    reloaded = open_db(tmp_path)
+    assert reloaded.get_library(library_id, expand="none")["name"] == "empty"
+    assert reloaded.search_chunks(library_id, np.ones(16), k=3) == []
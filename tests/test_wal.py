@@ -0,0 +1,165 @@
+import errno
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.core import v_db
+from app.core.wal import WriteAheadLog
+
+
+def crash_image(db, tmp_path):
+    """The storage directory as a crash would leave it: a copy taken while
+    ``db`` is still open, so nothing after the last commit is flushed by close."""
+    image = tmp_path / "crashed"
+    shutil.copytree(db.storage_path, image)
+    return image
+
+
+def chunk_state(db):
+    return {
+        chunk["id"]: {**chunk, "embedding": np.asarray(chunk["embedding"]).tolist()} for chunk in db.chunks.values()
+    }
+
+
+def populate(db):
+    library_id = db.create_library("library", index_type="flat")
+    document_id = db.create_document(library_id, "document", {"kind": "notes"})
+    chunk_ids = db.create_chunks(
+        document_id, [{"content": f"chunk number {i}", "metadata": {"i": i}} for i in range(10)]
+    )
+    return library_id, document_id, chunk_ids
+
+
+def test_log_replays_records_of_sealed_segments(tmp_path):
+    wal = WriteAheadLog(tmp_path)
+    wal.commit(wal.append({"op": "put", "n": 1}))
+    segment = wal.rotate()
+    wal.commit(wal.append({"op": "put", "n": 2}))
+    wal.close()
+
+    reopened = WriteAheadLog(tmp_path)
+    try:
+        assert [record["n"] for record in reopened.replay()] == [1, 2]
+        assert [record["n"] for record in reopened.replay(from_segment=segment)] == [2]
+    finally:
+        reopened.close()
+
+
+def test_failed_write_is_reported_and_retried(tmp_path, monkeypatch):
+    wal = WriteAheadLog(tmp_path)
+    disk_full = threading.Event()
+    disk_full.set()
+    fsync = os.fsync
+
+    def failing_fsync(fd):
+        if disk_full.is_set():
+            raise OSError(errno.ENOSPC, "No space left on device")
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+    try:
+        with pytest.raises(RuntimeError, match="No space left on device"):
+            wal.commit(wal.append({"op": "put", "n": 1}))
+        assert wal._flusher.is_alive()
+        # Once the disk is back the failed batch is written, once, ahead of later records.
+        disk_full.clear()
+        wal.commit(wal.append({"op": "put", "n": 2}))
+    finally:
+        wal.close()
+
+    reopened = WriteAheadLog(tmp_path)
+    try:
+        assert [record["n"] for record in reopened.replay()] == [1, 2]
+    finally:
+        reopened.close()
+
+
+def test_replays_writes_made_since_the_last_checkpoint(open_db, tmp_path):
+    db = open_db(tmp_path / "db")
+    library_id, document_id, chunk_ids = populate(db)
+    db.save_to_disk()
+
+    db.update_chunk(chunk_ids[0], "rewritten content", {"i": 0, "edited": True})
+    db.update_chunk(chunk_ids[1], "chunk number 1", {"i": 1}, embedding=np.ones(16))
+    db.delete_chunk(chunk_ids[2])
+    added = db.create_chunk(document_id, "added after the checkpoint", {"late": True})
+    db.update_library(library_id, "renamed", {"owner": "me"})
+    second = db.create_document(library_id, "second")
+    db.delete_document(second)
+
+    recovered = open_db(crash_image(db, tmp_path))
+    assert chunk_state(recovered) == chunk_state(db)
+    assert chunk_ids[2] not in recovered.chunks
+    assert recovered.get_chunk(added)["metadata"] == {"late": True}
+    assert recovered.get_library(library_id)["name"] == "renamed"
+    assert recovered.get_document(second) is None
+
+    query = db.get_chunk(chunk_ids[5])["embedding"]
+    expected = [(chunk["id"], score) for chunk, score in db.search_chunks(library_id, query, k=5)]
+    assert [(chunk["id"], score) for chunk, score in recovered.search_chunks(library_id, query, k=5)] == expected
+
+
+def test_replays_the_whole_log_without_a_checkpoint(open_db, tmp_path):
+    db = open_db(tmp_path / "db")
+    library_id, _, chunk_ids = populate(db)
+    db.delete_chunk(chunk_ids[-1])
+
+    recovered = open_db(crash_image(db, tmp_path))
+    assert chunk_state(recovered) == chunk_state(db)
+    assert len(recovered.search_chunks(library_id, db.get_chunk(chunk_ids[0])["embedding"], k=20)) == 9
+
+
+def test_torn_final_record_is_dropped(open_db, tmp_path):
+    db = open_db(tmp_path / "db")
+    _, document_id, _ = populate(db)
+    db.save_to_disk()
+    db.create_chunk(document_id, "acknowledged", {})
+    expected = chunk_state(db)
+
+    image = crash_image(db, tmp_path)
+    newest = sorted((image / "wal").glob("wal-*.log"))[-1]
+    with open(newest, "ab") as f:
+        f.write(b'{"op":"put","table":"chunks","rec')
+
+    recovered = open_db(image)
+    assert chunk_state(recovered) == expected
+    # Writes after the torn record survive the next restart too.
+    later = recovered.create_chunk(document_id, "written after recovery", {})
+    recovered.close()
+    assert later in open_db(image).chunks
+
+
+def test_checkpoint_covers_the_log_it_truncates(open_db, tmp_path):
+    db = open_db(tmp_path / "db")
+    populate(db)
+    db.save_to_disk()
+    segments = db.wal.segments()
+    assert segments == [db.wal.segment]
+    db.close()
+
+    assert chunk_state(open_db(tmp_path / "db")) == chunk_state(db)
+
+
+def test_failed_checkpoint_is_retried(open_db, tmp_path, monkeypatch):
+    write_snapshot = v_db.write_snapshot
+    failures = []
+
+    def flaky_write_snapshot(*args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise OSError("No space left on device")
+        return write_snapshot(*args, **kwargs)
+
+    monkeypatch.setattr(v_db, "write_snapshot", flaky_write_snapshot)
+    db = open_db(tmp_path / "db", checkpoint_interval=0.05)
+    populate(db)
+
+    deadline = time.monotonic() + 10
+    while not list((tmp_path / "db").glob("snapshot-*")) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert failures
+    assert list((tmp_path / "db").glob("snapshot-*"))